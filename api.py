@@ -0,0 +1,315 @@
+"""Version 1 of the JSON API, under /api/v1.
+
+Covers what the HTML pages show: the home timeline, profiles, messages,
+likes and conversations. Every endpoint selects just the columns it
+returns, so no ORM objects are built, and rows go straight to JSON,
+through orjson when it's installed. A 'fields' query argument picks
+which fields come back (and so which columns are read), e.g.
+``?fields=id,text``.
+
+Lists are newest first and take 'before'/'after' cursors and a 'limit';
+they respond with {items, before, after}, the cursors for the older and
+newer pages (see pagination.py). A conversation's DMs come in windows
+instead, oldest first, as they do for the site's scripts (see dms.py).
+
+Requests are authenticated by the session cookie, as on the site.
+"""
+
+import json
+
+from flask import Blueprint, abort, current_app, g, request
+from sqlalchemy import and_, exists, literal
+from sqlalchemy.orm import aliased
+from werkzeug.exceptions import HTTPException
+
+from models import db, Conversation, DM, InboxEntry, Like, Message, User
+import dms
+import inbox
+import pagination
+import replicas
+import timeline
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAX_PER_PAGE = 200
+
+blueprint = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+def init_app(app):
+    """Serve the API from `app`."""
+
+    app.register_blueprint(blueprint)
+
+
+##############################################################################
+# Serialization
+
+def _default(value):
+    return value.isoformat()
+
+
+def dumps(data):
+    """`data` as compact JSON bytes; datetimes become ISO 8601 strings."""
+
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), default=_default).encode()
+
+
+def respond(data, status=200):
+    return current_app.response_class(dumps(data), status,
+                                      mimetype='application/json')
+
+
+@blueprint.errorhandler(HTTPException)
+def error(e):
+    return respond({'error': e.name}, e.code)
+
+
+##############################################################################
+# Fields
+
+def message_fields():
+    """The fields of a message, as labelled column expressions."""
+
+    if g.user:
+        # Aliased so it isn't correlated with a join to likes.
+        viewer_like = aliased(Like)
+        liked = exists().where(and_(viewer_like.user_id == g.user.id,
+                                    viewer_like.message_id == Message.id))
+    else:
+        liked = literal(False)
+
+    return {
+        'id': Message.id,
+        'text': Message.text,
+        'timestamp': Message.timestamp,
+        'likes_count': Message.likes_count,
+        'user_id': Message.user_id,
+        'username': User.username,
+        'image_url': User.image_url,
+        'liked': liked,
+    }
+
+
+# Fields read from a joined table, which is only joined when one of them
+# is selected.
+AUTHOR_FIELDS = {'username', 'image_url'}
+
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'likes_count': User.likes_count,
+}
+
+CONVERSATION_FIELDS = {
+    'conversation_id': InboxEntry.conversation_id,
+    'last_activity_at': InboxEntry.last_activity_at,
+    'unread_count': InboxEntry.unread_count,
+    'other_user_id': InboxEntry.other_user_id,
+    'other_username': User.username,
+    'other_image_url': User.image_url,
+    'last_dm_text': DM.text,
+}
+
+OTHER_USER_FIELDS = {'other_username', 'other_image_url'}
+LAST_DM_FIELDS = {'last_dm_text'}
+
+DM_FIELDS = {
+    'id': DM.id,
+    'text': DM.text,
+    'author': DM.author,
+    'timestamp': DM.timestamp,
+}
+
+
+def selected(fields, required=()):
+    """(names to return, names to read) for the 'fields' argument.
+
+    `required` fields are read even if they weren't asked for, for
+    paging. Aborts with a 400 on unknown fields.
+    """
+
+    wanted = request.args.get('fields')
+    names = wanted.split(',') if wanted else list(fields)
+    if not set(names) <= fields.keys():
+        abort(400)
+
+    return names, names + [name for name in required if name not in names]
+
+
+def columns(fields, read):
+    return [fields[name].label(name) for name in read]
+
+
+def serialize(rows, names):
+    return [dict(zip(names, row)) for row in rows]
+
+
+def page_args():
+    """(before, after, limit) from the query string."""
+
+    before, after = pagination.cursor_args()
+    limit = dms.int_arg('limit')
+    return before, after, min(limit or pagination.per_page(), MAX_PER_PAGE)
+
+
+def respond_page(page, names):
+    return respond({'items': serialize(page.items, names),
+                    'before': page.before,
+                    'after': page.after})
+
+
+def messages_query(read):
+    """Query selecting the `read` fields of messages, joining their
+    authors only if needed."""
+
+    query = (db.session
+             .query(*columns(message_fields(), read))
+             .select_from(Message))
+    if AUTHOR_FIELDS & set(read):
+        query = query.join(User, User.id == Message.user_id)
+    return query
+
+
+def login_required():
+    if not g.user:
+        abort(401)
+
+
+##############################################################################
+# Endpoints
+
+@blueprint.route('/timeline')
+@replicas.read_only
+def home_timeline():
+    """The logged-in user's home timeline (see timeline.py)."""
+
+    login_required()
+    names, read = selected(message_fields(), ('id', 'timestamp'))
+    before, after, limit = page_args()
+
+    page = timeline.home_timeline(g.user.id, before, after, limit,
+                                  messages=lambda: messages_query(read))
+    return respond_page(page, names)
+
+
+@blueprint.route('/users/<int:user_id>')
+@replicas.read_only
+def user(user_id):
+    names, read = selected(USER_FIELDS)
+
+    row = (db.session
+           .query(*columns(USER_FIELDS, read))
+           .filter(User.id == user_id)
+           .first())
+    if row is None:
+        abort(404)
+    return respond(dict(zip(names, row)))
+
+
+@blueprint.route('/users/<int:user_id>/messages')
+@replicas.read_only
+def user_messages(user_id):
+    names, read = selected(message_fields(), ('id', 'timestamp'))
+    before, after, limit = page_args()
+
+    page = pagination.paginate(
+        messages_query(read).filter(Message.user_id == user_id),
+        Message.timestamp, Message.id, before, after, limit)
+    return respond_page(page, names)
+
+
+@blueprint.route('/users/<int:user_id>/likes')
+@replicas.read_only
+def user_likes(user_id):
+    """The messages `user_id` has liked."""
+
+    names, read = selected(message_fields(), ('id', 'timestamp'))
+    before, after, limit = page_args()
+
+    page = pagination.paginate(
+        (messages_query(read)
+         .join(Like, Like.message_id == Message.id)
+         .filter(Like.user_id == user_id)),
+        Message.timestamp, Message.id, before, after, limit)
+    return respond_page(page, names)
+
+
+@blueprint.route('/messages/<int:message_id>')
+@replicas.read_only
+def message(message_id):
+    names, read = selected(message_fields())
+
+    row = messages_query(read).filter(Message.id == message_id).first()
+    if row is None:
+        abort(404)
+    return respond(dict(zip(names, row)))
+
+
+@blueprint.route('/conversations')
+@replicas.read_only
+def conversations():
+    """The logged-in user's inbox, most recently active first (see
+    inbox.py)."""
+
+    login_required()
+    names, read = selected(CONVERSATION_FIELDS,
+                           ('conversation_id', 'last_activity_at'))
+    before, after, limit = page_args()
+
+    query = (db.session
+             .query(*columns(CONVERSATION_FIELDS, read))
+             .select_from(InboxEntry)
+             .filter(InboxEntry.user_id == g.user.id,
+                     InboxEntry.last_activity_at.isnot(None)))
+    if OTHER_USER_FIELDS & set(read):
+        query = query.join(User, User.id == InboxEntry.other_user_id)
+    if LAST_DM_FIELDS & set(read):
+        query = query.outerjoin(DM, DM.id == InboxEntry.last_dm_id)
+
+    page = pagination.paginate(query,
+                               InboxEntry.last_activity_at,
+                               InboxEntry.conversation_id,
+                               before, after, limit, key=inbox.entry_key)
+    return respond_page(page, names)
+
+
+@blueprint.route('/conversations/<int:conversation_id>/dms')
+@replicas.read_only
+def conversation_dms(conversation_id):
+    """A window of a conversation's DMs, oldest first.
+
+    Takes 'since_id', 'before_id' and 'limit' like the site's list_dms,
+    and responds with {items, has_more}.
+    """
+
+    login_required()
+    participants = (db.session
+                    .query(Conversation.user1_id, Conversation.user2_id)
+                    .filter(Conversation.id == conversation_id)
+                    .first())
+    if participants is None:
+        abort(404)
+    if g.user.id not in participants:
+        abort(403)
+
+    names, read = selected(DM_FIELDS)
+    since_id, before_id, limit = dms.window_args()
+
+    window = dms.window(conversation_id, since_id, before_id, limit,
+                        query=db.session.query(*columns(DM_FIELDS, read)))
+    return respond({'items': serialize(window.items, names),
+                    'has_more': window.has_more})
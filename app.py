@@ -1,11 +1,36 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+import csv
+import time
+
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort, Response, stream_with_context
+from flask.cli import AppGroup
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
-from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm, LikesForm
+from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm, LikesForm, CSRFForm
 from models import db, connect_db, User, Message, Like, Conversation, DM
+import api
+import broker
+import counters
+import follows
+import dms
+import fragments
+import hashing
+import http_cache
+import identity
+import inbox
+import jobs
+import likes
+import membership
+import metrics
+import pagination
+import replicas
+import search
+import suggestions
+import timeline
+import trending
 
 CURR_USER_KEY = "curr_user"
 
@@ -18,11 +43,72 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = (
+    os.environ.get('DB_POOL_PRE_PING', 'on') == 'on')
+# Milliseconds per statement while serving a request; 0 means no limit.
+# CLI commands and the worker always run without one.
+app.config['DB_STATEMENT_TIMEOUT'] = int(
+    os.environ.get('DB_STATEMENT_TIMEOUT', 10000))
+app.config['SQL_SLOW_SECONDS'] = float(
+    os.environ.get('SQL_SLOW_SECONDS', 0.5))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['REPLICA_URLS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if url]
+app.config['READ_YOUR_WRITES_SECONDS'] = int(
+    os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['TIMELINE_MAX_ENTRIES'] = int(
+    os.environ.get('TIMELINE_MAX_ENTRIES', 800))
+app.config['TIMELINE_TRIM_EVERY'] = int(
+    os.environ.get('TIMELINE_TRIM_EVERY', 100))
+app.config['TIMELINE_FANOUT_THRESHOLD'] = int(
+    os.environ.get('TIMELINE_FANOUT_THRESHOLD', 10000))
+app.config['MESSAGES_PER_PAGE'] = int(
+    os.environ.get('MESSAGES_PER_PAGE', 100))
+app.config['DMS_PER_PAGE'] = int(os.environ.get('DMS_PER_PAGE', 50))
+app.config['FOLLOWS_PER_PAGE'] = int(os.environ.get('FOLLOWS_PER_PAGE', 60))
+app.config['FOLLOWS_BULK_MAX'] = int(os.environ.get('FOLLOWS_BULK_MAX', 5000))
+app.config['BROKER'] = os.environ.get('BROKER', 'local')
+app.config['FRAGMENT_CACHE'] = os.environ.get('FRAGMENT_CACHE', 'memory')
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get('FRAGMENT_CACHE_URL')
+app.config['FRAGMENT_CACHE_BYTES'] = int(
+    os.environ.get('FRAGMENT_CACHE_BYTES', 64 * 1024 * 1024))
+app.config['BROKER_URL'] = os.environ.get('BROKER_URL')
+app.config['LIKE_BUFFER_SECONDS'] = float(
+    os.environ.get('LIKE_BUFFER_SECONDS', 0))
+app.config['HOME_MAX_AGE'] = int(os.environ.get('HOME_MAX_AGE', 15))
+app.config['TRENDING_MAX_AGE'] = int(os.environ.get('TRENDING_MAX_AGE', 60))
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(
+    os.environ.get('TRENDING_HALF_LIFE_HOURS', 6))
+app.config['TRENDING_DECAY_MINUTES'] = float(
+    os.environ.get('TRENDING_DECAY_MINUTES', 10))
+app.config['ANON_HOME_MAX_AGE'] = int(
+    os.environ.get('ANON_HOME_MAX_AGE', 300))
+app.config['IDENTITY_CACHE'] = os.environ.get('IDENTITY_CACHE', 'memory')
+app.config['IDENTITY_CACHE_URL'] = os.environ.get('IDENTITY_CACHE_URL')
+app.config['IDENTITY_CACHE_TTL'] = int(
+    os.environ.get('IDENTITY_CACHE_TTL', 60))
+app.config['PASSWORD_HASH_ROUNDS'] = int(
+    os.environ.get('PASSWORD_HASH_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', 2))
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+replicas.init_app(app)
+identity.init_app(app)
+hashing.init_app(app)
+broker.init_app(app)
+fragments.init_app(app)
+http_cache.init_app(app)
+likes.init_app(app)
+metrics.init_app(app)
+api.init_app(app)
 
 
 ##############################################################################
@@ -31,10 +117,13 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user comes from the identity cache when possible (see identity.py).
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = identity.load_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -44,6 +133,7 @@ def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    identity.rotate_version()
 
 
 def do_logout():
@@ -52,6 +142,8 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
+    session.pop(identity.CURR_USER_VERSION_KEY, None)
+
 
 @app.route('/signup', methods=["GET", "POST"])
 def signup():
@@ -81,6 +173,8 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        search.index_user(user)
+
         do_login(user)
 
         return redirect("/")
@@ -100,6 +194,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # Saves the password if authenticate() re-hashed it.
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -109,6 +205,14 @@ def login():
     return render_template('users/login.html', form=form)
 
 
+@app.errorhandler(hashing.HashingBusy)
+def hashing_busy(e):
+    """Too many signups/logins are waiting on password hashing."""
+
+    flash("We're busy right now, please try again in a moment.", 'danger')
+    return redirect(request.path), 303
+
+
 @app.route('/logout')
 def logout():
     """Handle logout of user."""
@@ -119,71 +223,121 @@ def logout():
     return redirect("/")
 
 
+@app.context_processor
+def add_viewer():
+    """Make the logged-in user's follows and likes available to templates
+    as `viewer` (see membership.py)."""
+
+    return {'viewer': membership.current()}
+
+
 ##############################################################################
 # General user routes:
 
 @app.route('/users')
+@replicas.read_only
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and a
+    'page' of the results.
     """
 
-    search = request.args.get('q')
+    q = request.args.get('q')
 
-    if not search:
+    if not q:
         users = User.query.all()
+        results = None
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        results = search.users(q, request.args.get('page', 1, type=int))
+        users = results.items
+
+    membership.prefetch(users=users)
+    return render_template('users/index.html', users=users, q=q, results=results)
+
+
+@app.route('/users/suggestions')
+@replicas.read_only
+def users_suggestions():
+    """Show users the logged-in user might want to follow."""
 
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    users = suggestions.suggestions(g.user.id)
+    membership.prefetch(users=users)
     return render_template('users/index.html', users=users)
 
 
 @app.route('/users/<int:user_id>')
+@replicas.read_only
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Messages are paged newest first; takes 'before'/'after' cursors.
+
+    Answers conditional requests: the page changes only with the user's
+    counters, profile and newest message, and the viewer.
+    """
 
     user = User.query.get_or_404(user_id)
-    form = LikesForm()
+    newest_id = (db.session
+                 .query(db.func.max(Message.id))
+                 .filter(Message.user_id == user_id)
+                 .scalar())
+    tag = http_cache.etag(tuple(user.stats().values()), newest_id,
+                          user.version)
+
+    def render():
+        form = LikesForm()
+        before, after = pagination.cursor_args()
+
+        page = pagination.paginate(
+            Message.query.filter(Message.user_id == user_id),
+            Message.timestamp, Message.id, before, after)
+        membership.prefetch(users=[user], messages=page.items)
+        return render_template('users/show.html', user=user, stats=user.stats(), messages=page.items, page=page, form=form)
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    # import pdb; pdb.set_trace()
-    count_likes = len(user.likes)
-    msgs_ive_liked = [u.message_id for u in g.user.likes]
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages, form=form, count_likes=count_likes, msgs_ive_liked=msgs_ive_liked)
+    return http_cache.conditional(tag, render)
 
 
 @app.route('/users/<int:user_id>/following')
+@replicas.read_only
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following.
+
+    Newest follow first; takes 'before'/'after' cursors.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    count_likes = len(user.likes)
-    return render_template('users/following.html', user=user, count_likes=count_likes)
+    before, after = pagination.cursor_args()
+    page = follows.following(user_id, before, after)
+    membership.prefetch(users=[user, *page.items])
+    return render_template('users/following.html', user=user, stats=user.stats(), users=page.items, page=page)
 
 
 @app.route('/users/<int:user_id>/followers')
+@replicas.read_only
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user.
+
+    Newest follow first; takes 'before'/'after' cursors.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    count_likes = len(user.likes)
-    return render_template('users/followers.html', user=user, count_likes=count_likes)
+    before, after = pagination.cursor_args()
+    page = follows.followers(user_id, before, after)
+    membership.prefetch(users=[user, *page.items])
+    return render_template('users/followers.html', user=user, stats=user.stats(), users=page.items, page=page)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -195,8 +349,11 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    if follows.add([(g.user.id, followed_user.id)]):
+        timeline.backfill_follow(g.user.id, followed_user.id)
+        jobs.enqueue('follow_changed', follower_id=g.user.id,
+                     followed_id=followed_user.id, following=True)
+        db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -209,13 +366,49 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    if follows.remove([(g.user.id, follow_id)]):
+        timeline.remove_follow(g.user.id, follow_id)
+        jobs.enqueue('follow_changed', follower_id=g.user.id,
+                     followed_id=follow_id, following=False)
+        db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
+@app.route('/users/following', methods=['POST'])
+def bulk_follow():
+    """Follow and unfollow many users at once for the logged-in user.
+
+    Takes a JSON body of {follow: [user ids], unfollow: [user ids]}, up to
+    FOLLOWS_BULK_MAX ids in all and none in both, and responds with how
+    many follows were added and removed. Timelines catch up in the
+    background.
+    """
+
+    if not g.user:
+        abort(401)
+
+    form = CSRFForm()
+    if not form.validate_on_submit():
+        abort(400)
+
+    body = request.get_json(silent=True) or {}
+    try:
+        follow = [int(id) for id in body.get('follow', [])]
+        unfollow = [int(id) for id in body.get('unfollow', [])]
+    except (TypeError, ValueError):
+        abort(400)
+    if len(follow) + len(unfollow) > app.config['FOLLOWS_BULK_MAX']:
+        abort(413)
+    if set(follow) & set(unfollow):
+        abort(400)
+
+    followed, unfollowed = follows.bulk(
+        [(True, (g.user.id, id)) for id in follow]
+        + [(False, (g.user.id, id)) for id in unfollow])
+    return jsonify(followed=followed, unfollowed=unfollowed)
+
+
 @app.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
@@ -241,7 +434,10 @@ def profile():
             user.bio = form.bio.data
             user.location = form.location.data
             db.session.add(user)
+            fragments.bump_user(user.id)
             db.session.commit()
+            identity.invalidate(user.id)
+            search.index_user(user)
             return redirect(f"/users/{g.user.id}")
 
         flash("Invalid credentials.", 'danger')
@@ -251,20 +447,37 @@ def profile():
 
 @app.route('/users/delete', methods=["POST"])
 def delete_user():
-    """Delete user."""
+    """Delete user.
+
+    The user is logged out straight away; deleting their account and
+    everything it owns is queued for the worker.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    identity.invalidate(g.user.id)
     do_logout()
 
-    db.session.delete(g.user)
+    jobs.enqueue('delete_user', user_id=g.user.id)
+    fragments.bump_user(g.user.id)
     db.session.commit()
+    search.remove_user(g.user)
 
     return redirect("/signup")
 
 
+@jobs.handler('delete_user')
+def delete_users(payloads):
+    """Delete the queued users, fixing the counters of what survives."""
+
+    ids = [payload['user_id'] for payload in payloads]
+    for user in User.query.filter(User.id.in_(ids)):
+        counters.user_removed(user)
+        db.session.delete(user)
+
+
 ##############################################################################
 # Messages routes:
 
@@ -284,7 +497,11 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        counters.message_added(msg)
+        jobs.enqueue('fan_out', priority=10, message_id=msg.id)
         db.session.commit()
+        search.index_message(msg)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -292,16 +509,22 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@replicas.read_only
 def messages_show(message_id):
-    """Show a message."""
-    form = LikesForm()
-    msg = Message.query.get(message_id)
-    msgs_ive_liked = [u.message_id for u in g.user.likes]
-    liked_msgs = (Like
-                  .query
-                  .filter(Message.user_id.in_(msgs_ive_liked))
-                  .all())
-    return render_template('messages/show.html', message=msg, form=form, msgs_ive_liked=msgs_ive_liked)
+    """Show a message.
+
+    Answers conditional requests: messages don't change, so the page only
+    changes with its author's profile and the viewer.
+    """
+
+    msg = Message.with_authors().get_or_404(message_id)
+    tag = http_cache.etag(msg.id, msg.user.version)
+
+    def render():
+        form = LikesForm()
+        return render_template('messages/show.html', message=msg, form=form)
+
+    return http_cache.conditional(tag, render)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -313,42 +536,85 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    counters.message_removed(msg)
+    timeline.remove_message(msg)
     db.session.delete(msg)
     db.session.commit()
+    search.remove_message(msg)
 
     return redirect(f"/users/{g.user.id}")
 
 
 @app.route('/messages/<int:message_id>/like', methods=["POST"])
 def handle_message_like(message_id):
-    """Handle a like/unlike of a message."""
+    """Handle a like/unlike of a message.
+
+    Toggles the like, or sets it to a JSON body's 'liked'. Requests that
+    accept JSON get back the new {liked, likes_count}; others are sent
+    back to the page they came from.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
     form = LikesForm()
-    if form.validate_on_submit():
-        like_to_delete = Like.query.filter_by(
-            user_id=g.user.id, message_id=message_id).first()
-        if (like_to_delete):
-            db.session.delete(like_to_delete)
-            db.session.commit()
-        else:
-            try:
-                liked_msg = Like(user_id=g.user.id, message_id=message_id)
-                db.session.add(liked_msg)
-                db.session.commit()
-            except IntegrityError:
-                db.session.rollback()
+    if not form.validate_on_submit():
+        abort(400)
 
-    return redirect("/")
+    body = request.get_json(silent=True) or {}
+    result = likes.toggle(g.user.id, message_id, body.get('liked'))
+    if result is None:
+        abort(404)
+
+    wants = request.accept_mimetypes.best_match(
+        ['text/html', 'application/json'])
+    if request.is_json or wants == 'application/json':
+        liked, likes_count = result
+        return jsonify(liked=liked, likes_count=likes_count)
+
+    return redirect(request.referrer or "/")
 
 
 @app.route('/users/<int:user_id>/likes')
+@replicas.read_only
 def display_liked_msgs(user_id):
-    """Displays a list of messages that a user has liked."""
+    """Displays a list of messages that a user has liked.
+
+    Messages are paged newest first; takes 'before'/'after' cursors.
+    """
 
     user = User.query.get_or_404(user_id)
-    liked_messages = user.liked_messages
-    count_likes = len(liked_messages)
-    return render_template('/users/likes.html', messages=liked_messages, user=user, count_likes=count_likes)
+    before, after = pagination.cursor_args()
+
+    page = pagination.paginate(
+        (Message
+         .with_authors()
+         .join(Like, Like.message_id == Message.id)
+         .filter(Like.user_id == user_id)),
+        Message.timestamp, Message.id, before, after)
+    return render_template('/users/likes.html', messages=page.items, page=page, user=user, stats=user.stats())
+
+
+@app.route('/search')
+@replicas.read_only
+def search_all():
+    """Search users and messages.
+
+    Takes a 'q' param with the search terms and an optional 'page'.
+    """
+
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    if not q:
+        return render_template('search.html', q=q, users=None, messages=None)
+
+    users = search.users(q, page)
+    messages = search.messages(q, page)
+    membership.prefetch(users=users.items, messages=messages.items)
+
+    return render_template('search.html', q=q, users=users, messages=messages, form=LikesForm())
 
 
 ##############################################################################
@@ -356,11 +622,18 @@ def display_liked_msgs(user_id):
 
 
 @app.route('/')
+@replicas.read_only
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, read from the
+      user's materialized timeline (see timeline.py) and paged with
+      'before'/'after' cursors; with 'ranked' set, each page is ordered by
+      how much its messages are trending (see trending.py)
+
+    Both are cached briefly by browsers: the anon page publicly, timelines
+    privately.
     """
 
     # if g.user:
@@ -372,23 +645,146 @@ def homepage():
 
     form = LikesForm()
     if g.user:
-        following_ids = [u.id for u in g.user.following]
+        http_cache.set_policy(private=True, max_age=app.config['HOME_MAX_AGE'])
+        before, after = pagination.cursor_args()
+        page = timeline.home_timeline(g.user.id, before, after)
+        ranked = bool(request.args.get('ranked'))
+        if ranked:
+            page = page._replace(items=trending.rank(page.items))
+        membership.prefetch(messages=page.items)
 
-        msgs_ive_liked = [u.message_id for u in g.user.likes]
-
-        messages = (Message
-                    .query
-                    .order_by(Message.timestamp.desc())
-                    .filter(Message.user_id.in_(following_ids))
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages, form=form, msgs_ive_liked=msgs_ive_liked)
+        return render_template('home.html', stats=g.user.stats(), messages=page.items, page=page, form=form, ranked=ranked)
 
     else:
+        http_cache.set_policy(public=True,
+                              max_age=app.config['ANON_HOME_MAX_AGE'])
         return render_template('home-anon.html')
 
 
+@app.route('/trending')
+@replicas.read_only
+def show_trending():
+    """Show the messages with the most likes lately (see trending.py).
+
+    Cached briefly, publicly for anon users.
+    """
+
+    messages = trending.top()
+    membership.prefetch(messages=messages)
+    if not g.user:
+        http_cache.set_policy(public=True,
+                              max_age=app.config['TRENDING_MAX_AGE'])
+
+    return render_template('messages/trending.html', messages=messages, form=LikesForm())
+
+
+@app.cli.command('worker')
+@click.option('--batch-size', default=50, help="Jobs claimed at a time.")
+@click.option('--poll', default=1.0,
+              help="Seconds between checks of an empty queue.")
+@click.option('--once', is_flag=True, help="Stop when the queue is empty.")
+def worker(batch_size, poll, once):
+    """Run queued jobs (see jobs.py) until stopped."""
+
+    ran = jobs.work(batch_size, poll, once)
+    print(f"Ran {ran} jobs.")
+
+
+follows_cli = AppGroup('follows', help="Manage follows in bulk.")
+app.cli.add_command(follows_cli)
+
+
+@follows_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=follows.DEFAULT_CHUNK_SIZE,
+              help="Follows written per statement.")
+def import_follows(path, chunk_size):
+    """Apply the follows and unfollows in a CSV file.
+
+    Columns are follower_id, followed_id and an optional action, 'follow'
+    (the default) or 'unfollow'. Rows are applied in file order.
+    """
+
+    start = time.monotonic()
+    changes = []
+    with open(path, newline='') as file:
+        for line, row in enumerate(csv.DictReader(file), 2):
+            action = row.get('action') or 'follow'
+            if action not in ('follow', 'unfollow'):
+                raise click.ClickException(
+                    f"Line {line}: unknown action {action!r}.")
+            pair = int(row['follower_id']), int(row['followed_id'])
+            changes.append((action == 'follow', pair))
+
+    followed, unfollowed = follows.bulk(changes, chunk_size)
+    elapsed = time.monotonic() - start
+    read = len(changes)
+    print(f"{read:,} rows: followed {followed:,}, unfollowed {unfollowed:,} "
+          f"({read / elapsed if elapsed else 0:,.0f} rows/s)")
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every user's home timeline from the follows table."""
+
+    timeline.rebuild_all()
+    db.session.commit()
+
+
+@app.cli.command('rebuild-suggestions')
+@click.option('--workers', default=0,
+              help="Processes to compute in; 0 computes in this one.")
+def rebuild_suggestions(workers):
+    """Recompute every user's follow suggestions from the follows table."""
+
+    stored = suggestions.rebuild_all(workers)
+    db.session.commit()
+    print(f"Stored {stored} suggestions.")
+
+
+@app.cli.command('decay-trending')
+def decay_trending():
+    """Decay trending scores; run every TRENDING_DECAY_MINUTES."""
+
+    dropped = trending.decay()
+    db.session.commit()
+    print(f"Dropped {dropped} messages from trending.")
+
+
+@app.cli.command('rebuild-trending')
+def rebuild_trending():
+    """Recompute trending scores from the likes table."""
+
+    trending.rebuild()
+    db.session.commit()
+
+
+@app.cli.command('rebuild-inboxes')
+def rebuild_inboxes():
+    """Rebuild every user's conversation inbox from the dms table."""
+
+    inbox.rebuild_all()
+    db.session.commit()
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines():
+    """Trim timelines that have grown past TIMELINE_MAX_ENTRIES."""
+
+    trimmed = timeline.trim_all()
+    db.session.commit()
+    print(f"Trimmed {trimmed} timelines.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute denormalized counters from the source tables."""
+
+    users, messages = counters.reconcile()
+    db.session.commit()
+    print(f"Repaired {users} users and {messages} messages.")
+
+
 # @app.errorhandler(404)
 # def page_not_found(e):
 #     """404 NOT FOUND page."""
@@ -402,49 +798,35 @@ def homepage():
 
 @app.route('/conversations')
 def list_conversationss():
-    """Page with listing of conversations."""
+    """Page with listing of conversations.
 
-    conversations_with_dms = DM.query.all()
-    conversations_with_dms_ids = [u.conversation_id for u in conversations_with_dms]
+    Reads the user's inbox (see inbox.py), most recent activity first;
+    takes 'before'/'after' cursors.
+    """
 
-    conversations_master = (Conversation
-                .query
-                .filter(Conversation.id.in_(conversations_with_dms_ids))
-                .all())
+    before, after = pagination.cursor_args()
+    page = inbox.inbox(g.user.id, before, after)
 
-    #the conversations where I'm user 1
-    conversations_1 = [conversation for conversation in conversations_master if conversation.user1_id == g.user.id]
-    #the conversations where I'm user 2
-    conversations_2 = [conversation for conversation in conversations_master if conversation.user2_id == g.user.id]
-    #todo: fix bug where dm to self appears twice because it appears in both conversations_1 and conversations_2
+    return render_template('conversations.html', entries=page.items, page=page)
 
-    return render_template('conversations.html', my_user1_conversations=conversations_1, my_user2_conversations=conversations_2)
-    
 
 @app.route('/conversations/add/<int:user_id>', methods=["POST"])
 def add_conversation(user_id):
-    """Page to add a conversation. """
-    # if this user id combo exists
-    conversation = Conversation.query.filter(
-        Conversation.user1_id == user_id, Conversation.user2_id == g.user.id).all()
-
-    conversation2 = Conversation.query.filter(
-        Conversation.user2_id == user_id, Conversation.user1_id == g.user.id).all()
-
-    if conversation:
-        return redirect(f"/conversations/{conversation[0].id}")
-
-    if conversation2:
-        return redirect(f"/conversations/{conversation2[0].id}")
-
-    # else:
-    if (user_id < g.user.id):
-        new_conversation = Conversation(user1_id=user_id, user2_id=g.user.id)
-    else:
-        new_conversation = Conversation(user1_id=g.user.id, user2_id=user_id)
-    db.session.add(new_conversation)
+    """Open the conversation with a user, starting it if there isn't one."""
+
+    try:
+        conversation_id, created = Conversation.get_or_create(g.user.id,
+                                                              user_id)
+    except IntegrityError:
+        db.session.rollback()
+        abort(404)
+
+    if created:
+        inbox.conversation_added(conversation_id,
+                                 *Conversation.pair(g.user.id, user_id))
     db.session.commit()
-    return redirect(f"/conversations/{new_conversation.id}")
+
+    return redirect(f"/conversations/{conversation_id}")
 
 
 @app.route('/conversations/<int:conversation_id>')
@@ -459,38 +841,98 @@ def show_conversation(conversation_id):
             other_username = conversation.user1.username
             other_pic = conversation.user1.image_url
 
-        return render_template("show-conversation.html", conversation=conversation, other_username=other_username, other_pic = other_pic)
+        inbox.mark_read(g.user.id, conversation_id)
+        db.session.commit()
+
+        # Only the newest DMs are rendered; older ones are fetched from
+        # list_dms as the user scrolls back.
+        window = dms.window(conversation_id)
+
+        return render_template("show-conversation.html", conversation=conversation, dms=window.items, has_older=window.has_more, other_username=other_username, other_pic = other_pic)
     else:
         flash('Unauthorized', 'danger')
         return redirect('/')
 
 
+def get_conversation_or_abort(conversation_id):
+    """The conversation, if the logged-in user takes part in it.
+
+    Aborts with a 404 if it doesn't exist and a 403 if it isn't theirs.
+    """
+
+    conversation = Conversation.query.get_or_404(conversation_id)
+    if not g.user or g.user.id not in (conversation.user1_id,
+                                       conversation.user2_id):
+        abort(403)
+
+    return conversation
+
+
+@app.route('/conversations/<int:conversation_id>/dms')
+def list_dms(conversation_id):
+    """JSON window of a conversation's DMs, oldest first.
+
+    Takes 'since_id' for DMs newer than the client's newest, or
+    'before_id' for older history, and 'limit'. 'has_more' says whether
+    more DMs lie past the window in that direction.
+    """
+
+    get_conversation_or_abort(conversation_id)
+    since_id, before_id, limit = dms.window_args()
+    window = dms.window(conversation_id, since_id, before_id, limit)
+
+    return jsonify(dms=[dms.serialize(dm) for dm in window.items],
+                   has_more=window.has_more)
+
+
 @app.route('/conversations/<int:conversation_id>/dm/add', methods=["POST"])
 def add_dm(conversation_id):
-    """adds a dm"""
-    conversation = Conversation.query.get(conversation_id)
+    """adds a dm
+
+    Responds with just the new DM; clients fetch anything else they've
+    missed from list_dms with 'since_id'.
+    """
+    get_conversation_or_abort(conversation_id)
     text = request.json["text"]
     dm = DM(text=text, conversation_id=conversation_id, author=g.user.id)
     db.session.add(dm)
+    db.session.flush()
+    inbox.dm_added(dm)
     db.session.commit()
-    all_dms = [[dm.text, dm.author] for dm in conversation.dms]
-    return jsonify(all_dms)
+    dms.published(dm)
+    return jsonify(dm=dms.serialize(dm)), 201
 
 
+@app.route('/conversations/<int:conversation_id>/stream')
+def stream_dms(conversation_id):
+    """Push new DMs in a conversation as they're sent.
 
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+    Browsers asking for text/event-stream get Server-Sent Events, resuming
+    after 'Last-Event-ID' or 'since_id'. Anyone else long-polls: the
+    response is the JSON list_dms would give for 'since_id', held until
+    there's at least one DM or STREAM_POLL_TIMEOUT passes.
+    """
+
+    get_conversation_or_abort(conversation_id)
+
+    since_id = dms.int_arg('since_id')
+    wants = request.accept_mimetypes.best_match(
+        ['application/json', 'text/event-stream'])
+
+    if wants == 'text/event-stream':
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        if last_event_id.isdigit():
+            since_id = int(last_event_id)
+        if since_id is None:
+            since_id = dms.latest_id(conversation_id)
+
+        return Response(
+            stream_with_context(dms.events(conversation_id, since_id)),
+            mimetype='text/event-stream',
+            headers={'X-Accel-Buffering': 'no'})
+
+    if since_id is None:
+        since_id = dms.latest_id(conversation_id)
+
+    items, has_more = dms.wait_for_window(conversation_id, since_id)
+    return jsonify(dms=items, has_more=has_more)
@@ -0,0 +1,553 @@
+"""Latency benchmarks for Warbler's routes.
+
+Seeds a dataset of a chosen size, requests each route as a random seeded
+user, and reports p50/p95/p99 latency, throughput and SQL statements per
+request:
+
+    python benchmark.py --users 2000 --follows-per-user 50 --save base.json
+    ...change something...
+    python benchmark.py --no-seed --compare base.json
+
+By default requests go through Flask's test client, in this process, so
+SQL statements can be counted. Pass --gunicorn WORKERS to start a local
+gunicorn, or --url to point at a server that's already running, to
+include the web server in the measurements (SQL isn't counted then).
+
+The benchmark drops and reseeds the database at DATABASE_URL, which
+defaults to a separate warbler-bench database.
+
+Some features replace a query with a cheaper one; the old and new
+queries in QUERIES are also run directly, in this process, and reported
+side by side (the naive GROUP BY behind trending, for one).
+
+With --compare, routes and queries whose p95 latency or SQL statements
+per request grew by more than --tolerance are listed and the exit status
+is 1.
+"""
+
+import os
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+import argparse
+import http.cookiejar
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import session
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import event
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Conversation
+import seed
+import trending
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'generator', 'create_csvs.py')
+
+# A route request: who makes it, and what they ask for.
+Call = namedtuple('Call', ['viewer', 'method', 'path', 'data', 'json'])
+
+
+def call(viewer, path, method='GET', data=None, json=None):
+    return Call(viewer, method, path, data, json)
+
+
+##############################################################################
+# Dataset
+
+
+class Dataset:
+    """Ids to pick request targets from."""
+
+    def __init__(self):
+        self.max_user_id = db.session.query(db.func.max(User.id)).scalar()
+        self.max_message_id = db.session.query(
+            db.func.max(Message.id)).scalar()
+        self.conversations = (db.session
+                              .query(Conversation.id,
+                                     Conversation.user1_id,
+                                     Conversation.user2_id)
+                              .order_by(db.func.random())
+                              .limit(1000)
+                              .all())
+        self.words = [username[:4] for (username,) in
+                      db.session.query(User.username).limit(100)]
+
+        if not self.max_user_id or not self.max_message_id:
+            sys.exit("The database is empty; run without --no-seed.")
+
+    def user(self, rng):
+        return rng.randint(1, self.max_user_id)
+
+    def message(self, rng):
+        return rng.randint(1, self.max_message_id)
+
+    def conversation(self, rng):
+        """A (conversation id, participant) pair."""
+
+        if not self.conversations:
+            return None, self.user(rng)
+
+        id, user1_id, user2_id = rng.choice(self.conversations)
+        return id, rng.choice((user1_id, user2_id))
+
+    def word(self, rng):
+        return rng.choice(self.words)
+
+
+def generate(args, out):
+    """Write CSVs for the dataset `args` describes to `out`."""
+
+    users = args.users
+    subprocess.run(
+        [sys.executable, GENERATOR,
+         '--users', str(users),
+         '--messages', str(users * args.messages_per_user),
+         '--follows', str(users * args.follows_per_user),
+         '--likes', str(users * args.likes_per_user),
+         '--conversations', str(users * args.conversations_per_user),
+         '--seed', str(args.seed),
+         '--out', out],
+        check=True)
+
+
+##############################################################################
+# Routes
+
+
+def conversation_call(data, rng, suffix='', **kwargs):
+    id, viewer = data.conversation(rng)
+    return call(viewer, f"/conversations/{id}{suffix}", **kwargs)
+
+
+ROUTES = {
+    'homepage':
+        lambda data, rng: call(data.user(rng), "/"),
+    'users_show':
+        lambda data, rng: call(data.user(rng), f"/users/{data.user(rng)}"),
+    'list_users':
+        lambda data, rng: call(data.user(rng), "/users"),
+    'list_users_search':
+        lambda data, rng: call(data.user(rng), f"/users?q={data.word(rng)}"),
+    'show_following':
+        lambda data, rng: call(data.user(rng),
+                               f"/users/{data.user(rng)}/following"),
+    'users_followers':
+        lambda data, rng: call(data.user(rng),
+                               f"/users/{data.user(rng)}/followers"),
+    'display_liked_msgs':
+        lambda data, rng: call(data.user(rng),
+                               f"/users/{data.user(rng)}/likes"),
+    'messages_show':
+        lambda data, rng: call(data.user(rng),
+                               f"/messages/{data.message(rng)}"),
+    'search_all':
+        lambda data, rng: call(data.user(rng), f"/search?q={data.word(rng)}"),
+    'trending':
+        lambda data, rng: call(data.user(rng), "/trending"),
+    'homepage_ranked':
+        lambda data, rng: call(data.user(rng), "/?ranked=1"),
+    'messages_add':
+        lambda data, rng: call(data.user(rng), "/messages/new", 'POST',
+                               data={'text': "Benchmarking"}),
+    'handle_message_like':
+        lambda data, rng: call(data.user(rng),
+                               f"/messages/{data.message(rng)}/like", 'POST',
+                               data={}),
+    'api_timeline':
+        lambda data, rng: call(data.user(rng), "/api/v1/timeline"),
+    'api_users_show':
+        lambda data, rng: call(data.user(rng),
+                               f"/api/v1/users/{data.user(rng)}"),
+    'api_user_messages':
+        lambda data, rng: call(data.user(rng),
+                               f"/api/v1/users/{data.user(rng)}/messages"),
+    'api_messages_show':
+        lambda data, rng: call(data.user(rng),
+                               f"/api/v1/messages/{data.message(rng)}"),
+    'api_conversations':
+        lambda data, rng: call(data.user(rng), "/api/v1/conversations"),
+    'list_conversationss':
+        lambda data, rng: call(data.user(rng), "/conversations"),
+    'show_conversation':
+        lambda data, rng: conversation_call(data, rng),
+    'add_dm':
+        lambda data, rng: conversation_call(data, rng, '/dm/add', method='POST',
+                                            json={'text': "Benchmarking"}),
+}
+
+
+# Queries timed against each other: what a feature reads, and the naive
+# query it replaces.
+QUERIES = {
+    'trending_scores': trending.top,
+    'trending_group_by': trending.naive_top,
+}
+
+
+##############################################################################
+# Clients
+
+
+class TestClients:
+    """A logged-in Flask test client per viewer, counting SQL statements."""
+
+    def __init__(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.clients = {}
+        self.local = threading.local()
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.local.statements = getattr(self.local, 'statements', 0) + 1
+
+    def client(self, viewer):
+        if viewer not in self.clients:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = viewer
+            self.clients[viewer] = client
+        return self.clients[viewer]
+
+    def request(self, call):
+        """Make `call`; returns (status, SQL statements run)."""
+
+        client = self.client(call.viewer)
+        self.local.statements = 0
+        response = client.open(call.path, method=call.method,
+                               data=call.data, json=call.json)
+        return response.status_code, self.local.statements
+
+    def close(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+
+class HttpClients:
+    """Logged-in HTTP sessions against a running server, per viewer."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.openers = {}
+        self.lock = threading.Lock()
+
+    def login(self, viewer):
+        """An opener holding a session cookie for `viewer`, and a CSRF token.
+
+        The cookie is signed with this app's SECRET_KEY, which must match
+        the server's.
+        """
+
+        with app.test_request_context():
+            session[CURR_USER_KEY] = viewer
+            token = generate_csrf()
+            value = (app.session_interface
+                     .get_signing_serializer(app)
+                     .dumps(dict(session)))
+
+        host = urllib.parse.urlsplit(self.url).hostname
+        jar = http.cookiejar.CookieJar()
+        jar.set_cookie(http.cookiejar.Cookie(
+            0, app.config['SESSION_COOKIE_NAME'], value, None, False,
+            host, False, False, '/', True, False, None, False, None, None,
+            {}))
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(jar), NoRedirect)
+        return opener, token
+
+    def request(self, call):
+        with self.lock:
+            if call.viewer not in self.openers:
+                self.openers[call.viewer] = self.login(call.viewer)
+            opener, token = self.openers[call.viewer]
+
+        headers = {}
+        body = None
+        if call.json is not None:
+            body = json.dumps(call.json).encode()
+            headers['Content-Type'] = 'application/json'
+        elif call.data is not None:
+            body = urllib.parse.urlencode(
+                {**call.data, 'csrf_token': token}).encode()
+
+        request = urllib.request.Request(self.url + call.path, body, headers,
+                                         method=call.method)
+        try:
+            with opener.open(request) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as error:
+            return error.code, None
+
+    def close(self):
+        pass
+
+
+def start_gunicorn(workers, port):
+    """Start a local gunicorn serving the app; returns the process."""
+
+    process = subprocess.Popen(
+        ['gunicorn', 'app:app', '--workers', str(workers),
+         '--bind', f"127.0.0.1:{port}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    url = f"http://127.0.0.1:{port}/"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.terminate()
+    sys.exit("gunicorn didn't start.")
+
+
+##############################################################################
+# Measuring
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted `values`."""
+
+    if not values:
+        return None
+
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def run_route(clients, route, data, args):
+    """Request `route` repeatedly; returns its summary statistics."""
+
+    rng = random.Random(f"{args.seed}:{route}")
+    calls = [ROUTES[route](data, rng)
+             for _ in range(args.warmup + args.requests)]
+
+    for warmup in calls[:args.warmup]:
+        clients.request(warmup)
+
+    def timed(call):
+        start = time.perf_counter()
+        status, statements = clients.request(call)
+        return time.perf_counter() - start, status, statements
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(timed, calls[args.warmup:]))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds * 1000 for seconds, _, _ in results)
+    statements = [count for _, _, count in results if count is not None]
+
+    return {
+        'requests': len(results),
+        'errors': sum(status >= 400 for _, status, _ in results),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'rps': len(results) / elapsed if elapsed else None,
+        'sql': sum(statements) / len(statements) if statements else None,
+    }
+
+
+def run_query(query, args):
+    """Run `query` repeatedly in this process; returns its summary
+    statistics, like `run_route`."""
+
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    with app.app_context():
+        for _ in range(args.warmup):
+            QUERIES[query]()
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        latencies = []
+        try:
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                began = time.perf_counter()
+                QUERIES[query]()
+                latencies.append((time.perf_counter() - began) * 1000)
+                db.session.expire_all()
+            elapsed = time.perf_counter() - start
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': 0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'rps': len(latencies) / elapsed if elapsed else None,
+        'sql': statements / len(latencies) if latencies else None,
+    }
+
+
+def compare(routes, baseline, tolerance):
+    """Routes whose p95 or SQL per request grew by more than `tolerance`.
+
+    Returns (route, measure, baseline value, new value) tuples.
+    """
+
+    regressions = []
+
+    for route, stats in routes.items():
+        base = baseline.get(route)
+        if base is None:
+            continue
+
+        for measure in ('p95', 'sql'):
+            old, new = base.get(measure), stats.get(measure)
+            if old is not None and new is not None and (
+                    new > old * (1 + tolerance)):
+                regressions.append((route, measure, old, new))
+
+    return regressions
+
+
+def show(value, format):
+    return '-' if value is None else format.format(value)
+
+
+def report(routes, baseline=None, label='route'):
+    print(f"{label:<22}{'n':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'req/s':>9}{'sql':>7}{'base p95':>10}")
+
+    for route, stats in routes.items():
+        base = (baseline or {}).get(route, {})
+        print(f"{route:<22}{stats['requests']:>6}{stats['errors']:>5}"
+              f"{show(stats['p50'], '{:.1f}'):>9}"
+              f"{show(stats['p95'], '{:.1f}'):>9}"
+              f"{show(stats['p99'], '{:.1f}'):>9}"
+              f"{show(stats['rps'], '{:.0f}'):>9}"
+              f"{show(stats['sql'], '{:.1f}'):>7}"
+              f"{show(base.get('p95'), '{:.1f}'):>10}")
+
+
+##############################################################################
+# Command line
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark Warbler's routes.")
+
+    dataset = parser.add_argument_group('dataset')
+    dataset.add_argument('--users', type=int, default=1000)
+    dataset.add_argument('--follows-per-user', type=int, default=20)
+    dataset.add_argument('--messages-per-user', type=int, default=20)
+    dataset.add_argument('--likes-per-user', type=int, default=10)
+    dataset.add_argument('--conversations-per-user', type=int, default=1)
+    dataset.add_argument('--no-seed', action='store_true',
+                         help="benchmark the data already in the database")
+
+    run = parser.add_argument_group('run')
+    run.add_argument('--routes', nargs='+', choices=sorted(ROUTES),
+                     default=list(ROUTES))
+    run.add_argument('--queries', nargs='*', choices=sorted(QUERIES),
+                     default=list(QUERIES))
+    run.add_argument('--requests', type=int, default=200,
+                     help="measured requests per route or query")
+    run.add_argument('--warmup', type=int, default=20)
+    run.add_argument('--concurrency', type=int, default=1)
+    run.add_argument('--seed', type=int, default=0)
+    server = run.add_mutually_exclusive_group()
+    server.add_argument('--url', help="benchmark a server already running")
+    server.add_argument('--gunicorn', type=int, metavar='WORKERS',
+                        help="start a local gunicorn with WORKERS workers")
+    run.add_argument('--port', type=int, default=8765)
+
+    results = parser.add_argument_group('results')
+    results.add_argument('--save', metavar='FILE',
+                         help="save the results as a baseline")
+    results.add_argument('--compare', metavar='FILE',
+                         help="compare with a saved baseline")
+    results.add_argument('--tolerance', type=float, default=0.2,
+                         help="allowed growth before a regression "
+                              "(default: %(default)s)")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    with app.app_context():
+        if not args.no_seed:
+            with tempfile.TemporaryDirectory() as out:
+                generate(args, out)
+                seed.load(out)
+
+        data = Dataset()
+        db.session.remove()
+
+    server = None
+    if args.gunicorn:
+        server = start_gunicorn(args.gunicorn, args.port)
+        clients = HttpClients(f"http://127.0.0.1:{args.port}")
+    elif args.url:
+        clients = HttpClients(args.url)
+    else:
+        clients = TestClients()
+
+    try:
+        routes = {route: run_route(clients, route, data, args)
+                  for route in args.routes}
+    finally:
+        clients.close()
+        if server:
+            server.terminate()
+            server.wait()
+
+    queries = {query: run_query(query, args) for query in args.queries}
+
+    report(routes, baseline and baseline['routes'])
+    if queries:
+        print()
+        report(queries, baseline and baseline.get('queries'), label='query')
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'args': vars(args), 'routes': routes,
+                       'queries': queries}, file, indent=2)
+
+    if baseline:
+        regressions = (
+            compare(routes, baseline['routes'], args.tolerance)
+            + compare(queries, baseline.get('queries', {}), args.tolerance))
+        for route, measure, old, new in regressions:
+            print(f"REGRESSION {route} {measure}: {old:.1f} -> {new:.1f}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
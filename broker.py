@@ -0,0 +1,262 @@
+"""Publish/subscribe for pushing events to open connections.
+
+A `LocalBroker` hands published messages to subscribers in the same
+process. With more than one web worker a DM can be sent to one worker
+while the recipient's stream is held open by another, so the
+`PostgresBroker` and `RedisBroker` route every message through PostgreSQL
+``LISTEN``/``NOTIFY`` or Redis pub/sub and a listener thread in each
+worker hands it on to that worker's local subscribers.
+
+Messages must be JSON-serializable, and small: ``NOTIFY`` payloads are
+limited to 8000 bytes. Use `make_broker` to pick a backend from
+configuration.
+
+Subscribers block while they wait, so holding many of them open needs an
+async worker class (see gunicorn.conf.py).
+"""
+
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import current_app
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Messages published to one channel since it was subscribed to."""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.messages = deque()
+        self.ready = threading.Condition()
+
+    def put(self, message):
+        with self.ready:
+            self.messages.append(message)
+            self.ready.notify()
+
+    def get(self, timeout=None):
+        """Wait up to `timeout` seconds; returns the messages received.
+
+        Returns an empty list if nothing arrived in time.
+        """
+
+        with self.ready:
+            if not self.messages:
+                self.ready.wait(timeout)
+            messages = list(self.messages)
+            self.messages.clear()
+            return messages
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalBroker:
+    """Delivers messages to subscribers in this process only."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        """Start receiving messages published to `channel`."""
+
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscriptions.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[subscription.channel]
+
+    def deliver(self, channel, message):
+        """Hand `message` to this process's subscribers of `channel`."""
+
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def publish(self, channel, message):
+        """Send `message` to every subscriber of `channel`."""
+
+        self.deliver(channel, message)
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subs) for subs in self.subscriptions.values())
+
+
+class ListeningBroker(LocalBroker):
+    """A broker that hears published messages on a background thread.
+
+    The thread is started on first subscribe, so each forked web worker
+    starts its own.
+    """
+
+    # Seconds to wait before reconnecting after the listener fails.
+    RECONNECT_DELAY = 1
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def subscribe(self, channel):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.run,
+                                                 daemon=True)
+                self.listener.start()
+        return super().subscribe(channel)
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception("Broker listener failed; reconnecting.")
+                time.sleep(self.RECONNECT_DELAY)
+
+    def received(self, raw):
+        event = json.loads(raw)
+        self.deliver(event['channel'], event['message'])
+
+    def encode(self, channel, message):
+        return json.dumps({'channel': channel, 'message': message})
+
+    def listen(self):
+        raise NotImplementedError
+
+
+class PostgresBroker(ListeningBroker):
+    """Messages go through PostgreSQL LISTEN/NOTIFY on one channel."""
+
+    def __init__(self, url, channel='warbler_events'):
+        if psycopg2 is None:
+            raise RuntimeError("PostgresBroker needs the 'psycopg2' package.")
+
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self.notifier = None
+        self.notify_lock = threading.Lock()
+
+    def connect(self):
+        connection = psycopg2.connect(self.url)
+        connection.autocommit = True
+        return connection
+
+    def publish(self, channel, message):
+        with self.notify_lock:
+            if self.notifier is None or self.notifier.closed:
+                self.notifier = self.connect()
+            with self.notifier.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)",
+                               (self.channel, self.encode(channel, message)))
+
+    def listen(self):
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel}")
+
+            while True:
+                if select.select([connection], [], [], 5) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    self.received(connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+
+class RedisBroker(ListeningBroker):
+    """Messages go through Redis pub/sub."""
+
+    def __init__(self, url, prefix="warbler:events:"):
+        if redis is None:
+            raise RuntimeError("RedisBroker needs the 'redis' package.")
+
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.key = prefix + "all"
+
+    def publish(self, channel, message):
+        self.client.publish(self.key, self.encode(channel, message))
+
+    def listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.key)
+        for event in pubsub.listen():
+            self.received(event['data'])
+
+
+def make_broker(backend, url=None):
+    """Build a broker: `backend` is 'local', 'postgres' or 'redis'."""
+
+    if backend == 'local':
+        return LocalBroker()
+    if backend == 'postgres':
+        return PostgresBroker(url)
+    if backend == 'redis':
+        return RedisBroker(url)
+
+    raise ValueError(f"Unknown broker backend: {backend!r}")
+
+
+def init_app(app):
+    """Set up the broker configured on `app`.
+
+    BROKER_URL defaults to the database's URL for the 'postgres' backend.
+    """
+
+    backend = app.config.get('BROKER', 'local')
+    url = app.config.get('BROKER_URL')
+    if backend == 'postgres' and url is None:
+        url = app.config['SQLALCHEMY_DATABASE_URI']
+
+    app.extensions['broker'] = make_broker(backend, url)
+
+
+def get_broker():
+    return current_app.extensions['broker']
+
+
+def publish(channel, message):
+    """Publish `message` to `channel` through the current app's broker."""
+
+    get_broker().publish(channel, message)
+
+
+def subscribe(channel):
+    """Subscribe to `channel` through the current app's broker."""
+
+    return get_broker().subscribe(channel)
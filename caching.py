@@ -0,0 +1,149 @@
+"""Key/value cache backends.
+
+Values must be JSON-serializable so the same code works against the
+in-process `LRUCache` and the shared `RedisCache`. Use `make_cache` to
+pick a backend from configuration.
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class NullCache:
+    """Cache that never holds anything (caching turned off)."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    """In-process least-recently-used cache with per-entry expiry.
+
+    Holds at most `maxsize` entries and, if `max_bytes` is set, at most
+    that many bytes of values as measured by `sizeof`. Each entry expires
+    `ttl` seconds after it was set. Safe to share between threads of one
+    worker.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, clock=time.monotonic,
+                 max_bytes=None, sizeof=sys.getsizeof):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Value stored at `key`, or None if missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at, size = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.bytes -= size
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` at `key`, evicting least recently used entries
+        while the cache is over its limits."""
+
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, expires_at, size)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or (
+                    self.max_bytes is not None
+                    and self.bytes > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class RedisCache:
+    """Cache shared between workers through a Redis-compatible server."""
+
+    def __init__(self, url, ttl=60, prefix="warbler:"):
+        if redis is None:
+            raise RuntimeError("RedisCache needs the 'redis' package.")
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value),
+                        ex=self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+def make_cache(backend, url=None, maxsize=10000, ttl=60, prefix="warbler:",
+               max_bytes=None):
+    """Build a cache: `backend` is 'memory', 'redis' or 'none'.
+
+    `maxsize` and `max_bytes` only limit the 'memory' backend.
+    """
+
+    if backend == 'memory':
+        return LRUCache(maxsize=maxsize, ttl=ttl, max_bytes=max_bytes)
+    if backend == 'redis':
+        return RedisCache(url, ttl=ttl, prefix=prefix)
+    if backend == 'none':
+        return NullCache()
+
+    raise ValueError(f"Unknown cache backend: {backend!r}")
@@ -0,0 +1,177 @@
+"""Denormalized counters on users and messages.
+
+`User` keeps `messages_count`, `following_count`, `followers_count` and
+`likes_count`, and `Message` keeps `likes_count`, so profile headers are
+read in O(1) instead of by counting rows.
+
+Each hook below is a single ``UPDATE ... SET n = n + delta`` so concurrent
+requests can't lose increments. None of them commit; callers commit along
+with the rows being counted, so a rolled-back change rolls back its count
+too. `reconcile` recomputes every counter from the source tables to repair
+any drift (``flask reconcile-counters``).
+"""
+
+from sqlalchemy import select
+
+from models import db, Follows, Like, Message, User
+
+
+def _bump(model, column, delta, *criteria):
+    """Add `delta` to `column` on every `model` row matching `criteria`."""
+
+    (model
+     .query
+     .filter(*criteria)
+     .update({column: column + delta}, synchronize_session=False))
+
+
+def follows_changed(following_deltas, followers_deltas):
+    """Many follows and unfollows at once.
+
+    `following_deltas` and `followers_deltas` map user ids to their net
+    change in `following_count` and `followers_count`; users sharing a
+    change are updated by one statement.
+    """
+
+    for column, deltas in ((User.following_count, following_deltas),
+                           (User.followers_count, followers_deltas)):
+        by_delta = {}
+        for user_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(user_id)
+        for delta, user_ids in by_delta.items():
+            _bump(User, column, delta, User.id.in_(user_ids))
+
+
+def message_added(message):
+    """`message` was posted."""
+
+    _bump(User, User.messages_count, 1, User.id == message.user_id)
+
+
+def message_removed(message):
+    """`message` is about to be deleted, along with its likes."""
+
+    likers = select([Like.user_id]).where(Like.message_id == message.id)
+
+    _bump(User, User.messages_count, -1, User.id == message.user_id)
+    _bump(User, User.likes_count, -1, User.id.in_(likers))
+
+
+def like_added(user_id, message_id):
+    """`user_id` liked `message_id`."""
+
+    _bump(User, User.likes_count, 1, User.id == user_id)
+    _bump(Message, Message.likes_count, 1, Message.id == message_id)
+
+
+def like_removed(user_id, message_id):
+    """`user_id` unliked `message_id`."""
+
+    _bump(User, User.likes_count, -1, User.id == user_id)
+    _bump(Message, Message.likes_count, -1, Message.id == message_id)
+
+
+def likes_changed(user_deltas, message_deltas):
+    """Many likes and unlikes at once.
+
+    `user_deltas` and `message_deltas` map user and message ids to their
+    net change in likes; each id with a change is updated once.
+    """
+
+    for user_id, delta in user_deltas.items():
+        if delta:
+            _bump(User, User.likes_count, delta, User.id == user_id)
+    for message_id, delta in message_deltas.items():
+        if delta:
+            _bump(Message, Message.likes_count, delta, Message.id == message_id)
+
+
+def user_removed(user):
+    """`user` is about to be deleted, along with everything they own.
+
+    Fixes the counters of the rows that survive: the users they followed
+    or were followed by, the messages they liked and the users who liked
+    their messages.
+    """
+
+    followed = (select([Follows.user_being_followed_id])
+                .where(Follows.user_following_id == user.id))
+    followers = (select([Follows.user_following_id])
+                 .where(Follows.user_being_followed_id == user.id))
+    liked = select([Like.message_id]).where(Like.user_id == user.id)
+    liked_own = (select([db.func.count()])
+                 .select_from(Like.__table__.join(Message.__table__))
+                 .where(db.and_(Like.user_id == User.id,
+                                Message.user_id == user.id))
+                 .as_scalar())
+    likers = (select([Like.user_id])
+              .select_from(Like.__table__.join(Message.__table__))
+              .where(Message.user_id == user.id))
+
+    _bump(User, User.followers_count, -1, User.id.in_(followed))
+    _bump(User, User.following_count, -1, User.id.in_(followers))
+    _bump(Message, Message.likes_count, -1, Message.id.in_(liked))
+    # A liker may have liked several of this user's messages.
+    _bump(User, User.likes_count, -liked_own, User.id.in_(likers))
+
+
+def _user_counts():
+    """Correlated subqueries computing each `User` counter from scratch."""
+
+    def count(table, criterion):
+        return (select([db.func.count()])
+                .select_from(table)
+                .where(criterion)
+                .as_scalar())
+
+    return {
+        User.messages_count: count(Message.__table__,
+                                   Message.user_id == User.id),
+        User.following_count: count(Follows.__table__,
+                                    Follows.user_following_id == User.id),
+        User.followers_count: count(Follows.__table__,
+                                    Follows.user_being_followed_id == User.id),
+        User.likes_count: count(Like.__table__, Like.user_id == User.id),
+    }
+
+
+def reconcile_users(*criteria):
+    """Recompute counters for users matching `criteria`.
+
+    Only rows whose counters have drifted are written. Returns the number
+    of users repaired.
+    """
+
+    counts = _user_counts()
+    drifted = db.or_(*[column != value for column, value in counts.items()])
+
+    return (User
+            .query
+            .filter(drifted, *criteria)
+            .update(counts, synchronize_session=False))
+
+
+def reconcile_messages(*criteria):
+    """Recompute `likes_count` for messages matching `criteria`.
+
+    Returns the number of messages repaired.
+    """
+
+    likes = (select([db.func.count()])
+             .where(Like.message_id == Message.id)
+             .as_scalar())
+
+    return (Message
+            .query
+            .filter(Message.likes_count != likes, *criteria)
+            .update({Message.likes_count: likes}, synchronize_session=False))
+
+
+def reconcile():
+    """Repair every drifted counter in bulk.
+
+    Returns a (users repaired, messages repaired) tuple.
+    """
+
+    return reconcile_users(), reconcile_messages()
@@ -0,0 +1,205 @@
+"""Windows of a conversation's DMs, by id.
+
+DMs are read in windows off the (conversation_id, id) index rather than
+loading a whole conversation: the newest few for the first render,
+`before_id` to scroll back through history, and `since_id` to pick up DMs
+sent after the newest one a client already has. Every window comes back
+oldest first, ready to append to the page.
+
+Clients that have the page open don't need to poll for new DMs: `events`
+streams them as Server-Sent Events and `wait_for_window` long-polls, both
+woken through the broker (see broker.py) when `published` is called.
+"""
+
+import json
+import time
+from collections import namedtuple
+
+from flask import abort, current_app, request
+
+from models import db, DM
+import broker
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+# Seconds a long-poll waits for a DM, between SSE keepalive comments, and
+# before an SSE stream ends and the browser reconnects.
+DEFAULT_POLL_TIMEOUT = 25
+DEFAULT_KEEPALIVE = 15
+DEFAULT_STREAM_SECONDS = 300
+
+# Milliseconds browsers wait before reconnecting a closed SSE stream.
+RECONNECT_MS = 1000
+
+Window = namedtuple('Window', ['items', 'has_more'])
+Window.__doc__ = """DMs oldest first, and whether more lie past the window.
+
+For a `since_id` window "more" are newer DMs; otherwise they're older.
+"""
+
+
+def per_page():
+    """Number of DMs in a window."""
+
+    return current_app.config.get('DMS_PER_PAGE', DEFAULT_PER_PAGE)
+
+
+def window(conversation_id, since_id=None, before_id=None, limit=None,
+           query=None):
+    """A window of `conversation_id`'s DMs.
+
+    With `since_id`, the oldest `limit` DMs newer than it; otherwise the
+    newest `limit` DMs, older than `before_id` if it's given. `query`
+    reads the rows, DM.query by default.
+    """
+
+    limit = limit or per_page()
+    query = (query or DM.query).filter(DM.conversation_id == conversation_id)
+
+    if since_id is not None:
+        rows = (query
+                .filter(DM.id > since_id)
+                .order_by(DM.id.asc())
+                .limit(limit + 1)
+                .all())
+        return Window(rows[:limit], len(rows) > limit)
+
+    if before_id is not None:
+        query = query.filter(DM.id < before_id)
+
+    rows = query.order_by(DM.id.desc()).limit(limit + 1).all()
+    return Window(rows[:limit][::-1], len(rows) > limit)
+
+
+def window_args():
+    """(since_id, before_id, limit) from the query string.
+
+    Aborts with a 400 if any is malformed or both ids are given.
+    """
+
+    since_id = int_arg('since_id')
+    before_id = int_arg('before_id')
+    limit = int_arg('limit')
+
+    if since_id is not None and before_id is not None:
+        abort(400)
+
+    return since_id, before_id, min(limit or per_page(), MAX_PER_PAGE)
+
+
+def int_arg(name):
+    """Non-negative integer query string argument `name`, or None if it's
+    missing or empty.
+
+    Aborts with a 400 if it's anything else.
+    """
+
+    value = request.args.get(name)
+    if not value:
+        return None
+    if not value.isdigit():
+        abort(400)
+    return int(value)
+
+
+def serialize(dm):
+    """JSON-ready dict of `dm`."""
+
+    return {
+        'id': dm.id,
+        'text': dm.text,
+        'author': dm.author,
+        'timestamp': dm.timestamp.isoformat(),
+    }
+
+
+def channel(conversation_id):
+    """Broker channel announcing new DMs in `conversation_id`."""
+
+    return f"conversation:{conversation_id}"
+
+
+def published(dm):
+    """Wake anyone streaming `dm`'s conversation.
+
+    Call after the DM is committed, so they can read it.
+    """
+
+    broker.publish(channel(dm.conversation_id), {'id': dm.id})
+
+
+def latest_id(conversation_id):
+    """Id of `conversation_id`'s newest DM, or 0 if it has none."""
+
+    return (db.session
+            .query(db.func.max(DM.id))
+            .filter(DM.conversation_id == conversation_id)
+            .scalar()) or 0
+
+
+def _read(conversation_id, since_id):
+    """The window after `since_id`, serialized.
+
+    The session is closed afterwards so an idle stream doesn't hold a
+    database connection while it waits.
+    """
+
+    try:
+        newer = window(conversation_id, since_id=since_id)
+        return [serialize(dm) for dm in newer.items], newer.has_more
+    finally:
+        db.session.close()
+
+
+def wait_for_window(conversation_id, since_id, timeout=None):
+    """Long-poll for DMs after `since_id`.
+
+    Returns (DMs, has_more) as soon as there are any, or empty once
+    `timeout` seconds pass.
+    """
+
+    if timeout is None:
+        timeout = current_app.config.get('STREAM_POLL_TIMEOUT',
+                                         DEFAULT_POLL_TIMEOUT)
+    deadline = time.monotonic() + timeout
+
+    # Subscribe before reading so a DM sent in between isn't missed.
+    with broker.subscribe(channel(conversation_id)) as subscription:
+        while True:
+            items, has_more = _read(conversation_id, since_id)
+            remaining = deadline - time.monotonic()
+            if items or remaining <= 0:
+                return items, has_more
+            subscription.get(remaining)
+
+
+def events(conversation_id, since_id):
+    """Server-Sent Events text for each DM after `since_id` as it's sent.
+
+    Each event's id is the DM's, so a reconnecting browser resumes from
+    the last one it saw. Idle streams send keepalive comments, and end
+    after STREAM_MAX_SECONDS to be reconnected.
+    """
+
+    config = current_app.config
+    keepalive = config.get('STREAM_KEEPALIVE', DEFAULT_KEEPALIVE)
+    deadline = time.monotonic() + config.get('STREAM_MAX_SECONDS',
+                                             DEFAULT_STREAM_SECONDS)
+
+    yield f"retry: {RECONNECT_MS}\n\n"
+
+    with broker.subscribe(channel(conversation_id)) as subscription:
+        while True:
+            items, has_more = _read(conversation_id, since_id)
+            for item in items:
+                yield f"id: {item['id']}\ndata: {json.dumps(item)}\n\n"
+                since_id = item['id']
+            if has_more:
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not subscription.get(min(keepalive, remaining)):
+                yield ": keepalive\n\n"
@@ -0,0 +1,188 @@
+"""Following and unfollowing, and pages of who follows whom.
+
+`add` and `remove` apply any number of follows or unfollows with one
+statement per chunk, ``INSERT ... ON CONFLICT DO NOTHING`` and
+``DELETE ... WHERE (follower, followed) IN (...)``, touching only the
+rows involved rather than loading anyone's whole `following` list, and
+bump each affected counter once. `bulk` (behind the bulk endpoint and
+``flask follows import``) leaves the timelines and suggestions of the
+follows it changes to a 'bulk_follows' job (see jobs.py).
+
+Both lists are newest follow first and keyset-paginated on
+``(created_at, user id)`` (see pagination.py), reading the follows table
+through an index on each side, so a popular account's hundredth page of
+followers costs the same as its first.
+"""
+
+from itertools import groupby, islice
+from operator import itemgetter
+
+from flask import current_app
+from sqlalchemy import tuple_
+
+from models import db, insert_ignoring_duplicates, Follows, User
+import counters
+import http_cache
+import jobs
+import pagination
+import suggestions
+import timeline
+
+DEFAULT_PER_PAGE = 60
+DEFAULT_CHUNK_SIZE = 1000
+
+PAIR = (Follows.user_following_id, Follows.user_being_followed_id)
+
+
+def per_page():
+    """Number of users shown per page."""
+
+    return current_app.config.get('FOLLOWS_PER_PAGE', DEFAULT_PER_PAGE)
+
+
+def follow_key(row):
+    user, created_at = row
+    return (created_at, user.id)
+
+
+def page_of(user_column, owner_column, owner_id, before, after, limit):
+    query = (db.session
+             .query(User, Follows.created_at)
+             .join(Follows, user_column == User.id)
+             .filter(owner_column == owner_id))
+
+    limit = limit or per_page()
+    page = pagination.paginate(query, Follows.created_at, user_column,
+                               before, after, limit, key=follow_key)
+    return page._replace(items=[user for user, _ in page.items])
+
+
+def following(user_id, before=None, after=None, limit=None):
+    """One page of the users `user_id` follows."""
+
+    return page_of(Follows.user_being_followed_id, Follows.user_following_id,
+                   user_id, before, after, limit)
+
+
+def followers(user_id, before=None, after=None, limit=None):
+    """One page of the users following `user_id`."""
+
+    return page_of(Follows.user_following_id, Follows.user_being_followed_id,
+                   user_id, before, after, limit)
+
+
+##############################################################################
+# Following and unfollowing
+
+def _existing(pairs):
+    """Which of the (follower, followed) `pairs` are follows."""
+
+    return set(db.session.query(*PAIR).filter(tuple_(*PAIR).in_(pairs)))
+
+
+def _count(pairs, delta):
+    following, followers = {}, {}
+    for follower_id, followed_id in pairs:
+        following[follower_id] = following.get(follower_id, 0) + delta
+        followers[followed_id] = followers.get(followed_id, 0) + delta
+    counters.follows_changed(following, followers)
+    http_cache.viewer_changed(following)
+
+
+def add(pairs):
+    """Make each (follower id, followed id) pair a follow; doesn't commit.
+
+    Users following themselves or users who don't exist are skipped.
+    Returns the set of pairs that weren't follows already.
+    """
+
+    pairs = {(follower_id, followed_id) for follower_id, followed_id in pairs
+             if follower_id != followed_id}
+    if not pairs:
+        return set()
+
+    ids = {id for pair in pairs for id in pair}
+    users = {id for (id,) in
+             db.session.query(User.id).filter(User.id.in_(ids))}
+    pairs = {pair for pair in pairs if pair[0] in users and pair[1] in users}
+    if not pairs:
+        return set()
+
+    statement = insert_ignoring_duplicates(Follows.__table__).values([
+        {'user_following_id': follower_id,
+         'user_being_followed_id': followed_id}
+        for follower_id, followed_id in pairs])
+
+    if db.engine.dialect.name == 'postgresql':
+        added = set(map(tuple, db.session.execute(statement.returning(*PAIR))))
+    else:
+        added = pairs - _existing(pairs)
+        db.session.execute(statement)
+
+    _count(added, 1)
+    return added
+
+
+def remove(pairs):
+    """Undo each (follower id, followed id) follow; doesn't commit.
+
+    Returns the set of pairs that were follows.
+    """
+
+    pairs = set(pairs)
+    if not pairs:
+        return set()
+
+    statement = Follows.__table__.delete().where(tuple_(*PAIR).in_(pairs))
+
+    if db.engine.dialect.name == 'postgresql':
+        removed = set(map(tuple, db.session.execute(statement.returning(*PAIR))))
+    else:
+        removed = _existing(pairs)
+        db.session.execute(statement)
+
+    _count(removed, -1)
+    return removed
+
+
+def bulk(changes, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Apply many follows and unfollows in order, committing each chunk.
+
+    `changes` are (following, (follower id, followed id)) pairs, True to
+    follow and False to unfollow. Runs of the same kind are applied in
+    chunks, so a pair unfollowed and then followed again ends up followed.
+
+    Returns the number of follows added and removed.
+    """
+
+    changed = {True: 0, False: 0}
+
+    for following, run in groupby(changes, key=itemgetter(0)):
+        pairs = (pair for _, pair in run)
+        while True:
+            chunk = list(islice(pairs, chunk_size))
+            if not chunk:
+                break
+            done = add(chunk) if following else remove(chunk)
+            if done:
+                jobs.enqueue('bulk_follows', following=following,
+                             pairs=sorted(done))
+            db.session.commit()
+            changed[following] += len(done)
+
+    return changed[True], changed[False]
+
+
+@jobs.handler('bulk_follows')
+def follows_changed(payloads):
+    """Update timelines and suggestions for follows made or undone in
+    bulk."""
+
+    for payload in payloads:
+        for follower_id, followed_id in payload['pairs']:
+            if payload['following']:
+                timeline.backfill_follow(follower_id, followed_id)
+            else:
+                timeline.remove_follow(follower_id, followed_id)
+            suggestions.follow_changed(follower_id, followed_id,
+                                       payload['following'])
@@ -39,3 +39,7 @@ class EditProfileForm(FlaskForm):
 
 class LikesForm(FlaskForm):
     pass
+
+
+class CSRFForm(FlaskForm):
+    """Form with nothing but a CSRF token, for POSTs without fields."""
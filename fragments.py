@@ -0,0 +1,89 @@
+"""Cache of rendered template fragments.
+
+Message cards and profile headers look the same to every viewer apart
+from a few bits (the like heart, the follow button), so each is rendered
+once and reused. Templates wrap a fragment in a call block:
+
+    {% set like %}...viewer's like form...{% endset %}
+    {% call cached('message-card', msg, msg.user, viewer=like) %}
+      ...card, with {{ VIEWER_SLOT }} where the like form goes...
+    {% endcall %}
+
+The fragment is keyed by its name and the id of each object it shows,
+plus the version of each user, and the `viewer` HTML is put into its slot
+after it comes out of the cache.
+
+Changing a profile bumps the user's `version` column (`bump_user`), so
+fragments showing the old one are never looked up again and age out of
+the cache. Versions live in the database rather than the cache, so a
+bump made by one worker retires fragments in every worker's cache, even
+with the per-process 'memory' backend, and they're read with the user
+at no extra cost. Messages can't be edited and deleted ones are never
+shown again, so their ids are enough.
+"""
+
+from flask import current_app
+from markupsafe import Markup
+
+from caching import make_cache
+from models import Message, User
+
+# Marks where viewer-specific HTML goes in a cached fragment.
+VIEWER_SLOT = Markup('<!--viewer-->')
+
+KINDS = {Message: 'message', User: 'user'}
+
+
+def init_app(app):
+    """Set up the fragment cache configured on `app`, and its template
+    globals."""
+
+    app.extensions['fragment_cache'] = make_cache(
+        app.config.get('FRAGMENT_CACHE', 'memory'),
+        url=app.config.get('FRAGMENT_CACHE_URL'),
+        maxsize=app.config.get('FRAGMENT_CACHE_SIZE', 50000),
+        max_bytes=app.config.get('FRAGMENT_CACHE_BYTES', 64 * 1024 * 1024),
+        ttl=app.config.get('FRAGMENT_CACHE_TTL', 300),
+        prefix="warbler:fragment:")
+
+    app.jinja_env.globals.update(cached=cached, VIEWER_SLOT=VIEWER_SLOT)
+
+
+def get_cache():
+    return current_app.extensions['fragment_cache']
+
+
+def bump_user(user_id):
+    """A user's profile was changed or deleted; doesn't commit."""
+
+    (User
+     .query
+     .filter(User.id == user_id)
+     .update({User.version: User.version + 1}, synchronize_session=False))
+
+
+def fragment_key(name, objects):
+    parts = [name]
+    for obj in objects:
+        part = f"{KINDS[type(obj)]}:{obj.id}"
+        if isinstance(obj, User):
+            part += f":{obj.version}"
+        parts.append(part)
+    return "|".join(parts)
+
+
+def cached(name, *objects, viewer='', caller):
+    """Fragment `name` showing `objects`, rendered by `caller` on a miss.
+
+    `viewer` is put in place of the fragment's VIEWER_SLOT.
+    """
+
+    cache = get_cache()
+    key = fragment_key(name, objects)
+
+    html = cache.get(key)
+    if html is None:
+        html = str(caller())
+        cache.set(key, html)
+
+    return Markup(html.replace(VIEWER_SLOT, str(viewer)))
@@ -3,12 +3,23 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Rows are written as they are generated, so memory use stays flat however
+many rows are asked for; load-testing sized datasets can be made with e.g.:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000
+
+Nothing is fetched over the network: header images come from the offline
+pool in header_images.txt and text is sampled from a fixed pool of fake
+sentences.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+import time
+
 from faker import Faker
 from helpers import get_random_datetime
 
@@ -17,10 +28,24 @@ MAX_WARBLER_LENGTH = 140
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+CONVERSATIONS_CSV_HEADERS = ['user1_id', 'user2_id']
+DMS_CSV_HEADERS = ['text', 'timestamp', 'conversation_id', 'author']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
+NUM_LIKES = 0
+NUM_CONVERSATIONS = 0
+DMS_PER_CONVERSATION = 10
+
+# Hash of "password", shared by every generated user.
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Size of the pools of fake text that rows are sampled from.
+TEXT_POOL_SIZE = 5000
+
+GENERATOR_DIR = os.path.dirname(os.path.abspath(__file__))
 
 fake = Faker()
 
@@ -32,46 +57,149 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header image URLs to use for users
+
+with open(os.path.join(GENERATOR_DIR, 'header_images.txt')) as header_images:
+    header_image_urls = header_images.read().split()
+
+
+def spread(total, buckets):
+    """Yield `buckets` random counts that add up to about `total`."""
+
+    average = total / buckets if buckets else 0
+    for _ in range(buckets):
+        yield round(random.expovariate(1 / average)) if average else 0
+
+
+def sample_ids(count, max_id, exclude=None):
+    """`count` distinct ids from 1..max_id, never `exclude`."""
+
+    count = min(count, max_id - (exclude is not None))
+    ids = random.sample(range(1, max_id + 1), min(count + 1, max_id))
+    return [id for id in ids if id != exclude][:count]
+
+
+def write_csv(path, headers, rows):
+    """Stream `rows` to a CSV at `path`; returns the number written."""
+
+    start = time.monotonic()
+    written = 0
+
+    with open(path, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+
+    elapsed = time.monotonic() - start
+    print(f"{os.path.basename(path)}: {written:,} rows "
+          f"({written / elapsed if elapsed else 0:,.0f} rows/s)")
+    return written
+
+
+def users(num_users):
+    sentences = [fake.sentence() for _ in range(TEXT_POOL_SIZE)]
+    cities = [fake.city() for _ in range(TEXT_POOL_SIZE)]
+    names = [fake.user_name() for _ in range(TEXT_POOL_SIZE)]
+    domains = [fake.free_email_domain() for _ in range(20)]
+
+    for i in range(1, num_users + 1):
+        # Suffix with the row number so names stay unique at any scale.
+        username = f"{random.choice(names)}{i}"
+        yield (f"{username}@{random.choice(domains)}",
+               username,
+               random.choice(image_urls),
+               PASSWORD,
+               random.choice(sentences),
+               random.choice(header_image_urls),
+               random.choice(cities))
+
+
+def messages(num_messages, num_users, texts):
+    for _ in range(num_messages):
+        yield (random.choice(texts),
+               get_random_datetime(),
+               random.randint(1, num_users))
+
+
+def follows(num_follows, num_users):
+    # Each user follows a random number of others, sampled without
+    # replacement, so pairs are unique without holding them all in memory.
+    for follower, count in enumerate(spread(num_follows, num_users), 1):
+        for followed in sample_ids(count, num_users, exclude=follower):
+            yield (followed, follower)
+
+
+def likes(num_likes, num_users, num_messages):
+    for user_id, count in enumerate(spread(num_likes, num_users), 1):
+        for message_id in sample_ids(count, num_messages):
+            yield (user_id, message_id)
+
+
+def conversations(num_conversations, num_users):
+    # One conversation per pair of users, stored with user1_id < user2_id;
+    # about half of each user's sampled partners are dropped by that rule.
+    for user1_id, count in enumerate(
+            spread(2 * num_conversations, num_users), 1):
+        for user2_id in sample_ids(count, num_users):
+            if user1_id < user2_id:
+                yield (user1_id, user2_id)
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+def dms(pairs_path, dms_per_conversation, texts):
+    with open(pairs_path, newline='') as pairs:
+        reader = csv.reader(pairs)
+        next(reader)
+        for conversation_id, (user1_id, user2_id) in enumerate(reader, 1):
+            for _ in range(random.randint(1, 2 * dms_per_conversation)):
+                yield (random.choice(texts),
+                       get_random_datetime(),
+                       conversation_id,
+                       random.choice((user1_id, user2_id)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS)
+    parser.add_argument('--likes', type=int, default=NUM_LIKES)
+    parser.add_argument('--conversations', type=int, default=NUM_CONVERSATIONS)
+    parser.add_argument('--dms-per-conversation', type=int,
+                        default=DMS_PER_CONVERSATION)
+    parser.add_argument('--out', default=GENERATOR_DIR,
+                        help="directory to write the CSVs to")
+    parser.add_argument('--seed', type=int, help="random seed")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        fake.seed_instance(args.seed)
+
+    def path(name):
+        return os.path.join(args.out, name)
+
+    texts = [fake.paragraph()[:MAX_WARBLER_LENGTH]
+             for _ in range(TEXT_POOL_SIZE)]
+
+    write_csv(path('users.csv'), USERS_CSV_HEADERS, users(args.users))
+    write_csv(path('messages.csv'), MESSAGES_CSV_HEADERS,
+              messages(args.messages, args.users, texts))
+    write_csv(path('follows.csv'), FOLLOWS_CSV_HEADERS,
+              follows(args.follows, args.users))
+
+    if args.likes:
+        write_csv(path('likes.csv'), LIKES_CSV_HEADERS,
+                  likes(args.likes, args.users, args.messages))
+
+    if args.conversations:
+        write_csv(path('conversations.csv'), CONVERSATIONS_CSV_HEADERS,
+                  conversations(args.conversations, args.users))
+        write_csv(path('dms.csv'), DMS_CSV_HEADERS,
+                  dms(path('conversations.csv'), args.dms_per_conversation,
+                      texts))
+
+
+if __name__ == '__main__':
+    main()
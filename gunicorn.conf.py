@@ -0,0 +1,22 @@
+"""gunicorn settings.
+
+DM streams (see dms.py) hold a connection open per reader, so workers are
+gevent workers that each serve up to GUNICORN_WORKER_CONNECTIONS
+connections from green threads instead of one request per process.
+
+With more than one worker, set BROKER=postgres (or redis) so a DM sent
+through one worker reaches streams held open by the others.
+"""
+
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(
+    os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    # psycopg2 blocks in C; make it yield to other green threads.
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,164 @@
+"""Password hashing in a bounded pool of worker processes.
+
+bcrypt is deliberately slow. Running it in a separate process keeps it off
+the request thread's CPU and GIL, so threaded or async web workers keep
+serving other requests while a login is checked. At most
+`max_pending` hashes may be queued; beyond that, or if a hash takes
+longer than `timeout` seconds, `HashingBusy` is raised rather than
+letting logins pile up behind each other.
+
+The pool works under gunicorn's gevent workers (see gunicorn.conf.py):
+it's started on first use, after the worker has forked and been
+monkey-patched, so waiting on a hash yields to other green threads while
+the forked processes, which only ever run bcrypt, do the work.
+test_hashing.py checks this when gevent is installed.
+
+The cost factor comes from PASSWORD_HASH_ROUNDS. Hashes made with a
+different cost still verify, and `needs_rehash` tells the caller to
+re-hash the password while it has it in hand.
+"""
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_ROUNDS = 12
+
+# bcrypt only ever looks at the first 72 bytes of a password.
+MAX_PASSWORD_BYTES = 72
+
+
+class HashingBusy(Exception):
+    """Too many passwords are already waiting to be hashed."""
+
+
+def _encode(password):
+    return password.encode('UTF-8')[:MAX_PASSWORD_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(_encode(password), pw_hash.encode('UTF-8'))
+
+
+def rounds_of(pw_hash):
+    """Cost factor a bcrypt hash was made with."""
+
+    return int(pw_hash.split('$')[2])
+
+
+class HashingService:
+    """Hashes and checks passwords, in a process pool if `workers` > 0."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=32,
+                 timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    def _pool(self):
+        # Started on first use, so each forked web worker gets its own.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers)
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+
+        start = time.monotonic()
+        with self._lock:
+            self.pending += 1
+
+        try:
+            if not self.workers:
+                return fn(*args)
+
+            future = self._pool().submit(fn, *args)
+            try:
+                return future.result(self.timeout)
+            except TimeoutError:
+                # Drops it if it hasn't started; a running hash can't be
+                # stopped, but its slot is freed all the same.
+                future.cancel()
+                with self._lock:
+                    self.rejected += 1
+                raise HashingBusy()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.seconds += time.monotonic() - start
+            self._slots.release()
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a cost other than the configured one?"""
+
+        return rounds_of(pw_hash) != self.rounds
+
+    def metrics(self):
+        """Queue depth and throughput counters."""
+
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'seconds': self.seconds,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# Used outside an app context (scripts, model tests): hash inline.
+_inline = HashingService(workers=0)
+
+
+def init_app(app):
+    """Set up the hashing pool configured on `app`."""
+
+    app.extensions['hashing'] = HashingService(
+        rounds=app.config.get('PASSWORD_HASH_ROUNDS', DEFAULT_ROUNDS),
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 32))
+
+
+def service():
+    """The current app's hashing service."""
+
+    if has_app_context() and 'hashing' in current_app.extensions:
+        return current_app.extensions['hashing']
+
+    return _inline
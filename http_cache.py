@@ -0,0 +1,176 @@
+"""HTTP caching policies.
+
+Every response gets a Cache-Control header from a policy:
+
+- Static files requested through `url_for('static', ...)` carry a
+  fingerprint of their contents (``?v=...``), so they are cached for a
+  year; editing a file changes its URL.
+- Views choose a policy with the `cache_policy` decorator or by calling
+  `set_policy`. Views that don't choose are ``private, no-cache``.
+- Anything that isn't a successful GET or HEAD, or that changes the
+  session (logging in, showing flashed messages), is ``no-store``.
+
+Pages that are expensive to build answer conditional requests: `etag`
+builds a validator from version counters the view can read cheaply, and
+`conditional` replies 304 Not Modified without rendering when the client
+already has that version.
+"""
+
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from werkzeug.http import quote_etag
+
+from models import User
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Unfingerprinted static URLs (hard-coded paths) are cached briefly.
+STATIC_FALLBACK_MAX_AGE = 60 * 60
+
+DEFAULT_POLICY = {'private': True, 'no_cache': True}
+
+# Pages embed CSRF tokens that expire (WTF_CSRF_TIME_LIMIT, an hour by
+# default), so validators change this often to keep cached copies fresh.
+ETAG_PERIOD = 30 * 60
+
+
+def init_app(app):
+    """Apply caching policies to `app`'s responses."""
+
+    app.extensions['static_fingerprints'] = {}
+    app.url_defaults(fingerprint_static)
+    app.after_request(apply_policy)
+
+
+def fingerprint(filename):
+    """Short hash of static file `filename`'s contents, or None."""
+
+    fingerprints = current_app.extensions['static_fingerprints']
+    if filename not in fingerprints:
+        path = os.path.join(current_app.static_folder, filename)
+        try:
+            with open(path, 'rb') as file:
+                digest = hashlib.md5(file.read()).hexdigest()[:12]
+        except OSError:
+            digest = None
+        fingerprints[filename] = digest
+
+    return fingerprints[filename]
+
+
+def fingerprint_static(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = fingerprint(values['filename'])
+        if digest:
+            values['v'] = digest
+
+
+def cache_policy(**directives):
+    """Decorate a view to send Cache-Control `directives`.
+
+    Directives are werkzeug's ResponseCacheControl attributes, e.g.
+    ``cache_policy(public=True, max_age=300)``.
+    """
+
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            set_policy(**directives)
+            return view(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def set_policy(**directives):
+    """Send Cache-Control `directives` with this request's response."""
+
+    g.cache_policy = directives
+
+
+def has_flashes():
+    """Are flashed messages waiting to be shown?"""
+
+    return '_flashes' in session
+
+
+def apply_policy(response):
+    if request.endpoint == 'static':
+        if 'v' in request.args:
+            directives = {'public': True, 'max_age': STATIC_MAX_AGE}
+            # Werkzeug 0.15 has no attribute for this directive.
+            response.cache_control['immutable'] = None
+        else:
+            directives = {'public': True, 'max_age': STATIC_FALLBACK_MAX_AGE}
+
+    elif (request.method not in ('GET', 'HEAD')
+          or response.status_code not in (200, 304)
+          or session.modified
+          or has_flashes()):
+        directives = {'no_store': True}
+
+    else:
+        directives = g.get('cache_policy', DEFAULT_POLICY)
+        response.vary.add('Cookie')
+
+    for name, value in directives.items():
+        setattr(response.cache_control, name, value)
+
+    return response
+
+
+def viewer_version():
+    """Version of everything about the logged-in user that pages show.
+
+    Covers their profile (in the nav), who they follow (follow buttons)
+    and what they've liked (like hearts), from the version columns every
+    worker sees (see `viewer_changed`).
+    """
+
+    if not g.user:
+        return 'anon'
+
+    return (g.user.id, g.user.version, g.user.activity_version)
+
+
+def viewer_changed(user_ids):
+    """The users with `user_ids` liked, unliked, followed or unfollowed,
+    so pages look different to them; doesn't commit."""
+
+    user_ids = list(user_ids)
+    if user_ids:
+        (User
+         .query
+         .filter(User.id.in_(user_ids))
+         .update({User.activity_version: User.activity_version + 1},
+                 synchronize_session=False))
+
+
+def etag(*parts):
+    """Validator for this URL, showing the versions in `parts`, for this
+    viewer."""
+
+    raw = repr((request.full_path, parts, viewer_version(),
+                int(time.time() // ETAG_PERIOD)))
+    return hashlib.sha1(raw.encode('UTF-8')).hexdigest()[:20]
+
+
+def conditional(tag, render):
+    """Response for a page with ETag `tag`, built by `render` if needed.
+
+    Answers 304 Not Modified, skipping `render`, if the client sent
+    If-None-Match with `tag`.
+    """
+
+    if request.if_none_match.contains(tag) and not has_flashes():
+        response = current_app.response_class(status=304)
+        response.headers['ETag'] = quote_etag(tag)
+        return response
+
+    response = make_response(render())
+    response.set_etag(tag)
+    return response
@@ -0,0 +1,98 @@
+"""Cache of the logged-in user, so `add_user_to_g` skips the database.
+
+The cache holds a snapshot of each user's profile columns. A snapshot is
+turned back into a `User` attached to the current session without a
+query; columns left out of the snapshot (the password hash and the
+counters, which other users' actions change) load lazily on first use.
+
+Cache keys include a version token kept in the user's session. Changing
+the profile rotates the token, so the editor's next request misses the
+cache on every worker and sees the edit immediately.
+"""
+
+import secrets
+
+from flask import current_app, session
+from sqlalchemy.orm import make_transient_to_detached
+
+from caching import make_cache
+from models import db, User
+
+CURR_USER_VERSION_KEY = "curr_user_version"
+
+SNAPSHOT_COLUMNS = ('id', 'email', 'username', 'image_url',
+                    'header_image_url', 'bio', 'location')
+
+
+def init_app(app):
+    """Set up the identity cache configured on `app`."""
+
+    app.extensions['identity_cache'] = make_cache(
+        app.config.get('IDENTITY_CACHE', 'memory'),
+        url=app.config.get('IDENTITY_CACHE_URL'),
+        maxsize=app.config.get('IDENTITY_CACHE_SIZE', 10000),
+        ttl=app.config.get('IDENTITY_CACHE_TTL', 60),
+        prefix="warbler:identity:")
+
+
+def get_cache():
+    return current_app.extensions['identity_cache']
+
+
+def snapshot(user):
+    """Cacheable dict of `user`'s profile columns."""
+
+    return {column: getattr(user, column) for column in SNAPSHOT_COLUMNS}
+
+
+def restore(data):
+    """`User` built from a snapshot and attached to the session, unqueried."""
+
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def cache_key(user_id, version):
+    return f"{user_id}:{version}"
+
+
+def rotate_version():
+    """Give the logged-in user a new cache version."""
+
+    session[CURR_USER_VERSION_KEY] = secrets.token_hex(4)
+
+
+def load_user(user_id):
+    """The logged-in `User`, from the cache if possible.
+
+    Returns None if the user no longer exists.
+    """
+
+    if CURR_USER_VERSION_KEY not in session:
+        rotate_version()
+
+    cache = get_cache()
+    key = cache_key(user_id, session[CURR_USER_VERSION_KEY])
+
+    data = cache.get(key)
+    if data is not None:
+        return restore(data)
+
+    user = User.query.get(user_id)
+    if user is not None:
+        cache.set(key, snapshot(user))
+
+    return user
+
+
+def invalidate(user_id):
+    """Forget the logged-in `user_id`'s cached snapshot.
+
+    Call after changing the user's profile or deleting them.
+    """
+
+    if CURR_USER_VERSION_KEY in session:
+        get_cache().delete(cache_key(user_id, session[CURR_USER_VERSION_KEY]))
+
+    rotate_version()
@@ -0,0 +1,130 @@
+"""Per-user conversation inboxes for Warbler.
+
+Each participant of a conversation has an ``inbox_entries`` row holding the
+conversation's latest DM, when it was sent and how many DMs they haven't
+read yet. Rows are created with the conversation and updated as each DM is
+sent, so listing an inbox is one indexed range read over the user's own
+conversations, newest activity first, however many DMs exist in total.
+
+Conversations only show up in an inbox once they have a DM.
+
+None of these functions commit; callers commit along with the change that
+triggered them.
+"""
+
+from sqlalchemy import case, literal, select, union_all
+
+from models import db, Conversation, DM, InboxEntry
+import pagination
+
+
+def conversation_added(conversation_id, user1_id, user2_id):
+    """Create inbox entries for both participants of a new conversation."""
+
+    participants = {user1_id: user2_id, user2_id: user1_id}
+
+    db.session.execute(InboxEntry.__table__.insert(), [
+        {'user_id': user_id,
+         'conversation_id': conversation_id,
+         'other_user_id': other_user_id,
+         'unread_count': 0}
+        for user_id, other_user_id in participants.items()
+    ])
+
+
+def dm_added(dm):
+    """Make a newly sent `dm` its conversation's latest in both inboxes.
+
+    It counts as unread for everyone but its author. The DM must already
+    be flushed so it has an id and timestamp.
+    """
+
+    unread = case([(InboxEntry.user_id == dm.author, 0)], else_=1)
+
+    (InboxEntry
+     .query
+     .filter(InboxEntry.conversation_id == dm.conversation_id)
+     .update({InboxEntry.last_dm_id: dm.id,
+              InboxEntry.last_activity_at: dm.timestamp,
+              InboxEntry.unread_count: InboxEntry.unread_count + unread},
+             synchronize_session=False))
+
+
+def mark_read(user_id, conversation_id):
+    """`user_id` has read every DM in `conversation_id`."""
+
+    (InboxEntry
+     .query
+     .filter(InboxEntry.user_id == user_id,
+             InboxEntry.conversation_id == conversation_id,
+             InboxEntry.unread_count != 0)
+     .update({InboxEntry.unread_count: 0}, synchronize_session=False))
+
+
+def entry_key(entry):
+    """Sort key of an InboxEntry: its (last_activity_at, conversation_id)."""
+
+    return (entry.last_activity_at, entry.conversation_id)
+
+
+def inbox(user_id, before=None, after=None, limit=None):
+    """One page of `user_id`'s conversations, most recently active first.
+
+    Returns a `pagination.Page` of InboxEntry rows, with their other user
+    and latest DM loaded.
+    """
+
+    query = (InboxEntry
+             .query
+             .options(db.joinedload(InboxEntry.other_user),
+                      db.joinedload(InboxEntry.last_dm))
+             .filter(InboxEntry.user_id == user_id,
+                     InboxEntry.last_activity_at.isnot(None)))
+
+    return pagination.paginate(query,
+                               InboxEntry.last_activity_at,
+                               InboxEntry.conversation_id,
+                               before, after, limit, key=entry_key)
+
+
+def rebuild_all():
+    """Rebuild every inbox from the conversations and dms tables.
+
+    Unread counts can't be recovered, so every conversation comes back
+    read.
+    """
+
+    InboxEntry.query.delete(synchronize_session=False)
+
+    sides = union_all(
+        select([Conversation.user1_id,
+                Conversation.id,
+                Conversation.user2_id,
+                literal(0)]),
+        select([Conversation.user2_id,
+                Conversation.id,
+                Conversation.user1_id,
+                literal(0)])
+        .where(Conversation.user1_id != Conversation.user2_id))
+
+    db.session.execute(InboxEntry.__table__.insert().from_select(
+        ['user_id', 'conversation_id', 'other_user_id', 'unread_count'],
+        sides))
+
+    latest = (select([DM.id])
+              .where(DM.conversation_id == InboxEntry.conversation_id)
+              .order_by(DM.timestamp.desc(), DM.id.desc())
+              .limit(1)
+              .as_scalar())
+    (InboxEntry
+     .query
+     .update({InboxEntry.last_dm_id: latest}, synchronize_session=False))
+
+    sent_at = (select([DM.timestamp])
+               .where(DM.id == InboxEntry.last_dm_id)
+               .as_scalar())
+    (InboxEntry
+     .query
+     .filter(InboxEntry.last_dm_id.isnot(None))
+     .update({InboxEntry.last_activity_at: sent_at},
+             synchronize_session=False))
@@ -0,0 +1,153 @@
+"""A job queue in the database, for work that shouldn't hold up requests.
+
+A view `enqueue`s a job in its own transaction, so the job exists if and
+only if the view's changes were committed. ``flask worker`` processes
+(see `work`) claim ready jobs with ``SELECT ... FOR UPDATE SKIP LOCKED``,
+so any number of them can run side by side without taking the same job,
+and run each claimed job in the transaction that deletes it: a job's
+effects and its removal from the queue commit together.
+
+Jobs are claimed in batches, highest priority first. Consecutive jobs of
+the same kind go to their handler together, so a handler can do a
+batch's work in a few statements. If a batch fails its jobs are retried
+one at a time; a job that fails is retried later with exponential
+backoff, and after MAX_ATTEMPTS it is kept with `failed_at` set instead.
+
+Handlers are registered with `handler` and must be idempotent: a worker
+that dies mid-batch leaves its jobs to be run again.
+"""
+
+import logging
+import time
+import traceback
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+# Retry delays double from this, up to MAX_BACKOFF.
+BASE_BACKOFF = timedelta(seconds=2)
+MAX_BACKOFF = timedelta(hours=1)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function to run jobs of `kind`.
+
+    It's called with a list of payloads and doesn't commit.
+    """
+
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+
+    return register
+
+
+def enqueue(kind, priority=0, delay=None, **payload):
+    """Queue a `kind` job with `payload`; doesn't commit.
+
+    Higher priorities run first. `delay` is a timedelta to wait before
+    running it.
+    """
+
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler for {kind!r} jobs.")
+
+    job = Job(kind=kind, payload=payload, priority=priority,
+              run_at=datetime.utcnow() + (delay or timedelta()))
+    db.session.add(job)
+    return job
+
+
+def claim(limit):
+    """Lock up to `limit` ready jobs for this transaction."""
+
+    return (Job
+            .query
+            .filter(Job.failed_at.is_(None),
+                    Job.run_at <= datetime.utcnow())
+            .order_by(Job.priority.desc(), Job.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all())
+
+
+def backoff(attempts):
+    return min(BASE_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def failed(job, error):
+    """Record that `job` raised `error`; retry it later or give up."""
+
+    job.attempts += 1
+    job.last_error = error
+    if job.attempts >= MAX_ATTEMPTS:
+        job.failed_at = datetime.utcnow()
+        logger.error("Job %s (%s) failed for good:\n%s",
+                     job.id, job.kind, error)
+    else:
+        job.run_at = datetime.utcnow() + backoff(job.attempts)
+        logger.warning("Job %s (%s) failed; retrying:\n%s",
+                       job.id, job.kind, error)
+
+
+def run(kind, batch):
+    """Run a batch of `kind` jobs, each alone if the batch fails.
+
+    Returns the jobs that succeeded.
+    """
+
+    try:
+        with db.session.begin_nested():
+            HANDLERS[kind]([job.payload for job in batch])
+        return batch
+    except Exception:
+        if len(batch) > 1:
+            return [job for job in batch if run(kind, [job])]
+        failed(batch[0], traceback.format_exc())
+        return []
+
+
+def work_batch(limit=50):
+    """Claim and run up to `limit` jobs, and commit.
+
+    Returns the number of jobs claimed.
+    """
+
+    jobs = claim(limit)
+
+    for kind, batch in groupby(jobs, key=lambda job: job.kind):
+        batch = list(batch)
+        if kind not in HANDLERS:
+            for job in batch:
+                failed(job, f"No handler for {kind!r} jobs.")
+            continue
+
+        for job in run(kind, batch):
+            db.session.delete(job)
+
+    db.session.commit()
+    return len(jobs)
+
+
+def work(limit=50, poll=1.0, once=False):
+    """Run jobs until stopped, checking for new ones every `poll` seconds
+    when the queue is empty.
+
+    With `once`, stop when no jobs are ready. Returns the number claimed.
+    """
+
+    total = 0
+    while True:
+        claimed = work_batch(limit)
+        total += claimed
+        if claimed < limit:
+            if once:
+                return total
+            time.sleep(poll)
@@ -0,0 +1,220 @@
+"""Liking and unliking messages.
+
+`set_liked` writes a like or unlike as a single statement: a ``DELETE``,
+or an ``INSERT`` that does nothing if the like already exists. Counters
+are only bumped when a row actually changed, so double submits and
+concurrent requests can't skew them, and nothing needs to SELECT first.
+`toggle` tries the ``INSERT`` and only falls back to the ``DELETE`` if
+the like was already there, so concurrent toggles queue on the like's
+unique key instead of both deleting nothing and then both inserting.
+
+A popular message can get bursts of likes and unlikes, each of which
+would update the same counter rows. Setting LIKE_BUFFER_SECONDS turns on
+a write-behind `LikeBuffer`: likes are answered straight away, kept in
+memory for up to that many seconds, and written in one transaction that
+keeps only each user's last choice per message and bumps each counter
+once. Until then the liker's other pages may show the old state, and a
+worker that crashes loses its unwritten likes.
+"""
+
+import atexit
+import logging
+import threading
+
+from flask import current_app
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+
+from models import db, insert_ignoring_duplicates, Like, Message, User
+import counters
+import http_cache
+import trending
+
+logger = logging.getLogger(__name__)
+
+
+def _write(user_id, message_id, liked):
+    """Write the like row; returns whether it changed."""
+
+    if liked:
+        statement = insert_ignoring_duplicates(Like.__table__).values(
+            user_id=user_id, message_id=message_id)
+    else:
+        statement = Like.__table__.delete().where(
+            (Like.user_id == user_id) & (Like.message_id == message_id))
+
+    return db.session.execute(statement).rowcount == 1
+
+
+def set_liked(user_id, message_id, liked):
+    """Make `user_id` like or unlike `message_id`; doesn't commit.
+
+    Returns whether anything changed. Raises IntegrityError if liking a
+    message or as a user that doesn't exist.
+    """
+
+    changed = _write(user_id, message_id, liked)
+    if changed:
+        if liked:
+            counters.like_added(user_id, message_id)
+        else:
+            counters.like_removed(user_id, message_id)
+        trending.likes_changed({message_id: 1 if liked else -1})
+        http_cache.viewer_changed([user_id])
+    return changed
+
+
+def state(user_id, message_id):
+    """(liked, likes_count) for `message_id` as stored, or None if there
+    is no such message."""
+
+    has_liked = exists().where(
+        (Like.user_id == user_id) & (Like.message_id == message_id))
+
+    row = (db.session
+           .query(has_liked, Message.likes_count)
+           .filter(Message.id == message_id)
+           .first())
+
+    return row and (bool(row[0]), row[1])
+
+
+def toggle(user_id, message_id, liked=None):
+    """Like `message_id` if `user_id` hasn't, else unlike it; or set it
+    to `liked`.
+
+    Returns the new (liked, likes_count), or None if there is no such
+    message. Commits, or leaves the write to the buffer if there is one.
+    """
+
+    buffer = get_buffer()
+    if buffer is not None:
+        return buffer.toggle(user_id, message_id, liked)
+
+    try:
+        if liked is None:
+            liked = set_liked(user_id, message_id, True)
+            if not liked:
+                set_liked(user_id, message_id, False)
+        else:
+            set_liked(user_id, message_id, liked)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+
+    return state(user_id, message_id)
+
+
+class LikeBuffer:
+    """Likes waiting to be written, at most `seconds` after they're made
+    or as soon as `max_pending` are waiting."""
+
+    def __init__(self, app, seconds, max_pending=1000):
+        self.app = app
+        self.seconds = seconds
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flusher = None
+        self.full = threading.Event()
+
+    def toggle(self, user_id, message_id, liked=None):
+        stored = state(user_id, message_id)
+        if stored is None:
+            return None
+        stored_liked, count = stored
+
+        key = (user_id, message_id)
+        with self.lock:
+            if liked is None:
+                liked = not self.pending.get(key, stored_liked)
+            self.pending[key] = liked
+            if len(self.pending) >= self.max_pending:
+                self.full.set()
+
+        self.start()
+
+        return liked, count + int(liked) - int(stored_liked)
+
+    def start(self):
+        """Start the background flusher; in each forked worker, on first
+        use."""
+
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.run, daemon=True)
+                self.flusher.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            self.full.wait(self.seconds)
+            self.full.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing buffered likes failed.")
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def flush(self):
+        """Write every waiting like. Returns the number of rows changed."""
+
+        pending = self.take()
+        if not pending:
+            return 0
+
+        with self.app.app_context():
+            return write_batch(pending)
+
+
+def write_batch(pending):
+    """Write {(user_id, message_id): liked} and commit, bumping each
+    counter once.
+
+    Likes of messages or by users deleted in the meantime are dropped.
+    """
+
+    user_ids = {user_id for user_id, _ in pending}
+    message_ids = {message_id for _, message_id in pending}
+    users = {id for (id,) in
+             db.session.query(User.id).filter(User.id.in_(user_ids))}
+    messages = {id for (id,) in
+                db.session.query(Message.id).filter(
+                    Message.id.in_(message_ids))}
+
+    changed = 0
+    user_deltas, message_deltas = {}, {}
+    for (user_id, message_id), liked in pending.items():
+        if user_id not in users or message_id not in messages:
+            continue
+        if _write(user_id, message_id, liked):
+            changed += 1
+            delta = 1 if liked else -1
+            user_deltas[user_id] = user_deltas.get(user_id, 0) + delta
+            message_deltas[message_id] = (
+                message_deltas.get(message_id, 0) + delta)
+
+    counters.likes_changed(user_deltas, message_deltas)
+    trending.likes_changed(message_deltas)
+    http_cache.viewer_changed(user_deltas)
+    db.session.commit()
+
+    return changed
+
+
+def init_app(app):
+    """Set up the like buffer if LIKE_BUFFER_SECONDS is set on `app`."""
+
+    seconds = app.config.get('LIKE_BUFFER_SECONDS', 0)
+    app.extensions['like_buffer'] = (
+        LikeBuffer(app, seconds, app.config.get('LIKE_BUFFER_SIZE', 1000))
+        if seconds else None)
+
+
+def get_buffer():
+    return current_app.extensions.get('like_buffer')
@@ -0,0 +1,110 @@
+"""Who the logged-in user follows and which messages they've liked.
+
+Templates ask these questions once per card, so the answers are loaded
+into sets once per request and checked in O(1). A view can `prefetch`
+just the users or messages on the page it is about to render, which
+loads their membership in a single ``IN`` query instead of the viewer's
+entire follow and like history.
+"""
+
+from flask import g
+
+from models import db, Follows, Like
+
+
+class IdSet:
+    """Ids related to one owner, loaded all at once or for chosen ids."""
+
+    def __init__(self, column, owner_column, owner_id):
+        self.column = column
+        self.owner_column = owner_column
+        self.owner_id = owner_id
+        self.ids = set()
+        self.checked = set()
+        self.complete = False
+
+    def load(self, ids=None):
+        """Load membership for `ids`, or for everything if `ids` is None."""
+
+        query = (db.session
+                 .query(self.column)
+                 .filter(self.owner_column == self.owner_id))
+
+        if ids is None:
+            self.ids = {id for (id,) in query}
+            self.complete = True
+            return
+
+        ids = set(ids) - self.checked
+        if self.complete or not ids:
+            return
+
+        self.ids.update(id for (id,) in query.filter(self.column.in_(ids)))
+        self.checked.update(ids)
+
+    def __contains__(self, id):
+        if not self.complete and id not in self.checked:
+            self.load([id] if self.checked else None)
+
+        return id in self.ids
+
+
+class Membership:
+    """The viewer's follows and likes, for O(1) checks in templates."""
+
+    def __init__(self, user_id):
+        self.following = IdSet(Follows.user_being_followed_id,
+                               Follows.user_following_id, user_id)
+        self.liked = IdSet(Like.message_id, Like.user_id, user_id)
+
+    def prefetch(self, users=(), messages=()):
+        """Load membership for just these users and messages."""
+
+        user_ids = [user.id for user in users]
+        message_ids = [message.id for message in messages]
+
+        if user_ids:
+            self.following.load(user_ids)
+        if message_ids:
+            self.liked.load(message_ids)
+
+    def is_following(self, user):
+        """Does the viewer follow `user`?"""
+
+        return user.id in self.following
+
+    def has_liked(self, message):
+        """Has the viewer liked `message`?"""
+
+        return message.id in self.liked
+
+
+class AnonymousMembership:
+    """Logged-out viewers follow and like nothing."""
+
+    def prefetch(self, users=(), messages=()):
+        pass
+
+    def is_following(self, user):
+        return False
+
+    def has_liked(self, message):
+        return False
+
+
+def current():
+    """Membership for the logged-in user (`AnonymousMembership` if none)."""
+
+    if not getattr(g, 'user', None):
+        return AnonymousMembership()
+
+    if 'membership' not in g:
+        g.membership = Membership(g.user.id)
+
+    return g.membership
+
+
+def prefetch(users=(), messages=()):
+    """Prefetch the logged-in user's membership for a page."""
+
+    current().prefetch(users=users, messages=messages)
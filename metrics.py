@@ -0,0 +1,240 @@
+"""Per-request SQL instrumentation and a Prometheus /metrics endpoint.
+
+SQLAlchemy cursor events time every statement. During a request the
+timings are added up in `g.sql_stats`: how many statements ran, how long
+they took in total, and the slowest few. Statements slower than
+SQL_SLOW_SECONDS are logged.
+
+After each request the numbers are added to per-endpoint totals, which
+``GET /metrics`` serves in Prometheus' text format along with the state
+of the connection pool, the password hashing queue and the broker. The
+totals are per process: with several gunicorn workers, each one counts
+the requests it served.
+
+With SQL_METRICS_HEADERS (on by default in debug mode) responses also
+carry the request's numbers in ``X-SQL-Queries``, ``X-SQL-Time`` and
+``Server-Timing`` headers, and its slowest statement in ``X-SQL-Slowest``.
+If METRICS_TOKEN is set, /metrics requires it as a bearer token.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from flask import abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db
+import broker
+import hashing
+
+logger = logging.getLogger(__name__)
+
+# Slowest statements kept per request.
+SLOWEST_KEPT = 3
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RequestStats:
+    """SQL statements run while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+        self.slowest = []
+
+    def record(self, statement, seconds, slow):
+        self.count += 1
+        self.seconds += seconds
+        self.slow += slow
+        self.slowest.append((seconds, statement))
+        self.slowest.sort(key=lambda timing: timing[0], reverse=True)
+        del self.slowest[SLOWEST_KEPT:]
+
+
+class Totals:
+    """Per-endpoint totals since this process started."""
+
+    FIELDS = ('requests', 'request_seconds', 'sql_queries', 'sql_seconds',
+              'sql_slow_queries')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+
+    def observe(self, endpoint, seconds, stats):
+        with self.lock:
+            totals = self.endpoints[endpoint]
+            totals['requests'] += 1
+            totals['request_seconds'] += seconds
+            totals['sql_queries'] += stats.count
+            totals['sql_seconds'] += stats.seconds
+            totals['sql_slow_queries'] += stats.slow
+
+    def snapshot(self):
+        with self.lock:
+            return {endpoint: dict(totals)
+                    for endpoint, totals in self.endpoints.items()}
+
+
+def init_app(app):
+    """Instrument `app`'s requests and serve /metrics."""
+
+    app.extensions['metrics'] = Totals()
+
+    if not event.contains(Engine, 'before_cursor_execute', statement_started):
+        event.listen(Engine, 'before_cursor_execute', statement_started)
+        event.listen(Engine, 'after_cursor_execute', statement_finished)
+
+    app.before_request(request_started)
+    app.after_request(request_finished)
+    app.add_url_rule('/metrics', 'metrics', serve_metrics)
+
+
+def get_totals():
+    return current_app.extensions['metrics']
+
+
+def statement_started(conn, cursor, statement, parameters, context,
+                      executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+def statement_finished(conn, cursor, statement, parameters, context,
+                       executemany):
+    seconds = time.perf_counter() - conn.info['statement_started'].pop()
+
+    if not has_request_context() or 'sql_stats' not in g:
+        return
+
+    slow = seconds >= current_app.config.get('SQL_SLOW_SECONDS', 0.5)
+    if slow:
+        logger.warning("Slow statement (%.3fs) in %s: %s",
+                       seconds, request.endpoint, statement)
+    g.sql_stats.record(statement, seconds, slow)
+
+
+def request_started():
+    g.sql_stats = RequestStats()
+    g.request_started = time.perf_counter()
+
+
+def one_line(statement, length=200):
+    return re.sub(r'\s+', ' ', statement)[:length]
+
+
+def request_finished(response):
+    if 'sql_stats' not in g:
+        return response
+
+    stats = g.sql_stats
+    seconds = time.perf_counter() - g.request_started
+    get_totals().observe(request.endpoint or 'none', seconds, stats)
+
+    if current_app.config.get('SQL_METRICS_HEADERS', current_app.debug):
+        milliseconds = stats.seconds * 1000
+        response.headers['X-SQL-Queries'] = str(stats.count)
+        response.headers['X-SQL-Time'] = f"{milliseconds:.1f}ms"
+        response.headers['Server-Timing'] = (
+            f'db;dur={milliseconds:.1f};desc="{stats.count} statements"')
+        if stats.slowest:
+            slowest_seconds, statement = stats.slowest[0]
+            response.headers['X-SQL-Slowest'] = (
+                f"{slowest_seconds * 1000:.1f}ms {one_line(statement)}")
+
+    return response
+
+
+def escape(value):
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def render(families):
+    """Prometheus text for [(name, type, help, [(labels, value)])]."""
+
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{escape(val)}"'
+                                  for key, val in labels.items())
+            if label_text:
+                label_text = "{" + label_text + "}"
+            lines.append(f"{name}{label_text} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def endpoint_families():
+    totals = get_totals().snapshot()
+
+    def samples(field):
+        return [({'endpoint': endpoint}, values[field])
+                for endpoint, values in sorted(totals.items())]
+
+    return [
+        ('warbler_requests_total', 'counter',
+         "Requests handled.", samples('requests')),
+        ('warbler_request_seconds_total', 'counter',
+         "Time spent handling requests.", samples('request_seconds')),
+        ('warbler_sql_queries_total', 'counter',
+         "SQL statements run while handling requests.",
+         samples('sql_queries')),
+        ('warbler_sql_seconds_total', 'counter',
+         "Time spent in SQL statements while handling requests.",
+         samples('sql_seconds')),
+        ('warbler_sql_slow_queries_total', 'counter',
+         "SQL statements slower than SQL_SLOW_SECONDS.",
+         samples('sql_slow_queries')),
+    ]
+
+
+def pool_families():
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return []
+
+    return [
+        ('warbler_db_pool_size', 'gauge',
+         "Connections the pool keeps open.", [({}, pool.size())]),
+        ('warbler_db_pool_checked_out', 'gauge',
+         "Connections in use.", [({}, pool.checkedout())]),
+        ('warbler_db_pool_overflow', 'gauge',
+         "Connections open beyond the pool size.", [({}, pool.overflow())]),
+    ]
+
+
+def service_families():
+    hashes = hashing.service().metrics()
+
+    return [
+        ('warbler_password_hashes_pending', 'gauge',
+         "Passwords waiting to be hashed.", [({}, hashes['pending'])]),
+        ('warbler_password_hashes_total', 'counter',
+         "Passwords hashed or checked.", [({}, hashes['completed'])]),
+        ('warbler_password_hashes_rejected_total', 'counter',
+         "Hashes refused because the queue was full.",
+         [({}, hashes['rejected'])]),
+        ('warbler_password_hash_seconds_total', 'counter',
+         "Time spent hashing passwords.", [({}, hashes['seconds'])]),
+        ('warbler_broker_subscribers', 'gauge',
+         "Open event subscriptions.",
+         [({}, broker.get_broker().subscriber_count())]),
+    ]
+
+
+def serve_metrics():
+    """Prometheus metrics for this process."""
+
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+
+    text = render(endpoint_families() + pool_families() + service_families())
+    return current_app.response_class(text, content_type=CONTENT_TYPE)
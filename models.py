@@ -2,17 +2,29 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask import current_app, has_app_context, has_request_context
+from sqlalchemy import DDL, event, literal_column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import hashing
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
 
     __tablename__ = 'follows'
+    __table_args__ = (
+        # Follower and following lists are read newest follow first.
+        db.Index('ix_follows_followed_recent',
+                 'user_being_followed_id', 'created_at'),
+        db.Index('ix_follows_following_recent',
+                 'user_following_id', 'created_at'),
+    )
 
     user_being_followed_id = db.Column(
         db.Integer,
@@ -26,10 +38,27 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
 class Conversation(db.Model):
-    """Connection from one user to another for a dm """
+    """Connection from one user to another for a dm
+
+    Each pair of users has one conversation, stored with the lower user id
+    as user1_id so the pair has a single canonical key.
+    """
 
     __tablename__ = 'conversations'
+    __table_args__ = (
+        db.UniqueConstraint('user1_id', 'user2_id',
+                            name='uq_conversations_pair'),
+        db.CheckConstraint('user1_id <= user2_id',
+                           name='ck_conversations_pair_order'),
+    )
 
     id = db.Column(
         db.Integer, autoincrement=True, primary_key=True
@@ -37,19 +66,74 @@ class Conversation(db.Model):
 
     user1_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete="cascade"))
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False)
 
     user2_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete="cascade"))
-
-    db.UniqueConstraint('user1_id', 'user2_id')
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False)
 
     user1 = db.relationship("User", foreign_keys=[user1_id])
     user2 = db.relationship("User", foreign_keys=[user2_id])
 
     dms = db.relationship("DM", backref="conversation")
 
+    @staticmethod
+    def pair(user_id, other_user_id):
+        """The canonical (user1_id, user2_id) key for two users."""
+
+        return tuple(sorted((user_id, other_user_id)))
+
+    @classmethod
+    def get_or_create(cls, user_id, other_user_id):
+        """The conversation between two users, created if there isn't one.
+
+        Returns a (conversation id, created) tuple. On PostgreSQL this is a
+        single INSERT ... ON CONFLICT that returns the existing row on a
+        clash, so two concurrent requests can't both create the pair.
+        Elsewhere the insert runs in a savepoint and a clash falls back to
+        reading the row the other request created.
+
+        Raises IntegrityError if either user doesn't exist.
+        """
+
+        user1_id, user2_id = cls.pair(user_id, other_user_id)
+
+        if db.engine.dialect.name == 'postgresql':
+            statement = (postgresql.insert(cls.__table__)
+                         .values(user1_id=user1_id, user2_id=user2_id))
+            # The no-op update makes RETURNING give back the existing row;
+            # xmax is 0 only on a row this statement inserted.
+            statement = (statement
+                         .on_conflict_do_update(
+                             constraint='uq_conversations_pair',
+                             set_={'user1_id': statement.excluded.user1_id})
+                         .returning(cls.id, literal_column('xmax = 0')))
+            return tuple(db.session.execute(statement).first())
+
+        existing = (db.session
+                    .query(cls.id)
+                    .filter_by(user1_id=user1_id, user2_id=user2_id)
+                    .scalar())
+        if existing is not None:
+            return existing, False
+
+        try:
+            with db.session.begin_nested():
+                conversation = cls(user1_id=user1_id, user2_id=user2_id)
+                db.session.add(conversation)
+            return conversation.id, True
+        except IntegrityError:
+            existing = (db.session
+                        .query(cls.id)
+                        .filter_by(user1_id=user1_id, user2_id=user2_id)
+                        .scalar())
+            if existing is None:
+                # Not a clash, so one of the users doesn't exist.
+                raise
+            return existing, False
+
 
 class User(db.Model):
     """User in the system."""
@@ -96,11 +180,60 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
 
-    likes = db.relationship('Like')
+    # Bumped when the profile changes, retiring cached fragments of it
+    # (see fragments.py).
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
 
-    liked_messages = db.relationship("Message", secondary="likes")
+    # Bumped when the user likes, unlikes, follows or unfollows, changing
+    # how pages look to them (see http_cache.viewer_version).
+    activity_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
+    messages = db.relationship(
+        'Message', cascade="all, delete-orphan", passive_deletes=True)
+
+    likes = db.relationship(
+        'Like', cascade="all, delete-orphan", passive_deletes=True)
+
+    liked_messages = db.relationship(
+        "Message", secondary="likes", viewonly=True)
 
     followers = db.relationship(
         "User",
@@ -130,16 +263,38 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.query(
+            Follows
+            .query
+            .filter_by(user_being_followed_id=self.id,
+                       user_following_id=other_user.id)
+            .exists()
+        ).scalar()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.query(
+            Follows
+            .query
+            .filter_by(user_being_followed_id=other_user.id,
+                       user_following_id=self.id)
+            .exists()
+        ).scalar()
+
+    def stats(self):
+        """Counts shown in this user's profile header.
+
+        Returns a dict with `messages`, `following`, `followers` and `likes`,
+        read from the counter columns kept up to date by counters.py.
+        """
+
+        return {
+            'messages': self.messages_count,
+            'following': self.following_count,
+            'followers': self.followers_count,
+            'likes': self.likes_count,
+        }
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -148,7 +303,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hashing.service().hash(password)
 
         user = User(
             username=username,
@@ -169,13 +324,19 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the password was hashed with an outdated cost factor, it is
+        re-hashed on the returned user; the caller should commit.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            hasher = hashing.service()
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -185,6 +346,9 @@ class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_user_recent', 'user_id', 'timestamp', 'id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -199,7 +363,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -208,9 +372,65 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
-    likes = db.relationship('Like')
-    users_who_liked = db.relationship("User", secondary="likes")
+    likes = db.relationship(
+        'Like', cascade="all, delete-orphan", passive_deletes=True)
+    users_who_liked = db.relationship("User", secondary="likes", viewonly=True)
+
+    @classmethod
+    def with_authors(cls):
+        """Query for messages that loads their authors in the same statement.
+
+        Use this for any list that renders `msg.user`, so a page of messages
+        doesn't issue one extra query per row.
+        """
+
+        return cls.query.options(db.joinedload(cls.user))
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline.
+
+    Rows are written when a message is posted (fan-out-on-write) so the
+    home page is a single range read on (user_id, timestamp).
+    """
+
+    __tablename__ = 'timeline_entries'
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_recent',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
 
 
 class Like(db.Model):
@@ -220,15 +440,57 @@ class Like(db.Model):
     __table_args__ = (db.UniqueConstraint('user_id', 'message_id'),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'))
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id', ondelete='cascade'), index=True)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.now())
+
+
+
+
+class TrendingScore(db.Model):
+    """A message's time-decayed count of recent likes (see trending.py).
+
+    Only messages liked lately have one.
+    """
+
+    __tablename__ = 'trending'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
 
+    score = db.Column(
+        db.Float,
+        nullable=False,
+        index=True,
+    )
+
+
+class TrendingDecay(db.Model):
+    """When trending scores were last decayed: a single row (see
+    trending.py)."""
 
+    __tablename__ = 'trending_decay'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    decayed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
 
 
 class DM(db.Model):
     """the exact message, connected to a conversation"""
     __tablename__ = 'dms'
+    __table_args__ = (
+        db.Index('ix_dms_conversation_id', 'conversation_id', 'id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -243,7 +505,7 @@ class DM(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     conversation_id = db.Column(
@@ -257,14 +519,243 @@ class DM(db.Model):
         db.ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False,
     )
-    user = db.relationship("User", backref="dm")
+    user = db.relationship(
+        "User", backref=db.backref("dm", passive_deletes=True))
+
+
+class InboxEntry(db.Model):
+    """One conversation in one participant's inbox.
+
+    Kept up to date as DMs are sent (see inbox.py) so the inbox is a single
+    range read on (user_id, last_activity_at).
+    """
+
+    __tablename__ = 'inbox_entries'
+    __table_args__ = (
+        db.Index('ix_inbox_entries_user_recent',
+                 'user_id', 'last_activity_at', 'conversation_id'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    conversation_id = db.Column(
+        db.Integer,
+        db.ForeignKey('conversations.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    other_user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    last_dm_id = db.Column(
+        db.Integer,
+        db.ForeignKey('dms.id', ondelete='set null'),
+    )
+
+    last_activity_at = db.Column(
+        db.DateTime,
+    )
+
+    unread_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    other_user = db.relationship('User', foreign_keys=[other_user_id])
+    last_dm = db.relationship('DM')
+
+
+class Suggestion(db.Model):
+    """A user worth following, for another user (see suggestions.py).
+
+    `score` is how many of the people the user follows already follow the
+    suggested user.
+    """
+
+    __tablename__ = 'suggestions'
+    __table_args__ = (
+        db.Index('ix_suggestions_user_score', 'user_id', 'score'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    suggested_user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class Job(db.Model):
+    """Work queued to run outside requests, by `flask worker` (see
+    jobs.py)."""
+
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_ready', 'priority', 'id'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True,
+    )
+
+    kind = db.Column(
+        db.String(50),
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    # Higher priorities run first.
+    priority = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    # Set when a job has used up its attempts; it is kept for inspection.
+    failed_at = db.Column(
+        db.DateTime,
+    )
+
+
+# Search indexes (see search.py). These use PostgreSQL-only extensions, so
+# they are created with raw DDL that is skipped on other databases.
+
+POSTGRES_SEARCH_INDEXES = {
+    'users': {
+        'ix_users_username_trgm':
+            "CREATE INDEX ix_users_username_trgm ON users "
+            "USING gin (username gin_trgm_ops)",
+        'ix_users_bio_fts':
+            "CREATE INDEX ix_users_bio_fts ON users "
+            "USING gin (to_tsvector('english', coalesce(bio, '')))",
+    },
+    'messages': {
+        'ix_messages_text_fts':
+            "CREATE INDEX ix_messages_text_fts ON messages "
+            "USING gin (to_tsvector('english', text))",
+    },
+}
+
+event.listen(
+    db.metadata, 'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        dialect='postgresql'))
+
+for table_name, indexes in POSTGRES_SEARCH_INDEXES.items():
+    for statement in indexes.values():
+        event.listen(
+            db.metadata.tables[table_name], 'after_create',
+            DDL(statement).execute_if(dialect='postgresql'))
+
+
+def insert_ignoring_duplicates(table):
+    """An INSERT into `table` that skips rows whose key already exists."""
+
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('OR IGNORE', dialect='sqlite')
+
+
+def engine_options(config):
+    """SQLAlchemy engine options from the DB_* settings in `config`.
+
+    Pool sizing only applies to PostgreSQL. The statement timeout isn't
+    an engine option; see `limit_statements`.
+    """
+
+    options = {
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+    }
+
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('postgres'):
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 30))
+
+    return options
+
+
+def limit_statements(connection):
+    """Limit each transaction's statements to DB_STATEMENT_TIMEOUT
+    milliseconds while serving a request.
+
+    Anything else (CLI commands, the job worker, seed.py) runs bulk
+    rebuilds that take far longer, so its transactions have the limit
+    turned off, whatever the server's default. Only PostgreSQL, and only
+    when DB_STATEMENT_TIMEOUT is set.
+    """
+
+    if connection.dialect.name != 'postgresql' or not has_app_context():
+        return
+
+    timeout = int(current_app.config.get('DB_STATEMENT_TIMEOUT', 0))
+    if timeout:
+        connection.execute(
+            f"SET LOCAL statement_timeout = "
+            f"{timeout if has_request_context() else 0}")
 
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. Engine options come from the
+    app's DB_* settings (see `engine_options`); anything set in
+    SQLALCHEMY_ENGINE_OPTIONS overrides them.
     """
 
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
     db.app = app
     db.init_app(app)
+
+    if not event.contains(Engine, 'begin', limit_statements):
+        event.listen(Engine, 'begin', limit_statements)
@@ -0,0 +1,141 @@
+"""Keyset (cursor) pagination for message and user lists.
+
+Lists are ordered newest first on ``(timestamp, id)``. Instead of page
+numbers, a page links to its neighbours with opaque cursors encoding the
+``(timestamp, id)`` of its edge rows, so every page is an indexed range
+read no matter how deep it is and no OFFSET scans are ever issued.
+"""
+
+import base64
+import binascii
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 100
+
+Page = namedtuple('Page', ['items', 'before', 'after'])
+Page.__doc__ = """One page of a keyset-paginated list.
+
+`before` is the cursor for the next (older) page and `after` the cursor
+for the previous (newer) page; either is None at the ends of the list.
+"""
+
+
+class InvalidCursor(ValueError):
+    """A cursor that wasn't produced by `encode_cursor`."""
+
+
+def per_page():
+    """Number of messages shown per page."""
+
+    return current_app.config.get('MESSAGES_PER_PAGE', DEFAULT_PER_PAGE)
+
+
+def encode_cursor(timestamp, id):
+    """Make an opaque cursor for the row at (`timestamp`, `id`)."""
+
+    raw = f"{timestamp.isoformat()}|{id}".encode('UTF-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into a (timestamp, id) tuple."""
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('UTF-8')
+        timestamp, id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def cursor_args():
+    """Decoded (before, after) cursors from the query string.
+
+    Aborts with a 400 if either cursor is malformed.
+    """
+
+    try:
+        before = request.args.get('before')
+        after = request.args.get('after')
+        return (before and decode_cursor(before),
+                after and decode_cursor(after))
+    except InvalidCursor:
+        abort(400)
+
+
+def older_than(timestamp_col, id_col, cursor):
+    """Filter for rows strictly older than `cursor`."""
+
+    timestamp, id = cursor
+    return or_(timestamp_col < timestamp,
+               and_(timestamp_col == timestamp, id_col < id))
+
+
+def newer_than(timestamp_col, id_col, cursor):
+    """Filter for rows strictly newer than `cursor`."""
+
+    timestamp, id = cursor
+    return or_(timestamp_col > timestamp,
+               and_(timestamp_col == timestamp, id_col > id))
+
+
+def fetch(query, timestamp_col, id_col, before=None, after=None, limit=None):
+    """Read up to `limit` + 1 rows walking away from the cursor.
+
+    Rows come back in walk order: newest first when paging back with
+    `before` (or from the top), oldest first when paging forward with
+    `after`. Pass them to `make_page` to build the page.
+    """
+
+    limit = limit or per_page()
+
+    if after:
+        query = (query
+                 .filter(newer_than(timestamp_col, id_col, after))
+                 .order_by(timestamp_col.asc(), id_col.asc()))
+    else:
+        if before:
+            query = query.filter(older_than(timestamp_col, id_col, before))
+        query = query.order_by(timestamp_col.desc(), id_col.desc())
+
+    return query.limit(limit + 1).all()
+
+
+def message_key(msg):
+    """Sort key of a Message: its (timestamp, id)."""
+
+    return (msg.timestamp, msg.id)
+
+
+def make_page(rows, before=None, after=None, limit=None, key=message_key):
+    """Build a newest-first Page from rows returned by `fetch`."""
+
+    limit = limit or per_page()
+    has_more = len(rows) > limit
+    items = rows[:limit]
+
+    if after:
+        items.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before is not None, has_more
+
+    if not items:
+        return Page(items, None, None)
+
+    return Page(items,
+                encode_cursor(*key(items[-1])) if has_older else None,
+                encode_cursor(*key(items[0])) if has_newer else None)
+
+
+def paginate(query, timestamp_col, id_col, before=None, after=None,
+             limit=None, key=message_key):
+    """One keyset page of `query`, ordered by (`timestamp_col`, `id_col`)."""
+
+    rows = fetch(query, timestamp_col, id_col, before, after, limit)
+    return make_page(rows, before, after, limit, key)
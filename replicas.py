@@ -0,0 +1,170 @@
+"""Sending read-only requests to read replicas.
+
+Views marked `read_only` read from one of the REPLICA_URLS, picked
+round-robin for each request and skipped while it fails health checks.
+Everything else uses the primary database, and so does a read-only
+request that writes: from its first write on, the rest of the request
+reads from the primary too. Statements that lock rows (``FOR UPDATE``)
+always go to the primary.
+
+Replicas lag behind the primary, so after a request writes anything the
+user's next READ_YOUR_WRITES_SECONDS of requests read from the primary,
+and they see their new message or follow straight away.
+
+Without REPLICA_URLS every request uses the primary. For local testing,
+a replica URL can point at a second database kept in sync by hand, or
+at the primary's own database.
+"""
+
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import CompoundSelect, Select
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_UNTIL_KEY = "primary_until"
+
+
+class Router:
+    """Round-robin over replica binds that are passing health checks.
+
+    A replica is checked with `check(bind)` at most every `interval`
+    seconds; one that fails is skipped for `interval` seconds.
+    """
+
+    def __init__(self, binds, check, interval=5):
+        self.binds = list(binds)
+        self.check = check
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.position = 0
+        self.checked_at = {}
+        self.down_until = {}
+
+    def available(self, bind):
+        now = time.monotonic()
+        if now < self.down_until.get(bind, 0):
+            return False
+        if now - self.checked_at.get(bind, -self.interval) < self.interval:
+            return True
+
+        try:
+            self.check(bind)
+        except Exception:
+            logger.warning("Replica %s failed its health check.", bind,
+                           exc_info=True)
+            self.down_until[bind] = now + self.interval
+            return False
+
+        self.checked_at[bind] = now
+        return True
+
+    def pick(self):
+        """The next healthy replica bind, or None if none are."""
+
+        with self.lock:
+            start = self.position
+            self.position = (self.position + 1) % len(self.binds)
+
+        for offset in range(len(self.binds)):
+            bind = self.binds[(start + offset) % len(self.binds)]
+            if self.available(bind):
+                return bind
+
+        return None
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from the request's replica, if it has one."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            if not is_plain_read(clause):
+                # Read what was just written from where it was written.
+                g.replica = None
+                g.wrote = True
+            elif g.get('replica'):
+                db = self.app.extensions['sqlalchemy'].db
+                return db.get_engine(self.app, bind=g.replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with a `RoutingSession`."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def is_plain_read(clause):
+    """Is `clause` a SELECT that doesn't lock rows?"""
+
+    return (isinstance(clause, (Select, CompoundSelect))
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+def read_only(view):
+    """Mark `view` as safe to serve from a read replica."""
+
+    view.read_only = True
+    return view
+
+
+def init_app(app):
+    """Route `app`'s read-only requests to its REPLICA_URLS.
+
+    Call after `connect_db`.
+    """
+
+    urls = app.config.get('REPLICA_URLS') or []
+    binds = {f"replica{i}": url for i, url in enumerate(urls)}
+    if binds:
+        app.config['SQLALCHEMY_BINDS'] = {
+            **(app.config.get('SQLALCHEMY_BINDS') or {}), **binds}
+
+    def check(bind):
+        db = app.extensions['sqlalchemy'].db
+        with db.get_engine(app, bind=bind).connect() as connection:
+            connection.execute("SELECT 1")
+
+    app.extensions['replicas'] = (
+        Router(binds, check, app.config.get('REPLICA_CHECK_SECONDS', 5))
+        if binds else None)
+
+    app.before_request(choose_database)
+    app.after_request(remember_writes)
+
+
+def get_router():
+    return current_app.extensions.get('replicas')
+
+
+def choose_database():
+    """Pick a replica for this request if it's read-only."""
+
+    router = get_router()
+    view = current_app.view_functions.get(request.endpoint)
+
+    if (router is None
+            or request.method not in ('GET', 'HEAD')
+            or not getattr(view, 'read_only', False)
+            or session.get(PRIMARY_UNTIL_KEY, 0) > time.time()):
+        return
+
+    g.replica = router.pick()
+
+
+def remember_writes(response):
+    """Keep the user on the primary for a while after they write."""
+
+    if get_router() is not None and g.get('wrote'):
+        session[PRIMARY_UNTIL_KEY] = (
+            time.time() + current_app.config.get('READ_YOUR_WRITES_SECONDS', 5))
+
+    return response
@@ -0,0 +1,270 @@
+"""User and message search.
+
+On PostgreSQL, search runs against trigram (``pg_trgm``) and full-text
+(``tsvector``) GIN indexes declared in models.py, so a query never scans
+the whole table. Elsewhere (the SQLite databases used for quick local
+testing) a pure-Python inverted index is built on first use and kept up
+to date by the `index_*`/`remove_*` hooks, which are no-ops on
+PostgreSQL. That index lives in each process and only sees the changes
+made through it, so it is for development only: with several workers,
+each one's results go stale as the others write.
+
+Results are ranked best match first and paged with `page` numbers.
+"""
+
+import re
+from collections import defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from models import db, Message, User
+
+DEFAULT_PER_PAGE = 20
+MAX_PAGE = 50
+
+# Share of a query's trigrams a username needs to match, like pg_trgm's
+# similarity threshold.
+MIN_USERNAME_SIMILARITY = 0.3
+
+Results = namedtuple('Results', ['items', 'page', 'has_next'])
+
+
+def words(text):
+    """Lower-cased words of `text`."""
+
+    return re.findall(r"\w+", (text or "").lower())
+
+
+def trigrams(text):
+    """Trigrams of each word of `text`, padded the way pg_trgm does."""
+
+    grams = set()
+    for word in words(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def escape_like(text):
+    """`text` with LIKE's wildcards escaped, to match it literally with
+    ``escape='\\'``."""
+
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+
+class PostgresSearch:
+    """Search backed by PostgreSQL trigram and full-text indexes."""
+
+    def users(self, q, limit, offset):
+        bio = func.to_tsvector('english', func.coalesce(User.bio, ''))
+        query = func.plainto_tsquery('english', q)
+        rank = func.greatest(func.similarity(User.username, q),
+                             func.ts_rank(bio, query))
+
+        return (User
+                .query
+                .filter(or_(User.username.ilike(f"%{escape_like(q)}%",
+                                                escape='\\'),
+                            bio.op('@@')(query)))
+                .order_by(rank.desc(), User.id)
+                .limit(limit)
+                .offset(offset)
+                .all())
+
+    def messages(self, q, limit, offset):
+        text = func.to_tsvector('english', Message.text)
+        query = func.plainto_tsquery('english', q)
+
+        return (Message
+                .with_authors()
+                .filter(text.op('@@')(query))
+                .order_by(func.ts_rank(text, query).desc(),
+                          Message.timestamp.desc(), Message.id.desc())
+                .limit(limit)
+                .offset(offset)
+                .all())
+
+    def index_user(self, user):
+        pass
+
+    def remove_user(self, user):
+        pass
+
+    def index_message(self, message):
+        pass
+
+    def remove_message(self, message):
+        pass
+
+
+class InvertedIndex:
+    """Maps terms to the ids of the documents containing them."""
+
+    def __init__(self, terms):
+        self.terms = terms
+        self.postings = defaultdict(set)
+        self.documents = {}
+
+    def add(self, id, text):
+        self.remove(id)
+        terms = self.terms(text)
+        self.documents[id] = terms
+        for term in terms:
+            self.postings[term].add(id)
+
+    def remove(self, id):
+        for term in self.documents.pop(id, ()):
+            self.postings[term].discard(id)
+
+    def search(self, text):
+        """{id: score} for documents sharing terms with `text`.
+
+        The score is the fraction of the query's terms each one contains.
+        """
+
+        terms = self.terms(text)
+        hits = defaultdict(int)
+        for term in terms:
+            for id in self.postings.get(term, ()):
+                hits[id] += 1
+
+        return {id: count / len(terms) for id, count in hits.items()}
+
+
+class MemorySearch:
+    """Pure-Python search for databases without search indexes.
+
+    Per process and for development only; see the module docstring.
+    """
+
+    def __init__(self):
+        self.usernames = None
+        self.bios = None
+        self.texts = None
+        self.authors = {}
+
+    def build(self):
+        self.usernames = InvertedIndex(trigrams)
+        self.bios = InvertedIndex(lambda text: set(words(text)))
+        self.texts = InvertedIndex(lambda text: set(words(text)))
+        self.authors = {}
+
+        for user in User.query:
+            self.index_user(user)
+        for message in Message.query:
+            self.index_message(message)
+
+    def _ranked(self, scores, limit, offset):
+        ranked = sorted(scores, key=lambda id: (-scores[id], id))
+        return ranked[offset:offset + limit]
+
+    def users(self, q, limit, offset):
+        if self.usernames is None:
+            self.build()
+
+        scores = {id: score
+                  for id, score in self.usernames.search(q).items()
+                  if score >= MIN_USERNAME_SIMILARITY}
+        for id, score in self.bios.search(q).items():
+            scores[id] = max(scores.get(id, 0), score)
+
+        ids = self._ranked(scores, limit, offset)
+        users = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+        return [users[id] for id in ids if id in users]
+
+    def messages(self, q, limit, offset):
+        if self.texts is None:
+            self.build()
+
+        ids = self._ranked(self.texts.search(q), limit, offset)
+        messages = {msg.id: msg for msg in
+                    Message.with_authors().filter(Message.id.in_(ids))}
+        return [messages[id] for id in ids if id in messages]
+
+    def index_user(self, user):
+        if self.usernames is not None:
+            self.usernames.add(user.id, user.username)
+            self.bios.add(user.id, user.bio)
+
+    def remove_user(self, user):
+        if self.usernames is not None:
+            self.usernames.remove(user.id)
+            self.bios.remove(user.id)
+            for id, author in list(self.authors.items()):
+                if author == user.id:
+                    self.texts.remove(id)
+                    del self.authors[id]
+
+    def index_message(self, message):
+        if self.texts is not None:
+            self.texts.add(message.id, message.text)
+            self.authors[message.id] = message.user_id
+
+    def remove_message(self, message):
+        if self.texts is not None:
+            self.texts.remove(message.id)
+            self.authors.pop(message.id, None)
+
+
+def backend():
+    """The search backend for the current app, created on first use.
+
+    Set SEARCH_BACKEND to 'postgres' or 'memory' to override the choice
+    made from the database dialect.
+    """
+
+    extensions = current_app.extensions
+    if extensions.get('search') is None:
+        name = current_app.config.get('SEARCH_BACKEND')
+        if name is None:
+            is_postgres = db.engine.dialect.name == 'postgresql'
+            name = 'postgres' if is_postgres else 'memory'
+        extensions['search'] = (PostgresSearch() if name == 'postgres'
+                                else MemorySearch())
+
+    return extensions['search']
+
+
+def _paged(find, q, page, per_page):
+    page = min(max(page, 1), MAX_PAGE)
+    per_page = per_page or current_app.config.get('SEARCH_PER_PAGE',
+                                                  DEFAULT_PER_PAGE)
+    items = find(q, per_page + 1, (page - 1) * per_page)
+    return Results(items[:per_page], page, len(items) > per_page)
+
+
+def users(q, page=1, per_page=None):
+    """Users whose username or bio matches `q`, best match first."""
+
+    return _paged(backend().users, q, page, per_page)
+
+
+def messages(q, page=1, per_page=None):
+    """Messages whose text matches `q`, best match first."""
+
+    return _paged(backend().messages, q, page, per_page)
+
+
+def index_user(user):
+    """`user` was created or edited."""
+
+    backend().index_user(user)
+
+
+def remove_user(user):
+    """`user` and their messages were deleted."""
+
+    backend().remove_user(user)
+
+
+def index_message(message):
+    """`message` was posted."""
+
+    backend().index_message(message)
+
+
+def remove_message(message):
+    """`message` was deleted."""
+
+    backend().remove_message(message)
@@ -1,20 +1,195 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+Make the CSVs with generator/create_csvs.py, then:
 
+    python seed.py [--data-dir generator] [--chunk-size 10000]
 
-db.drop_all()
-db.create_all()
+Rows are streamed from the files rather than read into memory. On
+PostgreSQL each file is loaded with ``COPY``, and the tables' secondary
+indexes are dropped for the load and rebuilt once at the end, which is far
+cheaper than maintaining them row by row. Other databases fall back to
+chunked multi-row inserts.
+"""
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+import argparse
+import csv
+import os
+import time
+from datetime import datetime
+from itertools import islice
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+from app import app, db
+from models import (User, Message, Follows, Like, Conversation, DM,
+                    TimelineEntry, InboxEntry, TrendingScore,
+                    POSTGRES_SEARCH_INDEXES)
+import counters
+import inbox
+import timeline
+import trending
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+DEFAULT_DATA_DIR = 'generator'
+DEFAULT_CHUNK_SIZE = 10000
 
-db.session.commit()
+# Loaded in this order so foreign keys always point at rows already loaded.
+# The first three files are required; the rest are loaded if present.
+
+CSV_FILES = [
+    ('users.csv', User),
+    ('messages.csv', Message),
+    ('follows.csv', Follows),
+    ('likes.csv', Like),
+    ('conversations.csv', Conversation),
+    ('dms.csv', DM),
+]
+REQUIRED = {'users.csv', 'messages.csv', 'follows.csv'}
+
+
+def report(name, rows, start):
+    elapsed = time.monotonic() - start
+    print(f"{name}: {rows:,} rows "
+          f"({rows / elapsed if elapsed else 0:,.0f} rows/s)")
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_csv(path, table):
+    """Load `path` into `table` with PostgreSQL's COPY; returns row count."""
+
+    with open(path, newline='') as file:
+        columns = ', '.join(next(csv.reader(file)))
+        file.seek(0)
+
+        connection = db.session.connection().connection
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table.name} ({columns}) FROM STDIN "
+                f"WITH (FORMAT csv, HEADER true)",
+                file)
+            return cursor.rowcount
+
+
+def insert_csv(path, table, chunk_size):
+    """Load `path` into `table` in chunks of multi-row inserts."""
+
+    datetimes = {column.name for column in table.columns
+                 if isinstance(column.type, db.DateTime)}
+    rows = 0
+
+    with open(path, newline='') as file:
+        for chunk in chunks(csv.DictReader(file), chunk_size):
+            for row in chunk:
+                for name in datetimes & row.keys():
+                    row[name] = datetime.fromisoformat(row[name])
+
+            db.session.execute(table.insert(), chunk)
+            db.session.commit()
+            rows += len(chunk)
+
+    return rows
+
+
+def drop_indexes(tables):
+    """Drop secondary indexes on `tables`; returns a function to rebuild."""
+
+    connection = db.session.connection()
+    dropped = []
+
+    for table in tables:
+        for index in table.indexes:
+            index.drop(bind=connection)
+            dropped.append(index.create)
+
+        for name, statement in POSTGRES_SEARCH_INDEXES.get(
+                table.name, {}).items():
+            connection.execute(f"DROP INDEX IF EXISTS {name}")
+            dropped.append(
+                lambda bind, statement=statement: bind.execute(statement))
+
+    def rebuild():
+        start = time.monotonic()
+        connection = db.session.connection()
+        for create in dropped:
+            create(bind=connection)
+        db.session.commit()
+        report('indexes', len(dropped), start)
+
+    return rebuild
+
+
+def load(data_dir=DEFAULT_DATA_DIR, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Recreate the tables and load every CSV found in `data_dir`."""
+
+    db.drop_all()
+    db.create_all()
+
+    files = [(os.path.join(data_dir, name), model.__table__)
+             for name, model in CSV_FILES
+             if name in REQUIRED or os.path.exists(
+                 os.path.join(data_dir, name))]
+
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    if is_postgres:
+        rebuild_indexes = drop_indexes(table for _, table in files)
+
+    for path, table in files:
+        start = time.monotonic()
+        if is_postgres:
+            rows = copy_csv(path, table)
+            db.session.commit()
+        else:
+            rows = insert_csv(path, table, chunk_size)
+        report(table.name, rows, start)
+
+    if is_postgres:
+        rebuild_indexes()
+
+    # Counters aren't maintained by bulk loads, so compute them in one pass.
+
+    start = time.monotonic()
+    counters.reconcile()
+    db.session.commit()
+    report('counters', User.query.count(), start)
+
+    # Home timelines are materialized, so build them for the seeded follows.
+
+    start = time.monotonic()
+    timeline.rebuild_all()
+    db.session.commit()
+    report('timeline_entries', TimelineEntry.query.count(), start)
+
+    # Inboxes are too, so build them for the seeded conversations.
+
+    start = time.monotonic()
+    inbox.rebuild_all()
+    db.session.commit()
+    report('inbox_entries', InboxEntry.query.count(), start)
+
+    # And trending scores, for the seeded likes.
+
+    start = time.monotonic()
+    trending.rebuild()
+    db.session.commit()
+    report('trending', TrendingScore.query.count(), start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the Warbler database.")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help="directory holding the CSVs")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows per insert when COPY isn't available")
+    args = parser.parse_args()
+
+    with app.app_context():
+        load(args.data_dir, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,29 +5,125 @@ $(document).ready(function () {
   $('#dm-form').on('submit', function (evt) {
     evt.preventDefault();
     let text = $('#dm-input').val();
-    console.log("text is ", text);
     if (text.length > 1) {
-      let conversationArr = document.URL.split('/');
-      console.log(conversationArr);
-      let conversationId = parseInt(conversationArr[conversationArr.length - 1]);
       $('#dm-form').trigger('reset');
-      addDM(text, conversationId, function (resp) {
-        console.log(resp);
-      });
+      // fetch from our newest DM on, so anything the other user sent
+      // in the meantime shows up before ours
+      addDM(text, fetchNewerDMs);
     }
   });
+
+  $('#dm-older').on('click', function (evt) {
+    evt.preventDefault();
+    fetchOlderDMs();
+  });
+
+  $(document).on('submit', '.like-form', function (evt) {
+    evt.preventDefault();
+    toggleLike($(this));
+  });
+
+  if (dmList().length) streamDMs();
 });
 
-function addDM(text, conversationId, cb) {
+// like/unlike in place; the server answers with the new state
+function toggleLike($form) {
+  $.ajax({
+    method: 'POST',
+    url: $form.attr('action'),
+    data: $form.serialize(),
+    dataType: 'json',
+    success: resp => {
+      $form.find('.fa-heart')
+        .toggleClass('fas', resp.liked)
+        .toggleClass('far', !resp.liked);
+    }
+  });
+}
+
+// new DMs are pushed by the server; long-poll where EventSource is missing
+function streamDMs() {
+  if (window.EventSource) {
+    // an empty conversation streams from the start, so a DM sent before
+    // the stream opens isn't missed
+    let source = new EventSource(
+      `${dmsUrl()}/stream?since_id=${dmList().data('newest-id') || 0}`);
+    source.onmessage = evt => appendDMs([JSON.parse(evt.data)]);
+  } else {
+    longPollDMs();
+  }
+}
+
+function longPollDMs() {
+  let sinceId = dmList().data('newest-id') || 0;
+  $.getJSON(`${dmsUrl()}/stream`, { since_id: sinceId })
+    .done(resp => {
+      appendDMs(resp.dms);
+      longPollDMs();
+    })
+    .fail(() => setTimeout(longPollDMs, 5000));
+}
+
+function dmList() {
+  return $('.dm-list');
+}
+
+// relative, so the DM feeds and stream stay on the page's own origin
+function dmsUrl() {
+  return `/conversations/${dmList().data('conversation-id')}`;
+}
+
+function makeDM(dm) {
+  let mine = dm.author === dmList().data('user-id');
+  return $('<div>')
+    .addClass(mine ? 'my dm-row ml-auto' : 'their dm-row')
+    .attr('data-id', dm.id)
+    .text(dm.text);
+}
+
+// DMs arrive oldest first; skip any already on the page
+function appendDMs(dms) {
+  let $list = dmList();
+  for (let dm of dms) {
+    if ($list.children(`[data-id="${dm.id}"]`).length) continue;
+    $list.append(makeDM(dm));
+    $list.data('newest-id', dm.id);
+    if (!$list.data('oldest-id')) $list.data('oldest-id', dm.id);
+  }
+}
+
+function prependDMs(dms) {
+  let $list = dmList();
+  for (let dm of dms.slice().reverse()) {
+    $list.prepend(makeDM(dm));
+    $list.data('oldest-id', dm.id);
+  }
+}
+
+function fetchNewerDMs() {
+  let sinceId = dmList().data('newest-id');
+  $.getJSON(`${dmsUrl()}/dms`, sinceId ? { since_id: sinceId } : {}, resp => {
+    appendDMs(resp.dms);
+    if (resp.has_more) fetchNewerDMs();
+  });
+}
+
+function fetchOlderDMs() {
+  let beforeId = dmList().data('oldest-id');
+  $.getJSON(`${dmsUrl()}/dms`, { before_id: beforeId }, resp => {
+    prependDMs(resp.dms);
+    if (!resp.has_more) $('#dm-older').remove();
+  });
+}
+
+function addDM(text, cb) {
   $.ajax({
     method: 'POST',
-    url: `${BASE_URL}/conversations/${conversationId}/dm/add`,
+    url: `${BASE_URL}${dmsUrl()}/dm/add`,
     contentType: 'application/json',
     data: JSON.stringify({ text }),
     success: response => {
       cb(response);
     }
   });
-  // append it to the dom
-  $('.dm-list').append($(`<div class="my dm-row ml-auto">${text}</div>`));
 }
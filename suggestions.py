@@ -0,0 +1,259 @@
+"""Who to follow: friends-of-friends suggestions over the follow graph.
+
+A user is suggested the people followed by the people they follow,
+ranked by how many of those paths lead to them. `rebuild_all` (run
+periodically with ``flask rebuild-suggestions``) loads the follow graph
+into compressed sparse row arrays, counts every user's two-hop
+candidates in parallel across a process pool, and stores the top
+SUGGESTIONS_PER_USER for each. With NumPy installed the counting is
+vectorized; without it the same counts are made with plain Python.
+
+Between rebuilds, each follow and unfollow queues a 'follow_changed'
+job (see jobs.py) that adjusts the affected scores: the follower's, from
+the followed user's most recent follows, and those of the follower's own
+followers, unless they are too many (see timeline.is_high_fanout). These
+updates are approximate; the next rebuild makes the scores exact again.
+
+`suggestions` serves a user's list in one indexed read.
+"""
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from flask import current_app
+from sqlalchemy import and_, exists, literal, select
+
+from models import db, Follows, Suggestion, User
+import jobs
+import timeline
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_PER_USER = 50
+
+
+def per_user():
+    """Number of suggestions kept and shown per user."""
+
+    return current_app.config.get('SUGGESTIONS_PER_USER', DEFAULT_PER_USER)
+
+
+def suggestions(user_id, limit=None):
+    """The users suggested for `user_id`, best first.
+
+    Users they've since followed are left out.
+    """
+
+    followed = exists().where(and_(
+        Follows.user_following_id == user_id,
+        Follows.user_being_followed_id == Suggestion.suggested_user_id))
+
+    return (User
+            .query
+            .join(Suggestion, Suggestion.suggested_user_id == User.id)
+            .filter(Suggestion.user_id == user_id, ~followed)
+            .order_by(Suggestion.score.desc(), User.id)
+            .limit(limit or per_user())
+            .all())
+
+
+##############################################################################
+# Computing every user's suggestions
+
+def load_graph():
+    """The follow graph in compressed sparse row form.
+
+    Returns (ids, indptr, indices): users are numbered by their position
+    in the sorted `ids`, and the users that user number i follows are
+    ``indices[indptr[i]:indptr[i + 1]]``.
+    """
+
+    pairs = (db.session
+             .query(Follows.user_following_id, Follows.user_being_followed_id)
+             .order_by(Follows.user_following_id,
+                       Follows.user_being_followed_id)
+             .all())
+
+    if np is not None:
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        ids = np.unique(pairs)
+        followers = np.searchsorted(ids, pairs[:, 0])
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(followers, minlength=len(ids)), out=indptr[1:])
+        return ids, indptr, np.searchsorted(ids, pairs[:, 1])
+
+    ids = sorted({id for pair in pairs for id in pair})
+    number = {id: i for i, id in enumerate(ids)}
+    indptr = [0] * (len(ids) + 1)
+    for follower, _ in pairs:
+        indptr[number[follower] + 1] += 1
+    for i in range(len(ids)):
+        indptr[i + 1] += indptr[i]
+    return ids, indptr, [number[followed] for _, followed in pairs]
+
+
+def top_candidates(graph, row, k):
+    """[(user id, score)] of the `k` best suggestions for user `row`."""
+
+    ids, indptr, indices = graph
+    followed = indices[indptr[row]:indptr[row + 1]]
+
+    if np is None:
+        counts = Counter()
+        for user in followed:
+            counts.update(indices[indptr[user]:indptr[user + 1]])
+        excluded = {row, *followed}
+        ranked = sorted(((-count, user) for user, count in counts.items()
+                         if user not in excluded))[:k]
+        return [(ids[user], -count) for count, user in ranked]
+
+    # Gather everyone the followed users follow in one fancy-indexed read.
+    starts = indptr[followed]
+    lengths = indptr[followed + 1] - starts
+    offsets = (np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+               + np.arange(lengths.sum()))
+    candidates, counts = np.unique(indices[offsets], return_counts=True)
+
+    keep = ~np.isin(candidates, followed) & (candidates != row)
+    candidates, counts = candidates[keep], counts[keep]
+    best = np.lexsort((candidates, -counts))[:k]
+    return [(int(ids[user]), int(count))
+            for user, count in zip(candidates[best], counts[best])]
+
+
+_graph = None
+
+
+def _use_graph(graph):
+    global _graph
+    _graph = graph
+
+
+def _top_for_rows(rows, k):
+    ids = _graph[0]
+    return [{'user_id': int(ids[row]), 'suggested_user_id': user,
+             'score': score}
+            for row in rows
+            for user, score in top_candidates(_graph, row, k)]
+
+
+def compute(graph, k, workers=0, chunk_size=1000):
+    """Yield lists of suggestion rows for every user in `graph`.
+
+    Chunks of users are spread across `workers` processes, or computed
+    in this one if `workers` is 0.
+    """
+
+    chunks = [range(start, min(start + chunk_size, len(graph[0])))
+              for start in range(0, len(graph[0]), chunk_size)]
+
+    if not workers:
+        _use_graph(graph)
+        yield from map(_top_for_rows, chunks, repeat(k))
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_use_graph,
+                             initargs=(graph,)) as pool:
+        yield from pool.map(_top_for_rows, chunks, repeat(k))
+
+
+def rebuild_all(workers=0, chunk_size=1000):
+    """Recompute every user's suggestions; doesn't commit.
+
+    Returns the number of suggestions stored.
+    """
+
+    graph = load_graph()
+
+    Suggestion.query.delete(synchronize_session=False)
+    stored = 0
+    for rows in compute(graph, per_user(), workers, chunk_size):
+        if rows:
+            db.session.execute(Suggestion.__table__.insert(), rows)
+            stored += len(rows)
+
+    return stored
+
+
+##############################################################################
+# Incremental updates
+
+def adjust(user_ids, candidate_ids, delta):
+    """Add `delta` to the score of each of `candidate_ids` for each of
+    `user_ids` (both aliased selects of an ``id`` column), adding missing
+    suggestions if `delta` is positive and dropping ones that reach zero."""
+
+    pairs = (select([user_ids.c.id.label('user_id'),
+                     candidate_ids.c.id.label('suggested_user_id')])
+             .where(user_ids.c.id != candidate_ids.c.id)
+             .alias())
+    followed = exists().where(and_(
+        Follows.user_following_id == pairs.c.user_id,
+        Follows.user_being_followed_id == pairs.c.suggested_user_id))
+    suggested = exists().where(and_(
+        Suggestion.user_id == pairs.c.user_id,
+        Suggestion.suggested_user_id == pairs.c.suggested_user_id))
+
+    affected = and_(Suggestion.user_id.in_(select([user_ids.c.id])),
+                    Suggestion.suggested_user_id.in_(
+                        select([candidate_ids.c.id])))
+    (Suggestion
+     .query
+     .filter(affected)
+     .update({Suggestion.score: Suggestion.score + delta},
+             synchronize_session=False))
+
+    if delta > 0:
+        db.session.execute(Suggestion.__table__.insert().from_select(
+            ['user_id', 'suggested_user_id', 'score'],
+            select([pairs.c.user_id, pairs.c.suggested_user_id,
+                    literal(delta)])
+            .where(and_(~followed, ~suggested))))
+    else:
+        (Suggestion
+         .query
+         .filter(affected, Suggestion.score <= 0)
+         .delete(synchronize_session=False))
+
+
+def follow_changed(follower_id, followed_id, following):
+    """Adjust suggestions after `follower_id` followed or unfollowed
+    `followed_id`; doesn't commit."""
+
+    delta = 1 if following else -1
+
+    if following:
+        (Suggestion
+         .query
+         .filter_by(user_id=follower_id, suggested_user_id=followed_id)
+         .delete(synchronize_session=False))
+
+    # The follower gains or loses the followed user's recent follows...
+    their_follows = (select([Follows.user_being_followed_id.label('id')])
+                     .where(Follows.user_following_id == followed_id)
+                     .order_by(Follows.created_at.desc())
+                     .limit(per_user())
+                     .alias())
+    adjust(select([literal(follower_id).label('id')]).alias(),
+           their_follows, delta)
+
+    # ...and the follower's followers gain or lose the followed user.
+    if not timeline.is_high_fanout(follower_id):
+        followers = (select([Follows.user_following_id.label('id')])
+                     .where(Follows.user_being_followed_id == follower_id)
+                     .alias())
+        adjust(followers, select([literal(followed_id).label('id')]).alias(),
+               delta)
+
+
+@jobs.handler('follow_changed')
+def follows_changed(payloads):
+    """Apply queued follows and unfollows to suggestions, in order."""
+
+    for payload in payloads:
+        follow_changed(payload['follower_id'], payload['followed_id'],
+                       payload['following'])
@@ -0,0 +1,180 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import (db, User, Message, Follows, Like, TimelineEntry,
+                    Conversation, DM, InboxEntry)
+import counters
+import inbox
+import timeline
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        """u1 follows u2, who has posted five messages, a minute apart;
+        u1 has liked the newest, and has a conversation with u2."""
+
+        InboxEntry.query.delete()
+        DM.query.delete()
+        Conversation.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User.signup("apiuser1", "apiuser1@email.com", PASSWORD, None)
+        u2 = User.signup("apiuser2", "apiuser2@email.com", PASSWORD, None)
+        u3 = User.signup("apiuser3", "apiuser3@email.com", PASSWORD, None)
+        db.session.commit()
+        u1.following.append(u2)
+
+        start = datetime(2020, 1, 1)
+        messages = [Message(text=f"warble {i}", user_id=u2.id,
+                            timestamp=start + timedelta(minutes=i))
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+        db.session.add(Like(user_id=u1.id, message_id=messages[-1].id))
+        counters.reconcile()
+
+        conversation = Conversation(user1_id=u1.id, user2_id=u2.id)
+        db.session.add(conversation)
+        db.session.flush()
+        inbox.conversation_added(conversation.id, conversation.user1_id,
+                                 conversation.user2_id)
+        dm = DM(text="hi there", conversation_id=conversation.id,
+                author=u2.id)
+        db.session.add(dm)
+        db.session.flush()
+        inbox.dm_added(dm)
+        db.session.commit()
+
+        self.u1_id, self.u2_id, self.u3_id = u1.id, u2.id, u3.id
+        self.msg_ids = [msg.id for msg in messages]
+        self.conversation_id = conversation.id
+
+        with app.app_context():
+            timeline.rebuild_all()
+            db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get(self, path, user_id=None):
+        with app.test_client() as c:
+            if user_id:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+            return c.get(path)
+
+    def test_timeline(self):
+        """Is the timeline paged newest first with cursors?"""
+
+        resp = self.get("/api/v1/timeline?limit=3", self.u1_id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/json')
+
+        items = resp.json['items']
+        self.assertEqual([item['id'] for item in items],
+                         self.msg_ids[:1:-1])
+        self.assertEqual(items[0]['username'], "apiuser2")
+        self.assertEqual([item['liked'] for item in items],
+                         [True, False, False])
+        self.assertIsNone(resp.json['after'])
+
+        resp = self.get(
+            f"/api/v1/timeline?limit=3&before={resp.json['before']}",
+            self.u1_id)
+        self.assertEqual([item['id'] for item in resp.json['items']],
+                         self.msg_ids[1::-1])
+        self.assertIsNone(resp.json['before'])
+
+    def test_fields(self):
+        """Does 'fields' pick what comes back?"""
+
+        resp = self.get("/api/v1/timeline?limit=1&fields=text", self.u1_id)
+        self.assertEqual(resp.json['items'], [{'text': "warble 4"}])
+        self.assertIsNotNone(resp.json['before'])
+
+        resp = self.get("/api/v1/timeline?fields=text,password", self.u1_id)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json, {'error': "Bad Request"})
+
+    def test_logged_out(self):
+        for path in ("/api/v1/timeline", "/api/v1/conversations"):
+            resp = self.get(path)
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.json, {'error': "Unauthorized"})
+
+    def test_user(self):
+        resp = self.get(f"/api/v1/users/{self.u2_id}")
+        self.assertEqual(resp.json['username'], "apiuser2")
+        self.assertEqual(resp.json['messages_count'], 5)
+        self.assertEqual(resp.json['followers_count'], 1)
+        self.assertNotIn('password', resp.json)
+
+        resp = self.get("/api/v1/users/999999")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_user_messages_and_likes(self):
+        resp = self.get(f"/api/v1/users/{self.u2_id}/messages?limit=2")
+        self.assertEqual([item['id'] for item in resp.json['items']],
+                         self.msg_ids[:2:-1])
+        self.assertEqual([item['liked'] for item in resp.json['items']],
+                         [False, False])
+
+        resp = self.get(f"/api/v1/users/{self.u1_id}/likes", self.u1_id)
+        self.assertEqual([item['id'] for item in resp.json['items']],
+                         [self.msg_ids[-1]])
+        self.assertTrue(resp.json['items'][0]['liked'])
+
+    def test_message(self):
+        resp = self.get(f"/api/v1/messages/{self.msg_ids[0]}")
+        self.assertEqual(resp.json['text'], "warble 0")
+        self.assertEqual(resp.json['timestamp'], "2020-01-01T00:00:00")
+
+        resp = self.get("/api/v1/messages/999999")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_conversations(self):
+        resp = self.get("/api/v1/conversations", self.u1_id)
+        self.assertEqual(resp.json['items'], [{
+            'conversation_id': self.conversation_id,
+            'last_activity_at': resp.json['items'][0]['last_activity_at'],
+            'unread_count': 1,
+            'other_user_id': self.u2_id,
+            'other_username': "apiuser2",
+            'other_image_url': "/static/images/default-pic.png",
+            'last_dm_text': "hi there",
+        }])
+
+        resp = self.get(
+            f"/api/v1/conversations/{self.conversation_id}/dms"
+            f"?fields=text,author", self.u1_id)
+        self.assertEqual(resp.json, {
+            'items': [{'text': "hi there", 'author': self.u2_id}],
+            'has_more': False,
+        })
+
+    def test_conversation_forbidden(self):
+        resp = self.get(f"/api/v1/conversations/{self.conversation_id}/dms",
+                        self.u3_id)
+        self.assertEqual(resp.status_code, 403)
@@ -0,0 +1,43 @@
+"""Benchmark harness tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_benchmark.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from unittest import TestCase
+
+from benchmark import compare, percentile
+
+
+class BenchmarkTestCase(TestCase):
+    """Tests for the benchmark's statistics."""
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_compare(self):
+        baseline = {
+            'homepage': {'p95': 10.0, 'sql': 4.0},
+            'users_show': {'p95': 10.0, 'sql': 4.0},
+            'add_dm': {'p95': 10.0, 'sql': None},
+        }
+        routes = {
+            'homepage': {'p95': 11.0, 'sql': 4.0},
+            'users_show': {'p95': 9.0, 'sql': 6.0},
+            'add_dm': {'p95': 30.0, 'sql': 5.0},
+            'search_all': {'p95': 99.0, 'sql': 9.0},
+        }
+
+        self.assertEqual(compare(routes, baseline, 0.2), [
+            ('users_show', 'sql', 4.0, 6.0),
+            ('add_dm', 'p95', 10.0, 30.0),
+        ])
@@ -0,0 +1,96 @@
+"""Pub/sub broker tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_broker.py
+
+import threading
+from unittest import TestCase
+
+from broker import LocalBroker, ListeningBroker, make_broker
+
+
+class LocalBrokerTestCase(TestCase):
+    """Test delivering messages within one process."""
+
+    def setUp(self):
+        self.broker = LocalBroker()
+
+    def test_publish(self):
+        """Do subscribers get messages for their channel only?"""
+
+        with self.broker.subscribe("a") as a, self.broker.subscribe("b") as b:
+            self.broker.publish("a", {"id": 1})
+            self.broker.publish("a", {"id": 2})
+
+            self.assertEqual(a.get(0), [{"id": 1}, {"id": 2}])
+            self.assertEqual(a.get(0), [])
+            self.assertEqual(b.get(0), [])
+
+    def test_unsubscribe(self):
+        """Do closed subscriptions stop receiving messages?"""
+
+        subscription = self.broker.subscribe("a")
+        self.assertEqual(self.broker.subscriber_count(), 1)
+
+        subscription.close()
+        self.broker.publish("a", {"id": 1})
+
+        self.assertEqual(subscription.get(0), [])
+        self.assertEqual(self.broker.subscriber_count(), 0)
+
+    def test_wakes_waiter(self):
+        """Does publishing wake a subscriber blocked in get()?"""
+
+        with self.broker.subscribe("a") as subscription:
+            timer = threading.Timer(0.05, self.broker.publish,
+                                    ("a", {"id": 1}))
+            timer.start()
+
+            self.assertEqual(subscription.get(5), [{"id": 1}])
+            timer.join()
+
+    def test_timeout(self):
+        """Does get() give up after its timeout?"""
+
+        with self.broker.subscribe("a") as subscription:
+            self.assertEqual(subscription.get(0.01), [])
+
+
+class FakeListeningBroker(ListeningBroker):
+    """Routes published messages through an in-memory 'server'."""
+
+    def __init__(self):
+        super().__init__()
+        self.wire = []
+        self.arrived = threading.Event()
+
+    def publish(self, channel, message):
+        self.wire.append(self.encode(channel, message))
+        self.arrived.set()
+
+    def listen(self):
+        while True:
+            self.arrived.wait()
+            self.arrived.clear()
+            while self.wire:
+                self.received(self.wire.pop(0))
+
+
+class ListeningBrokerTestCase(TestCase):
+    """Test delivering messages heard by a listener thread."""
+
+    def test_round_trip(self):
+        """Do messages published remotely reach local subscribers?"""
+
+        broker = FakeListeningBroker()
+
+        with broker.subscribe("a") as subscription:
+            broker.publish("a", {"id": 1})
+            self.assertEqual(subscription.get(5), [{"id": 1}])
+
+    def test_make_broker(self):
+        self.assertIsInstance(make_broker('local'), LocalBroker)
+
+        with self.assertRaises(ValueError):
+            make_broker('carrier-pigeon')
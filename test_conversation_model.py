@@ -0,0 +1,88 @@
+"""Conversation model tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_conversation_model.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Conversation, DM, InboxEntry
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class ConversationModelTestCase(TestCase):
+    """Test one conversation per pair of users."""
+
+    def setUp(self):
+        InboxEntry.query.delete()
+        DM.query.delete()
+        Conversation.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        db.session.commit()
+
+        self.u1_id, self.u2_id = u1.id, u2.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_pair(self):
+        self.assertEqual(Conversation.pair(5, 3), (3, 5))
+        self.assertEqual(Conversation.pair(3, 5), (3, 5))
+
+    def test_get_or_create(self):
+        """Do both orderings of a pair find the same conversation?"""
+
+        id, created = Conversation.get_or_create(self.u2_id, self.u1_id)
+        db.session.commit()
+        self.assertTrue(created)
+
+        self.assertEqual(Conversation.get_or_create(self.u1_id, self.u2_id),
+                         (id, False))
+        self.assertEqual(Conversation.get_or_create(self.u2_id, self.u1_id),
+                         (id, False))
+        self.assertEqual(Conversation.query.count(), 1)
+
+        conversation = Conversation.query.get(id)
+        self.assertEqual((conversation.user1_id, conversation.user2_id),
+                         Conversation.pair(self.u1_id, self.u2_id))
+
+    def test_unique_pair(self):
+        """Does the database refuse a second conversation for a pair?"""
+
+        user1_id, user2_id = Conversation.pair(self.u1_id, self.u2_id)
+        db.session.add(Conversation(user1_id=user1_id, user2_id=user2_id))
+        db.session.commit()
+
+        db.session.add(Conversation(user1_id=user1_id, user2_id=user2_id))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_add_conversation(self):
+        """Does opening a conversation twice reuse it?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        first = self.client.post(f"/conversations/add/{self.u1_id}")
+        again = self.client.post(f"/conversations/add/{self.u1_id}")
+
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(first.location, again.location)
+        self.assertEqual(Conversation.query.count(), 1)
+        self.assertEqual(InboxEntry.query.count(), 2)
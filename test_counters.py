@@ -0,0 +1,113 @@
+"""Counter maintenance tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app
+from unittest import TestCase
+from models import db, User, Message, Follows, Like
+import counters
+
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+PASSWORD = "Password"
+
+
+class CountersTestCase(TestCase):
+    """Test denormalized user and message counters."""
+
+    def setUp(self):
+        """Create two users; u2 has posted one message."""
+
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        self.u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        db.session.commit()
+
+        self.msg = Message(text="hello", user_id=self.u2.id)
+        db.session.add(self.msg)
+        db.session.flush()
+        counters.message_added(self.msg)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def follow_and_like(self):
+        self.u1.following.append(self.u2)
+        db.session.add(Like(user_id=self.u1.id, message_id=self.msg.id))
+        db.session.flush()
+        counters.follows_changed({self.u1.id: 1}, {self.u2.id: 1})
+        counters.like_added(self.u1.id, self.msg.id)
+        db.session.commit()
+
+    def test_hooks(self):
+        """Do the hooks keep counts in step with the rows?"""
+
+        self.follow_and_like()
+
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u1.likes_count, 1)
+        self.assertEqual(self.u2.followers_count, 1)
+        self.assertEqual(self.u2.messages_count, 1)
+        self.assertEqual(self.msg.likes_count, 1)
+
+    def test_message_removed(self):
+        """Does deleting a message fix its author's and likers' counts?"""
+
+        self.follow_and_like()
+
+        counters.message_removed(self.msg)
+        db.session.delete(self.msg)
+        db.session.commit()
+
+        self.assertEqual(self.u1.likes_count, 0)
+        self.assertEqual(self.u2.messages_count, 0)
+
+    def test_user_removed(self):
+        """Does deleting a user fix the counts of the users left behind?"""
+
+        self.follow_and_like()
+
+        counters.user_removed(self.u2)
+        db.session.delete(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_count, 0)
+        self.assertEqual(self.u1.likes_count, 0)
+
+    def test_reconcile(self):
+        """Does reconcile repair drifted counters?"""
+
+        self.follow_and_like()
+        User.query.update({User.followers_count: 7})
+        Message.query.update({Message.likes_count: 7})
+        db.session.commit()
+
+        self.assertEqual(counters.reconcile(), (2, 1))
+        db.session.commit()
+
+        self.assertEqual(self.u2.followers_count, 1)
+        self.assertEqual(self.msg.likes_count, 1)
+        self.assertEqual(counters.reconcile(), (0, 0))
@@ -0,0 +1,240 @@
+"""DM window and API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_dms.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from models import db, User, Conversation, DM, InboxEntry
+import broker
+import dms
+import inbox
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class DMTestCase(TestCase):
+    """Test reading DMs in windows."""
+
+    def setUp(self):
+        """Create a conversation between u1 and u2 with ten DMs."""
+
+        InboxEntry.query.delete()
+        DM.query.delete()
+        Conversation.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        u3 = User.signup(
+            "uniqueusername3", "uniqueemail3@email.com", PASSWORD, None)
+        db.session.commit()
+
+        conversation = Conversation(user1_id=u1.id, user2_id=u2.id)
+        db.session.add(conversation)
+        db.session.flush()
+        inbox.conversation_added(conversation.id, conversation.user1_id,
+                                 conversation.user2_id)
+
+        dm_list = [DM(text=f"dm {i}", conversation_id=conversation.id,
+                      author=(u1.id, u2.id)[i % 2])
+                   for i in range(10)]
+        db.session.add_all(dm_list)
+        db.session.commit()
+
+        self.u1_id, self.u3_id = u1.id, u3.id
+        self.conversation_id = conversation.id
+        self.ids = [dm.id for dm in dm_list]
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def window_ids(self, **kwargs):
+        window = dms.window(self.conversation_id, **kwargs)
+        return [dm.id for dm in window.items], window.has_more
+
+    def test_latest(self):
+        """Is the first window the newest DMs, oldest first?"""
+
+        self.assertEqual(self.window_ids(limit=3), (self.ids[-3:], True))
+        self.assertEqual(self.window_ids(limit=10), (self.ids, False))
+
+    def test_before_id(self):
+        """Does before_id page back through older DMs?"""
+
+        self.assertEqual(self.window_ids(before_id=self.ids[5], limit=3),
+                         (self.ids[2:5], True))
+        self.assertEqual(self.window_ids(before_id=self.ids[2], limit=3),
+                         (self.ids[:2], False))
+
+    def test_since_id(self):
+        """Does since_id return the DMs after it, oldest first?"""
+
+        self.assertEqual(self.window_ids(since_id=self.ids[5], limit=3),
+                         (self.ids[6:9], True))
+        self.assertEqual(self.window_ids(since_id=self.ids[-1], limit=3),
+                         ([], False))
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_list_dms(self):
+        """Does the API return a JSON window of DMs?"""
+
+        self.login(self.u1_id)
+
+        resp = self.client.get(f"/conversations/{self.conversation_id}/dms"
+                               f"?since_id={self.ids[7]}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([dm['id'] for dm in resp.json['dms']],
+                         self.ids[8:])
+        self.assertEqual(resp.json['dms'][0]['text'], "dm 8")
+        self.assertFalse(resp.json['has_more'])
+
+        resp = self.client.get(f"/conversations/{self.conversation_id}/dms"
+                               f"?since_id=1&before_id=5")
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.get(f"/conversations/{self.conversation_id}/dms"
+                               f"?before_id=x")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_outsider(self):
+        """Are users outside the conversation turned away?"""
+
+        self.login(self.u3_id)
+
+        resp = self.client.get(f"/conversations/{self.conversation_id}/dms")
+        self.assertEqual(resp.status_code, 403)
+
+        resp = self.client.post(
+            f"/conversations/{self.conversation_id}/dm/add",
+            json={"text": "let me in"})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_add_dm(self):
+        """Does sending a DM respond with just that DM?"""
+
+        self.login(self.u1_id)
+
+        resp = self.client.post(
+            f"/conversations/{self.conversation_id}/dm/add",
+            json={"text": "newest"})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json['dm']['text'], "newest")
+        self.assertEqual(resp.json['dm']['author'], self.u1_id)
+        self.assertGreater(resp.json['dm']['id'], self.ids[-1])
+
+    def test_show_conversation(self):
+        """Is only the newest window rendered?"""
+
+        self.login(self.u1_id)
+        per_page = app.config['DMS_PER_PAGE']
+        app.config['DMS_PER_PAGE'] = 3
+
+        try:
+            resp = self.client.get(f"/conversations/{self.conversation_id}")
+        finally:
+            app.config['DMS_PER_PAGE'] = per_page
+
+        html = str(resp.data)
+        self.assertIn("dm 9", html)
+        self.assertIn("dm 7", html)
+        self.assertNotIn("dm 6", html)
+        self.assertIn("dm-older", html)
+
+    def test_long_poll(self):
+        """Does long-polling return waiting DMs, or nothing on timeout?"""
+
+        self.login(self.u1_id)
+        url = f"/conversations/{self.conversation_id}/stream"
+
+        resp = self.client.get(f"{url}?since_id={self.ids[8]}")
+        self.assertEqual([dm['id'] for dm in resp.json['dms']],
+                         self.ids[9:])
+
+        app.config['STREAM_POLL_TIMEOUT'] = 0.01
+        try:
+            resp = self.client.get(f"{url}?since_id={self.ids[9]}")
+        finally:
+            del app.config['STREAM_POLL_TIMEOUT']
+        self.assertEqual(resp.json['dms'], [])
+
+    def test_published(self):
+        """Does sending a DM wake its conversation's subscribers?"""
+
+        with app.app_context():
+            with broker.subscribe(dms.channel(self.conversation_id)) as sub:
+                dm = DM(text="pushed", conversation_id=self.conversation_id,
+                        author=self.u1_id)
+                db.session.add(dm)
+                db.session.commit()
+                dms.published(dm)
+
+                self.assertEqual(sub.get(0), [{'id': dm.id}])
+
+    def test_event_stream(self):
+        """Are DMs after Last-Event-ID sent as Server-Sent Events?"""
+
+        self.login(self.u1_id)
+        app.config['STREAM_MAX_SECONDS'] = 0
+
+        try:
+            resp = self.client.get(
+                f"/conversations/{self.conversation_id}/stream",
+                headers={'Accept': 'text/event-stream',
+                         'Last-Event-ID': str(self.ids[7])})
+            body = resp.get_data(as_text=True)
+        finally:
+            del app.config['STREAM_MAX_SECONDS']
+
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertIn(f"id: {self.ids[8]}\n", body)
+        self.assertIn('"text": "dm 9"', body)
+        self.assertNotIn("dm 7", body)
+
+    def test_stream_empty_conversation(self):
+        """Can a conversation with no DMs yet be streamed?"""
+
+        conversation = Conversation(user1_id=self.u1_id, user2_id=self.u3_id)
+        db.session.add(conversation)
+        db.session.commit()
+        conversation_id = conversation.id
+
+        self.login(self.u1_id)
+        url = f"/conversations/{conversation_id}/stream"
+        app.config['STREAM_MAX_SECONDS'] = 0
+
+        try:
+            # As the page renders an empty data-newest-id.
+            resp = self.client.get(f"{url}?since_id=",
+                                   headers={'Accept': 'text/event-stream'})
+            body = resp.get_data(as_text=True)
+        finally:
+            del app.config['STREAM_MAX_SECONDS']
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertIn("retry:", body)
+
+        dm = DM(text="first", conversation_id=conversation_id,
+                author=self.u3_id)
+        db.session.add(dm)
+        db.session.commit()
+
+        resp = self.client.get(f"{url}?since_id=0")
+        self.assertEqual([dm['text'] for dm in resp.json['dms']], ["first"])
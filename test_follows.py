@@ -0,0 +1,245 @@
+"""Follower and following list tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follows.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message, Follows, Like, Job, TimelineEntry
+import follows
+import jobs
+import pagination
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class FollowsTestCase(TestCase):
+    """Test paging through who follows whom."""
+
+    def setUp(self):
+        """Five fans follow the star, one a minute, fan0 first."""
+
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        star = User.signup("star", "star@email.com", PASSWORD, None)
+        fans = [User.signup(f"fan{i}", f"fan{i}@email.com", PASSWORD, None)
+                for i in range(5)]
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all(
+            Follows(user_being_followed_id=star.id, user_following_id=fan.id,
+                    created_at=start + timedelta(minutes=i))
+            for i, fan in enumerate(fans))
+        db.session.commit()
+
+        self.star_id = star.id
+        self.fan_ids = [fan.id for fan in fans]
+
+        # The setup's follows bypass the counters.
+        star.followers_count = len(fans)
+        for fan in fans:
+            fan.following_count = 1
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_followers(self):
+        """Are followers paged newest follow first?"""
+
+        with app.app_context():
+            page = follows.followers(self.star_id, limit=2)
+            self.assertEqual([u.id for u in page.items],
+                             [self.fan_ids[4], self.fan_ids[3]])
+            self.assertIsNone(page.after)
+
+            before = pagination.decode_cursor(page.before)
+            page = follows.followers(self.star_id, before=before, limit=2)
+            self.assertEqual([u.id for u in page.items],
+                             [self.fan_ids[2], self.fan_ids[1]])
+
+            before = pagination.decode_cursor(page.before)
+            page = follows.followers(self.star_id, before=before, limit=2)
+            self.assertEqual([u.id for u in page.items], [self.fan_ids[0]])
+            self.assertIsNone(page.before)
+
+    def test_following(self):
+        with app.app_context():
+            page = follows.following(self.fan_ids[0])
+            self.assertEqual([u.id for u in page.items], [self.star_id])
+
+    def test_new_follow_timestamp(self):
+        """Do follows made through the relationship get a created_at?"""
+
+        fan = User.query.get(self.fan_ids[0])
+        star = User.query.get(self.star_id)
+        star.following.append(fan)
+        db.session.commit()
+
+        follow = Follows.query.filter_by(user_following_id=self.star_id).one()
+        self.assertIsNotNone(follow.created_at)
+
+    def test_followers_view(self):
+        """Does the followers page show one page and link to the next?"""
+
+        app.config['FOLLOWS_PER_PAGE'] = 3
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.fan_ids[0]
+                resp = c.get(f"/users/{self.star_id}/followers")
+        finally:
+            app.config['FOLLOWS_PER_PAGE'] = follows.DEFAULT_PER_PAGE
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@fan4", html)
+        self.assertIn("@fan2", html)
+        self.assertNotIn("@fan1<", html)
+        self.assertIn("?before=", html)
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = User.query.get(user_id)
+        return user.following_count, user.followers_count
+
+    def test_bulk(self):
+        """Are follows added and removed in bulk, keeping counters right?"""
+
+        star, fans = self.star_id, self.fan_ids
+        with app.app_context():
+            added = follows.add([(star, fans[0]), (star, fans[1]),
+                                 (fans[0], star), (star, star),
+                                 (star, 999999)])
+            db.session.commit()
+        self.assertEqual(added, {(star, fans[0]), (star, fans[1])})
+        self.assertEqual(self.counts(star), (2, 5))
+        self.assertEqual(self.counts(fans[0]), (1, 1))
+
+        with app.app_context():
+            removed = follows.remove([(star, fans[0]), (fans[1], star),
+                                      (fans[2], fans[3])])
+            db.session.commit()
+        self.assertEqual(removed, {(star, fans[0]), (fans[1], star)})
+        self.assertEqual(self.counts(star), (1, 4))
+        self.assertEqual(self.counts(fans[1]), (0, 1))
+
+    def test_bulk_view(self):
+        """Does the bulk endpoint follow and unfollow, leaving timelines
+        to the worker?"""
+
+        msg = Message(text="Hello fans", user_id=self.fan_ids[3])
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_ids[0]
+            resp = c.post("/users/following",
+                          json={"follow": self.fan_ids[1:],
+                                "unfollow": [self.star_id]})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, {"followed": 4, "unfollowed": 1})
+        self.assertEqual(self.counts(self.fan_ids[0]), (4, 0))
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+        with app.app_context():
+            jobs.work(once=True)
+        self.assertEqual(
+            [entry.message_id for entry in TimelineEntry.query], [msg_id])
+
+    def test_bulk_view_limit(self):
+        app.config['FOLLOWS_BULK_MAX'] = 2
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.fan_ids[0]
+                resp = c.post("/users/following",
+                              json={"follow": self.fan_ids[1:]})
+        finally:
+            app.config['FOLLOWS_BULK_MAX'] = 5000
+
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(self.counts(self.fan_ids[0]), (1, 0))
+
+    def test_bulk_view_both_lists(self):
+        """Is an id both followed and unfollowed refused?"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_ids[0]
+            resp = c.post("/users/following",
+                          json={"follow": [self.fan_ids[1]],
+                                "unfollow": [self.fan_ids[1]]})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.counts(self.fan_ids[0]), (1, 0))
+
+    def test_import_in_order(self):
+        """Are a CSV's rows applied in file order?"""
+
+        star, fan = self.star_id, self.fan_ids[0]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write("follower_id,followed_id,action\n")
+            file.write(f"{fan},{star},unfollow\n")
+            file.write(f"{star},{fan},follow\n")
+            file.write(f"{fan},{star},follow\n")
+            file.write(f"{star},{fan},unfollow\n")
+            file.flush()
+
+            result = app.test_cli_runner().invoke(
+                args=['follows', 'import', file.name])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("followed 2, unfollowed 2", result.output)
+        self.assertEqual(self.counts(fan), (1, 0))
+        self.assertEqual(self.counts(star), (0, 5))
+
+    def test_import(self):
+        """Does `flask follows import` apply a CSV of follows?"""
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write("follower_id,followed_id,action\n")
+            file.write(f"{self.star_id},{self.fan_ids[0]},\n")
+            file.write(f"{self.star_id},{self.fan_ids[1]},follow\n")
+            file.write(f"{self.fan_ids[2]},{self.star_id},unfollow\n")
+            file.flush()
+
+            result = app.test_cli_runner().invoke(
+                args=['follows', 'import', file.name, '--chunk-size', '1'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("followed 2, unfollowed 1", result.output)
+        self.assertEqual(self.counts(self.star_id), (2, 4))
+        self.assertEqual(Job.query.count(), 3)
+
+    def test_follow_view(self):
+        """Does following twice count once?"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.star_id
+            c.post(f"/users/follow/{self.fan_ids[0]}")
+            c.post(f"/users/follow/{self.fan_ids[0]}")
+
+        self.assertEqual(self.counts(self.star_id), (1, 5))
+        self.assertEqual(self.counts(self.fan_ids[0]), (1, 1))
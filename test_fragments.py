@@ -0,0 +1,120 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from flask import render_template_string
+from models import db, User, Message, Follows, Like
+from caching import LRUCache
+import fragments
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+CARD = """
+{%- call cached('card', msg, msg.user, viewer=viewer_html) -%}
+{{ render() }}@{{ msg.user.username }}: {{ msg.text }} {{ VIEWER_SLOT }}
+{%- endcall -%}
+"""
+
+
+class FragmentTestCase(TestCase):
+    """Test caching and invalidating rendered fragments."""
+
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.user = User.signup("testuser", "test@test.com", "password", None)
+        db.session.commit()
+        self.msg = Message(text="hello", user_id=self.user.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+        fragments.get_cache().clear()
+        self.renders = 0
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def render(self, viewer_html="<b>like</b>"):
+        def count():
+            self.renders += 1
+            return ""
+
+        return render_template_string(CARD, msg=self.msg, render=count,
+                                      viewer_html=viewer_html)
+
+    def test_cached(self):
+        """Is a fragment rendered once and then served from the cache?"""
+
+        self.assertEqual(self.render(), "@testuser: hello <b>like</b>")
+        self.assertEqual(self.render("<i>unlike</i>"),
+                         "@testuser: hello <i>unlike</i>")
+        self.assertEqual(self.renders, 1)
+
+    def test_bump_user(self):
+        """Do profile changes show up in cached cards?"""
+
+        self.render()
+        self.user.username = "renamed"
+        fragments.bump_user(self.user.id)
+        db.session.commit()
+
+        self.assertEqual(self.render(), "@renamed: hello <b>like</b>")
+        self.assertEqual(self.renders, 2)
+
+    def test_bump_seen_by_other_workers(self):
+        """Does a bump made in one worker retire the fragment cached by
+        another worker's cache?"""
+
+        caches = [LRUCache(), LRUCache()]
+        original = app.extensions['fragment_cache']
+        self.addCleanup(app.extensions.__setitem__, 'fragment_cache',
+                        original)
+
+        for cache in caches:
+            app.extensions['fragment_cache'] = cache
+            self.render()
+
+        app.extensions['fragment_cache'] = caches[0]
+        self.user.username = "renamed"
+        fragments.bump_user(self.user.id)
+        db.session.commit()
+
+        app.extensions['fragment_cache'] = caches[1]
+        self.assertEqual(self.render(), "@renamed: hello <b>like</b>")
+        self.assertEqual(self.renders, 3)
+
+    def test_profile_edit(self):
+        """Does editing a profile refresh its cached header?"""
+
+        client = app.test_client()
+        user_id = self.user.id
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        self.assertIn("@testuser", str(client.get(f"/users/{user_id}").data))
+
+        client.post("/users/profile", data={
+            "username": "testuser",
+            "email": "test@test.com",
+            "bio": "A brand new bio",
+            "password": "password",
+        })
+
+        self.assertIn("A brand new bio",
+                      str(client.get(f"/users/{user_id}").data))
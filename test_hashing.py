@@ -0,0 +1,113 @@
+"""Password hashing service tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+import os
+import subprocess
+import sys
+from unittest import TestCase, skipUnless
+
+from hashing import HashingBusy, HashingService, rounds_of
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+# Hashes in a pool from green threads of a monkey-patched process, as a
+# gunicorn gevent worker would, while another green thread keeps ticking.
+GEVENT_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+
+import time
+import gevent
+from hashing import HashingService
+
+service = HashingService(rounds=10, workers=2)
+ticks = []
+
+def tick():
+    while True:
+        ticks.append(time.monotonic())
+        gevent.sleep(0.01)
+
+ticker = gevent.spawn(tick)
+hashes = [gevent.spawn(service.hash, f"password{n}") for n in range(4)]
+gevent.joinall(hashes, timeout=30, raise_error=True)
+ticker.kill()
+
+assert all(service.check(h.value, f"password{n}")
+           for n, h in enumerate(hashes))
+# The other green thread ran while the hashes were waited on.
+assert len(ticks) >= 5, ticks
+service.shutdown()
+print("ok")
+"""
+
+
+class HashingServiceTestCase(TestCase):
+    """Test hashing, checking and re-hashing passwords."""
+
+    def test_hash_and_check_inline(self):
+        service = HashingService(rounds=4, workers=0)
+        pw_hash = service.hash("password")
+
+        self.assertEqual(rounds_of(pw_hash), 4)
+        self.assertTrue(service.check(pw_hash, "password"))
+        self.assertFalse(service.check(pw_hash, "wrongpass"))
+        self.assertEqual(service.metrics()['completed'], 3)
+
+    def test_hash_in_pool(self):
+        service = HashingService(rounds=4, workers=1)
+        try:
+            self.assertTrue(service.check(service.hash("password"),
+                                          "password"))
+        finally:
+            service.shutdown()
+
+    def test_needs_rehash(self):
+        old = HashingService(rounds=4, workers=0)
+        new = HashingService(rounds=5, workers=0)
+        pw_hash = old.hash("password")
+
+        self.assertFalse(old.needs_rehash(pw_hash))
+        self.assertTrue(new.needs_rehash(pw_hash))
+        self.assertTrue(new.check(pw_hash, "password"))
+
+    def test_busy(self):
+        service = HashingService(rounds=4, workers=0, max_pending=1,
+                                 timeout=0)
+        service._slots.acquire()
+
+        with self.assertRaises(HashingBusy):
+            service.hash("password")
+        self.assertEqual(service.metrics()['rejected'], 1)
+
+    def test_timeout(self):
+        """Does a hash that takes too long raise HashingBusy and free its
+        slot?"""
+
+        service = HashingService(rounds=14, workers=1, max_pending=1,
+                                 timeout=0.01)
+        try:
+            with self.assertRaises(HashingBusy):
+                service.hash("password")
+            self.assertEqual(service.metrics()['pending'], 0)
+            self.assertEqual(service.metrics()['rejected'], 1)
+            self.assertTrue(service._slots.acquire(blocking=False))
+        finally:
+            service.shutdown()
+
+    @skipUnless(gevent, "gevent isn't installed")
+    def test_pool_under_gevent(self):
+        """Does the pool work in a gevent-patched process?"""
+
+        result = subprocess.run(
+            [sys.executable, "-c", GEVENT_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "ok")
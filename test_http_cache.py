@@ -0,0 +1,170 @@
+"""HTTP caching policy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from models import db, User, Message, Follows, Like
+import counters
+import identity
+import likes
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class HTTPCacheTestCase(TestCase):
+    """Test Cache-Control policies and conditional requests."""
+
+    def setUp(self):
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        db.session.commit()
+
+        msg = Message(text="hello", user_id=u2.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.message_added(msg)
+        db.session.commit()
+
+        other = Message(text="other", user_id=u2.id)
+        db.session.add(other)
+        db.session.flush()
+        counters.message_added(other)
+        db.session.add(Like(user_id=u1.id, message_id=other.id))
+        counters.like_added(u1.id, other.id)
+        db.session.commit()
+
+        self.u1_id, self.u2_id, self.msg_id = u1.id, u2.id, msg.id
+        self.other_id = other.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+            # As after logging in, so viewing pages doesn't change the
+            # session (which would make them uncacheable).
+            sess[identity.CURR_USER_VERSION_KEY] = "v1"
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_static(self):
+        """Are fingerprinted static files cached for good?"""
+
+        resp = self.client.get("/")
+        html = resp.get_data(as_text=True)
+        self.assertIn("/static/stylesheets/style.css?v=", html)
+
+        start = html.index("/static/stylesheets/style.css?v=")
+        url = html[start:html.index('"', start)]
+        resp = self.client.get(url)
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+        self.assertIn("immutable", resp.headers['Cache-Control'])
+        resp.close()
+
+    def test_home(self):
+        """Is the timeline cached privately and the anon page publicly?"""
+
+        resp = self.client.get("/")
+        self.assertTrue(resp.cache_control.private)
+        self.assertEqual(resp.cache_control.max_age, app.config['HOME_MAX_AGE'])
+        self.assertIn("Cookie", resp.vary)
+
+        resp = app.test_client().get("/")
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age,
+                         app.config['ANON_HOME_MAX_AGE'])
+
+    def test_no_store(self):
+        """Are POSTs not stored?"""
+
+        resp = self.client.post(f"/users/follow/{self.u2_id}")
+        self.assertTrue(resp.cache_control.no_store)
+
+    def test_not_modified(self):
+        """Is an unchanged message page answered with 304?"""
+
+        url = f"/messages/{self.msg_id}"
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.private)
+        self.assertTrue(resp.cache_control.no_cache)
+        tag, _ = resp.get_etag()
+
+        resp = self.client.get(url, headers={'If-None-Match': f'"{tag}"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+    def test_changed(self):
+        """Does following the author change the pages' ETags?"""
+
+        urls = [f"/messages/{self.msg_id}", f"/users/{self.u2_id}"]
+        tags = [self.client.get(url).get_etag()[0] for url in urls]
+
+        self.client.post(f"/users/follow/{self.u2_id}")
+
+        for url, tag in zip(urls, tags):
+            resp = self.client.get(url,
+                                   headers={'If-None-Match': f'"{tag}"'})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_liked_and_unliked(self):
+        """Does liking one message and unliking another change the ETag,
+        though the viewer's like count stays the same?"""
+
+        url = f"/messages/{self.msg_id}"
+        tag, _ = self.client.get(url).get_etag()
+
+        self.client.post(f"/messages/{self.msg_id}/like")
+        self.client.post(f"/messages/{self.other_id}/like")
+
+        resp = self.client.get(url, headers={'If-None-Match': f'"{tag}"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("fas fa-heart", resp.get_data(as_text=True))
+
+    def test_liked_elsewhere(self):
+        """Does a like made outside this client's requests, as by another
+        worker or device, change the ETag?"""
+
+        url = f"/messages/{self.msg_id}"
+        tag, _ = self.client.get(url).get_etag()
+
+        with app.app_context():
+            likes.toggle(self.u1_id, self.msg_id, True)
+
+        resp = self.client.get(url, headers={'If-None-Match': f'"{tag}"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("fas fa-heart", resp.get_data(as_text=True))
+
+    def test_new_message(self):
+        """Does a new message change its author's profile ETag?"""
+
+        url = f"/users/{self.u2_id}"
+        tag, _ = self.client.get(url).get_etag()
+
+        msg = Message(text="again", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.message_added(msg)
+        db.session.commit()
+
+        resp = self.client.get(url, headers={'If-None-Match': f'"{tag}"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("again", resp.get_data(as_text=True))
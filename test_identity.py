@@ -0,0 +1,140 @@
+"""Identity cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_identity.py
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from sqlalchemy import event
+
+from caching import LRUCache
+from models import db, Message, User
+import identity
+
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the in-process cache backend."""
+
+    def setUp(self):
+        self.now = 0
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_expires(self):
+        self.cache.set("a", 1)
+        self.now = 10
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_max_bytes(self):
+        cache = LRUCache(maxsize=10, ttl=10, max_bytes=10, sizeof=len)
+        cache.set("a", "12345")
+        cache.set("b", "12345")
+        cache.set("a", "1234")
+        cache.set("c", "12")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1234")
+        self.assertEqual(cache.get("c"), "12")
+        self.assertEqual(cache.bytes, 6)
+
+
+class IdentityViewTestCase(TestCase):
+    """Test that add_user_to_g uses the cache and sees profile edits."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        app.extensions['identity_cache'].clear()
+        self.client = app.test_client()
+
+        testuser = User.signup(username="testuser",
+                               email="test@test.com",
+                               password="testuser",
+                               image_url=None)
+        db.session.commit()
+        self.testuser_id = testuser.id
+
+    def count_queries(self, client, url):
+        queries = []
+
+        def record(*args):
+            queries.append(args)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(resp.status_code, 200)
+        return len(queries)
+
+    def test_cached_user(self):
+        """Is the user loaded once and then served from the cache?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            self.assertEqual(self.count_queries(c, "/messages/new"), 1)
+            self.assertEqual(self.count_queries(c, "/messages/new"), 0)
+
+    def test_profile_edit_invalidates(self):
+        """Does the editor see their new profile straight away?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/messages/new")
+            c.post("/users/profile", data={"username": "renamed",
+                                           "email": "test@test.com",
+                                           "password": "testuser"})
+
+            resp = c.get("/messages/new")
+            self.assertIn(b'alt="renamed"', resp.data)
+
+    def test_deleted_user(self):
+        """Is a deleted user logged out rather than served from cache?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/messages/new")
+            c.post("/users/delete")
+
+            resp = c.get("/messages/new")
+            self.assertEqual(resp.status_code, 302)
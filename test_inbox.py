@@ -0,0 +1,157 @@
+"""Conversation inbox tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_inbox.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from models import db, User, Conversation, DM, InboxEntry
+import inbox
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class InboxTestCase(TestCase):
+    """Test maintaining and reading conversation inboxes."""
+
+    def setUp(self):
+        """Create three users; u1 has a conversation with u2 and u3."""
+
+        InboxEntry.query.delete()
+        DM.query.delete()
+        Conversation.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        self.u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        self.u3 = User.signup(
+            "uniqueusername3", "uniqueemail3@email.com", PASSWORD, None)
+        db.session.commit()
+
+        self.c12 = self.converse(self.u1, self.u2)
+        self.c13 = self.converse(self.u1, self.u3)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def converse(self, user1, user2):
+        conversation = Conversation(user1_id=user1.id, user2_id=user2.id)
+        db.session.add(conversation)
+        db.session.flush()
+        inbox.conversation_added(conversation.id, conversation.user1_id,
+                                 conversation.user2_id)
+        db.session.commit()
+        return conversation
+
+    def send(self, conversation, author, text):
+        dm = DM(text=text, conversation_id=conversation.id, author=author.id)
+        db.session.add(dm)
+        db.session.flush()
+        inbox.dm_added(dm)
+        db.session.commit()
+        return dm
+
+    def conversation_ids(self, user):
+        return [entry.conversation_id
+                for entry in inbox.inbox(user.id, limit=10).items]
+
+    def test_empty_conversations_hidden(self):
+        """Are conversations without DMs left out of the inbox?"""
+
+        self.assertEqual(self.conversation_ids(self.u1), [])
+
+        self.send(self.c12, self.u2, "hi")
+
+        self.assertEqual(self.conversation_ids(self.u1), [self.c12.id])
+        self.assertEqual(self.conversation_ids(self.u3), [])
+
+    def test_recency_order(self):
+        """Is the most recently active conversation first?"""
+
+        self.send(self.c12, self.u2, "first")
+        self.send(self.c13, self.u3, "second")
+        self.assertEqual(self.conversation_ids(self.u1),
+                         [self.c13.id, self.c12.id])
+
+        dm = self.send(self.c12, self.u1, "third")
+        self.assertEqual(self.conversation_ids(self.u1),
+                         [self.c12.id, self.c13.id])
+
+        entry = InboxEntry.query.get((self.u2.id, self.c12.id))
+        self.assertEqual(entry.last_dm_id, dm.id)
+        self.assertEqual(entry.other_user_id, self.u1.id)
+
+    def test_unread_counts(self):
+        """Are DMs unread for the recipient until they open it?"""
+
+        self.send(self.c12, self.u2, "one")
+        self.send(self.c12, self.u2, "two")
+        self.send(self.c12, self.u1, "three")
+
+        self.assertEqual(
+            InboxEntry.query.get((self.u1.id, self.c12.id)).unread_count, 2)
+        self.assertEqual(
+            InboxEntry.query.get((self.u2.id, self.c12.id)).unread_count, 1)
+
+        inbox.mark_read(self.u1.id, self.c12.id)
+        db.session.commit()
+
+        self.assertEqual(
+            InboxEntry.query.get((self.u1.id, self.c12.id)).unread_count, 0)
+
+    def test_self_conversation(self):
+        """Does a conversation with yourself appear once?"""
+
+        c11 = self.converse(self.u1, self.u1)
+        self.send(c11, self.u1, "note to self")
+
+        self.assertEqual(self.conversation_ids(self.u1), [c11.id])
+
+    def test_rebuild_all(self):
+        """Does rebuilding reproduce the maintained inboxes?"""
+
+        self.send(self.c12, self.u2, "first")
+        self.send(self.c13, self.u3, "second")
+        before = self.conversation_ids(self.u1)
+
+        inbox.rebuild_all()
+        db.session.commit()
+
+        self.assertEqual(self.conversation_ids(self.u1), before)
+        self.assertEqual(self.conversation_ids(self.u2), [self.c12.id])
+
+    def test_views(self):
+        """Do sending and opening DMs update the inbox page?"""
+
+        u1_id, u2_id, c12_id = self.u1.id, self.u2.id, self.c12.id
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = u2_id
+
+        resp = self.client.post(f"/conversations/{c12_id}/dm/add",
+                                json={"text": "hello there"})
+        self.assertEqual(resp.status_code, 201)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = u1_id
+
+        resp = self.client.get("/conversations")
+        self.assertIn("hello there", str(resp.data))
+        self.assertIn("uniqueusername2", str(resp.data))
+
+        self.client.get(f"/conversations/{c12_id}")
+        self.assertEqual(
+            InboxEntry.query.get((u1_id, c12_id)).unread_count, 0)
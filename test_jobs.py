@@ -0,0 +1,161 @@
+"""Job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from datetime import datetime
+from unittest import TestCase
+from models import db, User, Message, Follows, Like, Job, TimelineEntry
+import jobs
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+ran = []
+
+
+@jobs.handler('test_record')
+def record(payloads):
+    ran.append([payload['n'] for payload in payloads])
+
+
+@jobs.handler('test_fail')
+def fail(payloads):
+    if any(payload.get('poison') for payload in payloads):
+        raise ValueError("poisoned")
+    ran.append([payload['n'] for payload in payloads])
+
+
+class JobsTestCase(TestCase):
+    """Test queueing and running jobs."""
+
+    def setUp(self):
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+        ran.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_batch(self):
+        """Are consecutive jobs of a kind run together, then removed?"""
+
+        for n in range(3):
+            jobs.enqueue('test_record', n=n)
+        db.session.commit()
+
+        self.assertEqual(jobs.work_batch(), 3)
+        self.assertEqual(ran, [[0, 1, 2]])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_priority(self):
+        """Do higher priority jobs run first?"""
+
+        jobs.enqueue('test_record', n=1)
+        jobs.enqueue('test_record', priority=5, n=2)
+        db.session.commit()
+
+        jobs.work_batch(limit=1)
+        self.assertEqual(ran, [[2]])
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('no_such_kind')
+
+    def test_retry(self):
+        """Is a failing job retried later, and kept once it gives up?"""
+
+        job = jobs.enqueue('test_fail', n=1, poison=True)
+        db.session.commit()
+        job_id = job.id
+
+        jobs.work_batch()
+        job = Job.query.get(job_id)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("poisoned", job.last_error)
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertEqual(jobs.work_batch(), 0)
+
+        for attempt in range(jobs.MAX_ATTEMPTS - 1):
+            job.run_at = datetime.utcnow()
+            db.session.commit()
+            jobs.work_batch()
+            job = Job.query.get(job_id)
+
+        self.assertEqual(job.attempts, jobs.MAX_ATTEMPTS)
+        self.assertIsNotNone(job.failed_at)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(jobs.work_batch(), 0)
+
+    def test_poison(self):
+        """Does one failing job leave the rest of its batch to run?"""
+
+        jobs.enqueue('test_fail', n=1)
+        jobs.enqueue('test_fail', n=2, poison=True)
+        jobs.enqueue('test_fail', n=3)
+        db.session.commit()
+
+        jobs.work_batch()
+        self.assertEqual(ran, [[1], [3]])
+        self.assertEqual([job.payload['n'] for job in Job.query], [2])
+
+    def test_fan_out(self):
+        """Is a posted message fanned out by the worker?"""
+
+        author = User.signup("author", "author@email.com", PASSWORD, None)
+        follower = User.signup(
+            "follower", "follower@email.com", PASSWORD, None)
+        db.session.commit()
+        author_id, follower_id = author.id, follower.id
+        follower.following.append(author)
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = author_id
+            c.post("/messages/new", data={"text": "Hello"})
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+        with app.app_context():
+            self.assertEqual(jobs.work(once=True), 1)
+
+        entry = TimelineEntry.query.one()
+        self.assertEqual((entry.user_id, entry.author_id),
+                         (follower_id, author_id))
+
+    def test_delete_user(self):
+        """Is a deleted account removed by the worker?"""
+
+        user = User.signup("doomed", "doomed@email.com", PASSWORD, None)
+        db.session.commit()
+        user_id = user.id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            resp = c.post("/users/delete")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNotNone(User.query.get(user_id))
+
+        with app.app_context():
+            jobs.work(once=True)
+
+        db.session.expire_all()
+        self.assertIsNone(User.query.get(user_id))
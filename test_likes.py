@@ -0,0 +1,164 @@
+"""Like toggle tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, User, Message, Follows, Like
+import counters
+import likes
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class LikesTestCase(TestCase):
+    """Test liking and unliking messages."""
+
+    def setUp(self):
+        """Create two users; u2 has posted one message."""
+
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        db.session.commit()
+
+        msg = Message(text="hello", user_id=u2.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.message_added(msg)
+        db.session.commit()
+
+        self.u1_id, self.u2_id, self.msg_id = u1.id, u2.id, msg.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self):
+        db.session.expire_all()
+        return (User.query.get(self.u1_id).likes_count,
+                Message.query.get(self.msg_id).likes_count,
+                Like.query.count())
+
+    def toggle(self, *args):
+        with app.app_context():
+            return likes.toggle(*args)
+
+    def test_toggle(self):
+        """Does toggling like, then unlike, keeping the counters right?"""
+
+        self.assertEqual(self.toggle(self.u1_id, self.msg_id), (True, 1))
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+        self.assertEqual(self.toggle(self.u1_id, self.msg_id), (False, 0))
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_toggle_statements(self):
+        """Does liking take a single write, and unliking fall back to a
+        DELETE only after the INSERT finds the like?"""
+
+        writes = []
+
+        def record(conn, cursor, statement, *args):
+            words = statement.split()
+            if words[0] in ("INSERT", "DELETE") and "likes" in words[:5]:
+                writes.append(words[0])
+
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                likes.toggle(self.u1_id, self.msg_id)
+                liked = list(writes)
+                del writes[:]
+                likes.toggle(self.u1_id, self.msg_id)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(liked, ["INSERT"])
+        self.assertEqual(writes, ["INSERT", "DELETE"])
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_set_liked_twice(self):
+        """Is liking something already liked a no-op?"""
+
+        self.assertEqual(self.toggle(self.u1_id, self.msg_id, True),
+                         (True, 1))
+        self.assertEqual(self.toggle(self.u1_id, self.msg_id, True),
+                         (True, 1))
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+    def test_missing_message(self):
+        self.assertIsNone(self.toggle(self.u1_id, self.msg_id + 1000))
+
+    def test_json(self):
+        """Does the JSON variant answer with the new state?"""
+
+        resp = self.client.post(f"/messages/{self.msg_id}/like",
+                                headers={'Accept': 'application/json'})
+        self.assertEqual(resp.json, {'liked': True, 'likes_count': 1})
+
+        resp = self.client.post(f"/messages/{self.msg_id}/like",
+                                json={'liked': True})
+        self.assertEqual(resp.json, {'liked': True, 'likes_count': 1})
+
+        resp = self.client.post(f"/messages/{self.msg_id}/like/",
+                                json={'liked': True})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_redirect_back(self):
+        """Are forms sent back to the page they came from?"""
+
+        resp = self.client.post(
+            f"/messages/{self.msg_id}/like",
+            headers={'Referer': f"http://localhost/users/{self.u2_id}"})
+        self.assertEqual(resp.status_code, 302)
+        self.assertTrue(resp.location.endswith(f"/users/{self.u2_id}"))
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+    def test_buffer(self):
+        """Does the buffer write only each user's last choice?"""
+
+        buffer = likes.LikeBuffer(app, 60)
+
+        self.assertEqual(buffer.toggle(self.u1_id, self.msg_id), (True, 1))
+        self.assertEqual(buffer.toggle(self.u1_id, self.msg_id), (False, 0))
+        self.assertEqual(buffer.toggle(self.u1_id, self.msg_id), (True, 1))
+        self.assertEqual(buffer.toggle(self.u2_id, self.msg_id, True),
+                         (True, 1))
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.counts(), (1, 2, 2))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_buffer_deleted_message(self):
+        """Are buffered likes of a since-deleted message dropped?"""
+
+        buffer = likes.LikeBuffer(app, 60)
+        buffer.toggle(self.u1_id, self.msg_id)
+
+        Message.query.filter_by(id=self.msg_id).delete()
+        db.session.commit()
+
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(Like.query.count(), 0)
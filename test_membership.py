@@ -0,0 +1,82 @@
+"""Viewer membership tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_membership.py
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app
+from unittest import TestCase
+from models import db, User, Message, Follows, Like
+from membership import Membership
+
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+PASSWORD = "Password"
+
+
+class MembershipTestCase(TestCase):
+    """Test follow and like checks for the viewer."""
+
+    def setUp(self):
+        """u1 follows u2 and likes u2's first message."""
+
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        self.u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        self.u3 = User.signup(
+            "uniqueusername3", "uniqueemail3@email.com", PASSWORD, None)
+        db.session.commit()
+
+        self.m1 = Message(text="one", user_id=self.u2.id)
+        self.m2 = Message(text="two", user_id=self.u2.id)
+        db.session.add_all([self.m1, self.m2])
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        db.session.add(Like(user_id=self.u1.id, message_id=self.m1.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_loads_everything_by_default(self):
+        viewer = Membership(self.u1.id)
+
+        self.assertTrue(viewer.is_following(self.u2))
+        self.assertFalse(viewer.is_following(self.u3))
+        self.assertTrue(viewer.has_liked(self.m1))
+        self.assertFalse(viewer.has_liked(self.m2))
+        self.assertTrue(viewer.following.complete)
+
+    def test_prefetch_page(self):
+        viewer = Membership(self.u1.id)
+        viewer.prefetch(users=[self.u2], messages=[self.m2])
+
+        self.assertFalse(viewer.following.complete)
+        self.assertTrue(viewer.is_following(self.u2))
+        self.assertFalse(viewer.has_liked(self.m2))
+
+        # Ids outside the prefetched page are loaded one by one.
+        self.assertFalse(viewer.is_following(self.u3))
+        self.assertTrue(viewer.has_liked(self.m1))
+        self.assertFalse(viewer.liked.complete)
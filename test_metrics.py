@@ -0,0 +1,118 @@
+"""SQL instrumentation and /metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app
+from types import SimpleNamespace
+from unittest import TestCase
+from models import db, engine_options, limit_statements
+import metrics
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MetricsTestCase(TestCase):
+    """Test per-request SQL stats and the Prometheus endpoint."""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.pop('SQL_METRICS_HEADERS', None)
+        app.config['METRICS_TOKEN'] = None
+
+    def test_headers(self):
+        """Are a request's SQL stats sent back in debug headers?"""
+
+        app.config['SQL_METRICS_HEADERS'] = True
+        resp = self.client.get("/users")
+
+        self.assertGreaterEqual(int(resp.headers['X-SQL-Queries']), 1)
+        self.assertTrue(resp.headers['X-SQL-Time'].endswith("ms"))
+        self.assertIn("SELECT", resp.headers['X-SQL-Slowest'])
+        self.assertIn("db;dur=", resp.headers['Server-Timing'])
+
+        app.config['SQL_METRICS_HEADERS'] = False
+        resp = self.client.get("/users")
+        self.assertNotIn('X-SQL-Queries', resp.headers)
+
+    def test_metrics(self):
+        """Are per-endpoint totals served in Prometheus' format?"""
+
+        self.client.get("/users")
+        resp = self.client.get("/metrics")
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn("# TYPE warbler_requests_total counter", text)
+        self.assertIn('warbler_requests_total{endpoint="list_users"}', text)
+        self.assertIn('warbler_sql_queries_total{endpoint="list_users"}', text)
+        self.assertIn("warbler_password_hashes_pending 0", text)
+
+    def test_token(self):
+        app.config['METRICS_TOKEN'] = "sekrit"
+
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        resp = self.client.get(
+            "/metrics", headers={'Authorization': "Bearer sekrit"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_request_stats(self):
+        stats = metrics.RequestStats()
+        for seconds in (0.1, 0.4, 0.2, 0.3):
+            stats.record(f"SELECT {seconds}", seconds, seconds > 0.25)
+
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.slow, 2)
+        self.assertEqual([s for s, _ in stats.slowest], [0.4, 0.3, 0.2])
+
+    def test_engine_options(self):
+        """Does pool sizing only apply to PostgreSQL?"""
+
+        options = engine_options({
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler",
+            'DB_POOL_SIZE': 20,
+            'DB_STATEMENT_TIMEOUT': 5000,
+        })
+        self.assertEqual(options['pool_size'], 20)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertNotIn('connect_args', options)
+
+        options = engine_options({'SQLALCHEMY_DATABASE_URI': "sqlite://"})
+        self.assertNotIn('pool_size', options)
+
+    def test_statement_timeout(self):
+        """Is the statement timeout set for requests, and lifted outside
+        them?"""
+
+        class Connection:
+            def __init__(self, dialect):
+                self.dialect = SimpleNamespace(name=dialect)
+                self.statements = []
+
+            def execute(self, statement):
+                self.statements.append(statement)
+
+        postgres = Connection('postgresql')
+        with app.test_request_context():
+            limit_statements(postgres)
+        with app.app_context():
+            limit_statements(postgres)
+        self.assertEqual(postgres.statements, [
+            f"SET LOCAL statement_timeout = "
+            f"{app.config['DB_STATEMENT_TIMEOUT']}",
+            "SET LOCAL statement_timeout = 0",
+        ])
+
+        sqlite = Connection('sqlite')
+        with app.test_request_context():
+            limit_statements(sqlite)
+        self.assertEqual(sqlite.statements, [])
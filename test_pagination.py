@@ -0,0 +1,94 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message
+import pagination
+
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursors and keyset pages."""
+
+    def setUp(self):
+        """Create a user with five messages, one second apart."""
+
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.user = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", "Password", None)
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        self.messages = [
+            Message(text=f"msg {i}", user_id=self.user.id,
+                    timestamp=start + timedelta(seconds=i))
+            for i in range(5)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+
+        self.newest_first = list(reversed(self.messages))
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def page(self, before=None, after=None):
+        return pagination.paginate(
+            Message.query.filter(Message.user_id == self.user.id),
+            Message.timestamp, Message.id,
+            before and pagination.decode_cursor(before),
+            after and pagination.decode_cursor(after),
+            limit=2)
+
+    def test_cursor_round_trip(self):
+        """Does a cursor decode to what it encoded?"""
+
+        timestamp = datetime(2020, 1, 1, 12, 30, 15, 123)
+        cursor = pagination.encode_cursor(timestamp, 42)
+
+        self.assertEqual(pagination.decode_cursor(cursor), (timestamp, 42))
+
+    def test_bad_cursor(self):
+        """Are garbage cursors rejected?"""
+
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.decode_cursor("not-a-cursor")
+
+    def test_walk_back_and_forward(self):
+        """Can we page to the end and back again?"""
+
+        first = self.page()
+        self.assertEqual(first.items, self.newest_first[:2])
+        self.assertIsNone(first.after)
+
+        second = self.page(before=first.before)
+        self.assertEqual(second.items, self.newest_first[2:4])
+
+        last = self.page(before=second.before)
+        self.assertEqual(last.items, self.newest_first[4:])
+        self.assertIsNone(last.before)
+
+        back = self.page(after=last.after)
+        self.assertEqual(back.items, self.newest_first[2:4])
+        self.assertEqual(back.before, second.before)
@@ -0,0 +1,114 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, User, Message, Follows, Like
+import replicas
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class ReplicaTestCase(TestCase):
+    """Test sending read-only requests to a replica.
+
+    The "replica" is the test database itself, through its own engine.
+    """
+
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        db.session.commit()
+        self.u1_id, self.u2_id = u1.id, u2.id
+
+        self.binds = app.config['SQLALCHEMY_BINDS']
+        self.router = app.extensions['replicas']
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica0': app.config['SQLALCHEMY_DATABASE_URI']}
+        app.extensions['replicas'] = replicas.Router(
+            ['replica0'], check=lambda bind: None)
+
+        self.replica = db.get_engine(app, bind='replica0')
+        self.replica_statements = 0
+        event.listen(self.replica, 'before_cursor_execute', self.count)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        event.remove(self.replica, 'before_cursor_execute', self.count)
+        app.config['SQLALCHEMY_BINDS'] = self.binds
+        app.extensions['replicas'] = self.router
+        db.session.rollback()
+
+    def count(self, *args):
+        self.replica_statements += 1
+
+    def test_read_only(self):
+        """Do read-only views read from the replica?"""
+
+        resp = self.client.get(f"/users/{self.u2_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(self.replica_statements, 0)
+
+    def test_primary_views(self):
+        """Do other views stay on the primary?"""
+
+        self.client.get("/conversations")
+        self.assertEqual(self.replica_statements, 0)
+
+    def test_read_your_writes(self):
+        """Does a user read from the primary right after writing?"""
+
+        resp = self.client.post(f"/users/follow/{self.u2_id}")
+        self.assertEqual(resp.status_code, 302)
+
+        self.client.get(f"/users/{self.u1_id}/following")
+        self.assertEqual(self.replica_statements, 0)
+
+        with self.client.session_transaction() as sess:
+            sess[replicas.PRIMARY_UNTIL_KEY] = 0
+        self.client.get(f"/users/{self.u1_id}/following")
+        self.assertGreater(self.replica_statements, 0)
+
+    def test_round_robin(self):
+        """Are healthy replicas taken in turn, skipping failing ones?"""
+
+        def check(bind):
+            if bind == 'b':
+                raise ConnectionError(bind)
+
+        router = replicas.Router(['a', 'b', 'c'], check)
+        self.assertEqual([router.pick() for _ in range(4)],
+                         ['a', 'c', 'c', 'a'])
+
+        router = replicas.Router(['b'], check)
+        self.assertIsNone(router.pick())
+
+    def test_is_plain_read(self):
+        query = User.query.filter_by(id=self.u1_id)
+
+        self.assertTrue(replicas.is_plain_read(query.statement))
+        self.assertFalse(
+            replicas.is_plain_read(query.with_for_update().statement))
+        self.assertFalse(replicas.is_plain_read(None))
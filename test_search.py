@@ -0,0 +1,142 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app
+from unittest import TestCase
+from models import db, User, Message
+import search
+
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+PASSWORD = "Password"
+
+
+class InvertedIndexTestCase(TestCase):
+    """Test the pure-Python fallback index."""
+
+    def test_scores_by_shared_terms(self):
+        index = search.InvertedIndex(lambda text: set(search.words(text)))
+        index.add(1, "the quick brown fox")
+        index.add(2, "the lazy dog")
+
+        self.assertEqual(index.search("quick dog"), {1: 0.5, 2: 0.5})
+        self.assertEqual(index.search("Quick Brown"), {1: 1.0})
+
+        index.remove(1)
+        self.assertEqual(index.search("quick"), {})
+
+
+class EscapeLikeTestCase(TestCase):
+    """Test escaping search terms for LIKE."""
+
+    def test_escapes_wildcards(self):
+        self.assertEqual(search.escape_like("a_b%c\\d"), "a\\_b\\%c\\\\d")
+        self.assertEqual(search.escape_like("plain"), "plain")
+
+    def test_matches_literally(self):
+        with app.app_context():
+            match = db.session.scalar(
+                db.select([db.literal("a_b%").ilike(
+                    f"%{search.escape_like('_b%')}%", escape='\\')]))
+            miss = db.session.scalar(
+                db.select([db.literal("axbc").ilike(
+                    f"%{search.escape_like('_b%')}%", escape='\\')]))
+
+        self.assertTrue(match)
+        self.assertFalse(miss)
+
+
+class SearchTestCase(TestCase):
+    """Test user and message search on whichever backend is in use."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+        app.extensions.pop('search', None)
+
+        self.alice = User.signup(
+            "alice", "alice@email.com", PASSWORD, None)
+        self.alicia = User.signup(
+            "alicia", "alicia@email.com", PASSWORD, None)
+        self.bob = User.signup(
+            "bob", "bob@email.com", PASSWORD, None)
+        self.bob.bio = "Birdwatcher"
+        db.session.commit()
+
+        db.session.add_all([
+            Message(text="Spotted a warbler today", user_id=self.bob.id),
+            Message(text="Nothing to report", user_id=self.bob.id),
+        ])
+        db.session.commit()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def test_users_by_username(self):
+        results = search.users("alice")
+
+        self.assertEqual(results.items[0], self.alice)
+        self.assertIn(self.alicia, results.items)
+        self.assertNotIn(self.bob, results.items)
+
+    def test_users_by_bio(self):
+        self.assertEqual(search.users("birdwatcher").items, [self.bob])
+
+    def test_messages(self):
+        results = search.messages("warbler")
+
+        self.assertEqual([msg.text for msg in results.items],
+                         ["Spotted a warbler today"])
+
+    def test_pages(self):
+        first = search.users("ali", per_page=1)
+        second = search.users("ali", page=2, per_page=1)
+
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertNotEqual(first.items, second.items)
+
+    def test_list_users_pages(self):
+        """Does /users?q= page through every match?"""
+
+        db.session.add_all([
+            User(username=f"finch{n}", email=f"finch{n}@email.com",
+                 password=PASSWORD)
+            for n in range(search.DEFAULT_PER_PAGE + 5)])
+        db.session.commit()
+
+        shown = set()
+        with app.test_client() as c:
+            for page in (1, 2):
+                html = c.get(f"/users?q=finch&page={page}").get_data(
+                    as_text=True)
+                shown |= {n for n in range(search.DEFAULT_PER_PAGE + 5)
+                          if f"@finch{n}<" in html}
+                if page == 1:
+                    self.assertIn("?q=finch&page=2", html)
+                else:
+                    self.assertNotIn("page=3", html)
+                    self.assertIn("?q=finch&page=1", html)
+
+        self.assertEqual(shown, set(range(search.DEFAULT_PER_PAGE + 5)))
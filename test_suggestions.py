@@ -0,0 +1,149 @@
+"""Who to follow tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from unittest import TestCase
+from models import db, User, Message, Follows, Like, Job, TimelineEntry, Suggestion
+import jobs
+import suggestions
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class SuggestionsTestCase(TestCase):
+    """Test computing, updating and showing suggestions."""
+
+    def setUp(self):
+        Suggestion.query.delete()
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.users = {}
+        for name in "abcde":
+            self.users[name] = User.signup(
+                name, f"{name}@email.com", PASSWORD, None)
+        db.session.commit()
+        self.ids = {name: user.id for name, user in self.users.items()}
+
+        # a follows b and c; b and c both follow d; c follows e and a.
+        for follower, followed in ["ab", "ac", "bd", "cd", "ce", "ca"]:
+            self.users[follower].following.append(self.users[followed])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def stored(self, name):
+        return [(s.suggested_user_id, s.score)
+                for s in (Suggestion
+                          .query
+                          .filter_by(user_id=self.ids[name])
+                          .order_by(Suggestion.score.desc(),
+                                    Suggestion.suggested_user_id))]
+
+    def test_rebuild(self):
+        """Are friends of friends ranked by the paths leading to them?"""
+
+        with app.app_context():
+            suggestions.rebuild_all(chunk_size=2)
+            db.session.commit()
+
+        self.assertEqual(self.stored('a'),
+                         [(self.ids['d'], 2), (self.ids['e'], 1)])
+        self.assertEqual(self.stored('c'), [(self.ids['b'], 1)])
+        self.assertEqual(self.stored('d'), [])
+
+    def test_top_k(self):
+        """Are only the best SUGGESTIONS_PER_USER kept?"""
+
+        app.config['SUGGESTIONS_PER_USER'] = 1
+        try:
+            with app.app_context():
+                suggestions.rebuild_all()
+                db.session.commit()
+        finally:
+            del app.config['SUGGESTIONS_PER_USER']
+
+        self.assertEqual(self.stored('a'), [(self.ids['d'], 2)])
+
+    def test_follow_updates(self):
+        """Do follows and unfollows adjust suggestions via the worker?"""
+
+        with app.app_context():
+            suggestions.rebuild_all()
+            db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids['a']
+            c.post(f"/users/follow/{self.ids['d']}")
+
+        with app.app_context():
+            jobs.work(once=True)
+
+        # a no longer needs d suggested, and c already follows d.
+        self.assertEqual(self.stored('a'), [(self.ids['e'], 1)])
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids['e']
+            c.post(f"/users/follow/{self.ids['b']}")
+
+        with app.app_context():
+            jobs.work(once=True)
+
+        # e now reaches d through b, and c (who follows e) reaches b.
+        self.assertEqual(self.stored('e'), [(self.ids['d'], 1)])
+        self.assertEqual(self.stored('c'), [(self.ids['b'], 2)])
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids['e']
+            c.post(f"/users/stop-following/{self.ids['b']}")
+
+        with app.app_context():
+            jobs.work(once=True)
+
+        self.assertEqual(self.stored('e'), [])
+        self.assertEqual(self.stored('c'), [(self.ids['b'], 1)])
+
+    def test_show(self):
+        """Are suggestions shown, leaving out users already followed?"""
+
+        with app.app_context():
+            suggestions.rebuild_all()
+            db.session.commit()
+        db.session.add(Follows(user_following_id=self.ids['a'],
+                               user_being_followed_id=self.ids['e']))
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids['a']
+            resp = c.get("/users/suggestions")
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@d", html)
+        self.assertNotIn("@e", html)
+
+    def test_show_logged_out(self):
+        with app.test_client() as c:
+            resp = c.get("/users/suggestions")
+
+        self.assertEqual(resp.status_code, 302)
@@ -0,0 +1,142 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app
+from unittest import TestCase
+from models import db, User, Message, Follows, TimelineEntry
+import counters
+import timeline
+
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+PASSWORD = "Password"
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out and reading of home timelines."""
+
+    def setUp(self):
+        """Create three users where u1 follows u2."""
+
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.u1 = User.signup(
+            "uniqueusername1", "uniqueemail1@email.com", PASSWORD, None)
+        self.u2 = User.signup(
+            "uniqueusername2", "uniqueemail2@email.com", PASSWORD, None)
+        self.u3 = User.signup(
+            "uniqueusername3", "uniqueemail3@email.com", PASSWORD, None)
+        db.session.commit()
+
+        self.u1.following.append(self.u2)
+        db.session.flush()
+        counters.follows_changed({self.u1.id: 1}, {self.u2.id: 1})
+        db.session.commit()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 10000
+        app.config['TIMELINE_MAX_ENTRIES'] = 800
+        app.config['TIMELINE_TRIM_EVERY'] = 100
+        self.ctx.pop()
+
+    def post(self, user, text):
+        msg = Message(text=text, user_id=user.id)
+        db.session.add(msg)
+        db.session.flush()
+        timeline.fan_out(msg)
+        db.session.commit()
+        return msg
+
+    def test_fan_out(self):
+        """Does posting copy the message to followers only?"""
+
+        msg = self.post(self.u2, "hello")
+
+        self.assertEqual(timeline.home_timeline(self.u1.id).items, [msg])
+        self.assertEqual(timeline.home_timeline(self.u3.id).items, [])
+
+    def test_remove_message(self):
+        """Does deleting a message remove it from timelines?"""
+
+        msg = self.post(self.u2, "hello")
+        timeline.remove_message(msg)
+        db.session.commit()
+
+        self.assertEqual(timeline.home_timeline(self.u1.id).items, [])
+
+    def test_follow_and_unfollow(self):
+        """Are follows backfilled and unfollows removed?"""
+
+        msg = self.post(self.u3, "hello")
+
+        self.u1.following.append(self.u3)
+        timeline.backfill_follow(self.u1.id, self.u3.id)
+        db.session.commit()
+        self.assertEqual(timeline.home_timeline(self.u1.id).items, [msg])
+
+        timeline.remove_follow(self.u1.id, self.u3.id)
+        db.session.commit()
+        self.assertEqual(timeline.home_timeline(self.u1.id).items, [])
+
+    def test_trim(self):
+        """Are timelines bounded to TIMELINE_MAX_ENTRIES?"""
+
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+        msgs = [self.post(self.u2, f"hello {i}") for i in range(3)]
+
+        timeline.trim(self.u1.id)
+        db.session.commit()
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.u1.id).count(), 2)
+        self.assertNotIn(msgs[0], timeline.home_timeline(self.u1.id).items)
+
+    def test_fan_out_trims(self):
+        """Does fan-out keep timelines bounded without trim-timelines?"""
+
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+        app.config['TIMELINE_TRIM_EVERY'] = 1
+        self.u3.following.append(self.u2)
+        db.session.commit()
+
+        msgs = [self.post(self.u2, f"hello {i}") for i in range(5)]
+
+        for user in (self.u1, self.u3):
+            self.assertEqual(
+                [msg.id for msg in timeline.home_timeline(user.id).items],
+                [msg.id for msg in msgs[:2:-1]])
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=user.id).count(), 2)
+
+    def test_high_fanout_merged_at_read(self):
+        """Are high-fanout accounts merged in instead of fanned out?"""
+
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 0
+        msg = self.post(self.u2, "hello")
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+        self.assertEqual(timeline.home_timeline(self.u1.id).items, [msg])
@@ -0,0 +1,198 @@
+"""Trending tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+import os
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Now we can import app
+from app import app, CURR_USER_KEY
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import (db, User, Message, Follows, Like, TimelineEntry,
+                    TrendingDecay, TrendingScore)
+import likes
+import timeline
+import trending
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+PASSWORD = "Password"
+
+
+class TrendingTestCase(TestCase):
+    """Test scoring, decaying and showing trending messages."""
+
+    def setUp(self):
+        """Create three users; u1 follows u2, who has posted three
+        messages."""
+
+        TrendingDecay.query.delete()
+        TrendingScore.query.delete()
+        TimelineEntry.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        users = [User.signup(f"user{n}", f"user{n}@email.com", PASSWORD, None)
+                 for n in range(3)]
+        db.session.commit()
+        self.user_ids = [user.id for user in users]
+        users[0].following.append(users[1])
+
+        messages = [Message(text=f"message {n}", user_id=users[1].id)
+                    for n in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.msg_ids = [msg.id for msg in messages]
+
+        with app.app_context():
+            timeline.rebuild_all()
+            db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def like(self, user, msg, liked=True):
+        with app.app_context():
+            likes.toggle(self.user_ids[user], self.msg_ids[msg], liked)
+
+    def scores(self):
+        db.session.expire_all()
+        return {self.msg_ids.index(score.message_id): score.score
+                for score in TrendingScore.query}
+
+    def test_likes_score(self):
+        """Do likes and unlikes move scores?"""
+
+        self.like(0, 0)
+        self.like(1, 0)
+        self.like(0, 1)
+        self.assertEqual(self.scores(), {0: 2, 1: 1})
+
+        self.like(0, 0, False)
+        self.like(0, 0, False)
+        self.assertEqual(self.scores(), {0: 1, 1: 1})
+
+    def test_buffered_likes_score(self):
+        """Do likes written by the buffer move scores once per message?"""
+
+        with app.app_context():
+            likes.write_batch({(self.user_ids[0], self.msg_ids[0]): True,
+                               (self.user_ids[1], self.msg_ids[0]): True})
+        self.assertEqual(self.scores(), {0: 2})
+
+    def test_decay(self):
+        """Do scores halve each half-life, and stop trending when small?"""
+
+        self.like(0, 0)
+        self.like(1, 0)
+        self.like(0, 1)
+
+        with app.app_context():
+            dropped = trending.decay(trending.half_life())
+            db.session.commit()
+        self.assertEqual(dropped, 0)
+        self.assertEqual(self.scores(), {0: 1, 1: 0.5})
+
+        with app.app_context():
+            dropped = trending.decay(trending.half_life() * 4)
+            db.session.commit()
+        self.assertEqual(dropped, 1)
+        self.assertEqual(self.scores(), {0: 1 / 16})
+
+    def test_decay_by_elapsed_time(self):
+        """Does decay go by the time since it last ran, so late or
+        repeated runs don't skew scores?"""
+
+        self.like(0, 0)
+
+        with app.app_context():
+            trending.decay()
+            db.session.commit()
+            first = trending.weight(trending.decay_interval())
+            half_life = trending.half_life()
+        self.assertAlmostEqual(self.scores()[0], first)
+
+        with app.app_context():
+            last = TrendingDecay.query.get(1)
+            last.decayed_at -= half_life * 2
+            db.session.commit()
+            start = self.scores()[0]
+
+            trending.decay()
+            db.session.commit()
+        self.assertAlmostEqual(self.scores()[0], start / 4, places=3)
+
+        with app.app_context():
+            trending.decay()
+            db.session.commit()
+        self.assertAlmostEqual(self.scores()[0], start / 4, places=3)
+
+    def test_rebuild(self):
+        """Are scores recomputed from the likes' ages?"""
+
+        self.like(0, 0)
+        self.like(1, 0)
+        self.like(0, 1)
+        self.like(0, 2)
+
+        with app.app_context():
+            like = Like.query.filter_by(message_id=self.msg_ids[1]).one()
+            like.timestamp = datetime.utcnow() - trending.half_life()
+            old = Like.query.filter_by(message_id=self.msg_ids[2]).one()
+            old.timestamp = datetime.utcnow() - timedelta(days=30)
+            db.session.commit()
+
+            trending.rebuild()
+            db.session.commit()
+
+        scores = self.scores()
+        self.assertEqual(sorted(scores), [0, 1])
+        self.assertAlmostEqual(scores[0], 2, places=3)
+        self.assertAlmostEqual(scores[1], 0.5, places=3)
+
+    def test_top(self):
+        """Are trending messages best first, like the naive count?"""
+
+        self.like(0, 2)
+        self.like(1, 2)
+        self.like(0, 1)
+
+        with app.app_context():
+            top = [msg.id for msg in trending.top()]
+            naive = [msg.id for msg in trending.naive_top()]
+
+        self.assertEqual(top, [self.msg_ids[2], self.msg_ids[1]])
+        self.assertEqual(naive, top)
+
+    def test_show(self):
+        self.like(0, 1)
+
+        with app.test_client() as c:
+            resp = c.get("/trending")
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("message 1", html)
+        self.assertNotIn("message 0", html)
+        self.assertIn("public", resp.headers['Cache-Control'])
+
+    def test_homepage_ranked(self):
+        """Does the ranked homepage put the most liked messages first?"""
+
+        self.like(1, 0)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[0]
+            latest = c.get("/").get_data(as_text=True)
+            ranked = c.get("/?ranked=1").get_data(as_text=True)
+
+        self.assertLess(latest.index("message 2"), latest.index("message 0"))
+        self.assertLess(ranked.index("message 0"), ranked.index("message 2"))
@@ -19,6 +19,7 @@ from app import app
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
 from models import db, User, Message, Follows
+import counters
 # from psycopg2 import IntegrityError
 
 
@@ -130,3 +131,18 @@ class UserModelTestCase(TestCase):
 
         self.assertFalse(authentication)
 
+    def test_stats(self):
+        """Does stats() count messages, follows and likes?"""
+
+        self.u1.following.append(self.u2)
+        self.u3.following.append(self.u1)
+        msg = Message(text="hello")
+        self.u1.messages.append(msg)
+        db.session.flush()
+        counters.follows_changed({self.u1.id: 1, self.u3.id: 1},
+                                 {self.u2.id: 1, self.u1.id: 1})
+        counters.message_added(msg)
+        db.session.commit()
+
+        self.assertEqual(self.u1.stats(), {
+            'messages': 1, 'following': 1, 'followers': 1, 'likes': 0})
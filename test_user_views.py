@@ -16,8 +16,10 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 from app import app, CURR_USER_KEY
 from unittest import TestCase
+from sqlalchemy import event
 
 from models import db, connect_db, Message, User
+import jobs
 
 
 # Create our tables (we do this here, so we only create the tables
@@ -70,3 +72,63 @@ class UserViewTestCase(TestCase):
             msg = Message.query.one()
             self.assertEqual(msg.text, "Hello")
 
+    def test_home_query_count(self):
+        """Does the home page issue the same number of queries for any
+        number of messages?"""
+
+        def count_queries(url):
+            """(queries issued, messages shown) for `url`."""
+
+            queries = []
+
+            def record(*args):
+                queries.append(args)
+
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                resp = c.get(url)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.get_data(as_text=True)
+            return len(queries), html.count('class="message-link"')
+
+        def post_as(user_id, text):
+            with app.test_client() as other_client:
+                with other_client.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+                other_client.post("/messages/new", data={"text": text})
+            # Messages reach timelines through the job queue.
+            with app.app_context():
+                jobs.work(once=True)
+
+        testuser_id = self.testuser.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = testuser_id
+
+            author = User.signup(username="author1",
+                                 email="author1@test.com",
+                                 password="author1",
+                                 image_url=None)
+            db.session.commit()
+            author_id = author.id
+            c.post(f"/users/follow/{author_id}")
+
+            post_as(author_id, "Hello")
+            one_message, shown = count_queries("/")
+            self.assertEqual(shown, 1)
+
+            for i in range(10):
+                other = User.signup(username=f"other{i}",
+                                    email=f"other{i}@test.com",
+                                    password="password",
+                                    image_url=None)
+                db.session.commit()
+                other_id = other.id
+                c.post(f"/users/follow/{other_id}")
+                post_as(other_id, f"Hello {i}")
+
+            self.assertEqual(count_queries("/"), (one_message, 11))
@@ -0,0 +1,312 @@
+"""Materialized home timelines for Warbler.
+
+Posting a message copies its id into the ``timeline_entries`` of every
+follower (fan-out-on-write), so reading the home page is one indexed range
+read instead of an ``IN`` query over everyone the user follows. The copy
+is a queued 'fan_out' job (see jobs.py), so posting doesn't wait on it.
+
+Timelines are trimmed back to ``TIMELINE_MAX_ENTRIES`` when a follow is
+backfilled, and by fan-out: every ``TIMELINE_TRIM_EVERY``-th message (by
+id) trims its author's followers' timelines in one statement as it's
+fanned out. Message ids are shared by every author, so each timeline is
+trimmed about once per that many entries it receives, and never holds
+many more than ``TIMELINE_MAX_ENTRIES + TIMELINE_TRIM_EVERY``, at a
+fraction of the cost of trimming on every message. ``flask
+trim-timelines`` trims everything at once, e.g. after lowering the
+limit.
+
+Accounts with more followers than ``TIMELINE_FANOUT_THRESHOLD`` are not
+fanned out; their recent messages are merged in when the timeline is read.
+
+None of these functions commit; callers commit along with the change that
+triggered them so the timeline stays consistent with the source tables.
+"""
+
+import heapq
+
+from flask import current_app
+from sqlalchemy import and_, exists, literal, or_, select, tuple_
+
+from models import db, Follows, Message, TimelineEntry, User
+import jobs
+import pagination
+
+DEFAULT_MAX_ENTRIES = 800
+DEFAULT_FANOUT_THRESHOLD = 10000
+DEFAULT_TRIM_EVERY = 100
+
+
+def max_entries():
+    """Number of entries kept per user timeline."""
+
+    return current_app.config.get('TIMELINE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+
+
+def trim_every():
+    """About how many fanned-out messages each timeline gets between
+    trims."""
+
+    return current_app.config.get('TIMELINE_TRIM_EVERY', DEFAULT_TRIM_EVERY)
+
+
+def fanout_threshold():
+    """Follower count above which a user is merged in at read time."""
+
+    return current_app.config.get('TIMELINE_FANOUT_THRESHOLD',
+                                  DEFAULT_FANOUT_THRESHOLD)
+
+
+def is_high_fanout(user_id):
+    """Is `user_id` followed by too many users to fan out on write?"""
+
+    followers_count = (db.session
+                       .query(User.followers_count)
+                       .filter(User.id == user_id)
+                       .scalar())
+    return (followers_count or 0) > fanout_threshold()
+
+
+def fan_out(message):
+    """Add a newly posted `message` to its author's followers' timelines,
+    trimming them if it's a `trim_every()`-th message.
+
+    The message must already be flushed so it has an id. Followers who
+    already have it (from backfilling a follow) are skipped.
+    """
+
+    if is_high_fanout(message.user_id):
+        return
+
+    entries = TimelineEntry.__table__
+    has_entry = exists().where(and_(
+        TimelineEntry.user_id == Follows.user_following_id,
+        TimelineEntry.message_id == message.id))
+    followers = (select([Follows.user_following_id,
+                         literal(message.id),
+                         literal(message.user_id),
+                         literal(message.timestamp)])
+                 .where(and_(Follows.user_being_followed_id == message.user_id,
+                             ~has_entry)))
+
+    db.session.execute(entries.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'], followers))
+
+    if message.id % trim_every() == 0:
+        trim_followers(message.user_id)
+
+
+@jobs.handler('fan_out')
+def fan_out_messages(payloads):
+    """Fan out the messages with the queued `message_id`s that still
+    exist."""
+
+    ids = [payload['message_id'] for payload in payloads]
+    for message in Message.query.filter(Message.id.in_(ids)):
+        fan_out(message)
+
+
+def remove_message(message):
+    """Remove a deleted `message` from every timeline holding it."""
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.message_id == message.id)
+     .delete(synchronize_session=False))
+
+
+def backfill_follow(follower_id, followed_id):
+    """Copy `followed_id`'s recent messages into `follower_id`'s timeline.
+
+    Messages already there (fanned out since the follow) are skipped.
+    """
+
+    if is_high_fanout(followed_id):
+        return
+
+    entries = TimelineEntry.__table__
+    has_entry = exists().where(and_(
+        TimelineEntry.user_id == follower_id,
+        TimelineEntry.message_id == Message.id))
+    recent = (select([literal(follower_id),
+                      Message.id,
+                      Message.user_id,
+                      Message.timestamp])
+              .where(and_(Message.user_id == followed_id, ~has_entry))
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(max_entries()))
+
+    db.session.execute(entries.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'], recent))
+    trim(follower_id)
+
+
+def remove_follow(follower_id, followed_id):
+    """Drop `followed_id`'s messages from `follower_id`'s timeline."""
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.author_id == followed_id)
+     .delete(synchronize_session=False))
+
+
+def trim(user_id):
+    """Delete everything past the newest `max_entries()` for `user_id`."""
+
+    cutoff = (db.session
+              .query(TimelineEntry.timestamp, TimelineEntry.message_id)
+              .filter(TimelineEntry.user_id == user_id)
+              .order_by(TimelineEntry.timestamp.desc(),
+                        TimelineEntry.message_id.desc())
+              .offset(max_entries())
+              .limit(1)
+              .first())
+
+    if cutoff is None:
+        return
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == user_id,
+             or_(TimelineEntry.timestamp < cutoff.timestamp,
+                 and_(TimelineEntry.timestamp == cutoff.timestamp,
+                      TimelineEntry.message_id <= cutoff.message_id)))
+     .delete(synchronize_session=False))
+
+
+def trim_followers(author_id):
+    """Trim the timelines of everyone following `author_id` to
+    `max_entries()`, with one statement."""
+
+    follower_ids = (select([Follows.user_following_id])
+                    .where(Follows.user_being_followed_id == author_id))
+    rank = (db.func.row_number()
+            .over(partition_by=TimelineEntry.user_id,
+                  order_by=(TimelineEntry.timestamp.desc(),
+                            TimelineEntry.message_id.desc()))
+            .label('rank'))
+    ranked = (select([TimelineEntry.user_id, TimelineEntry.message_id, rank])
+              .where(TimelineEntry.user_id.in_(follower_ids))
+              .alias('ranked'))
+    past_limit = (select([ranked.c.user_id, ranked.c.message_id])
+                  .where(ranked.c.rank > max_entries()))
+
+    db.session.execute(TimelineEntry.__table__.delete().where(
+        tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+        .in_(past_limit)))
+
+
+def trim_all():
+    """Trim every timeline that has grown past `max_entries()`."""
+
+    overfull = (db.session
+                .query(TimelineEntry.user_id)
+                .group_by(TimelineEntry.user_id)
+                .having(db.func.count() > max_entries())
+                .all())
+
+    for (user_id,) in overfull:
+        trim(user_id)
+
+    return len(overfull)
+
+
+def rebuild(user_id):
+    """Rebuild `user_id`'s timeline from scratch out of `follows`."""
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == user_id)
+     .delete(synchronize_session=False))
+
+    followed_ids = [followed_id for (followed_id,) in db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == user_id)]
+
+    for followed_id in followed_ids:
+        backfill_follow(user_id, followed_id)
+
+
+def rebuild_all():
+    """Rebuild every user's timeline with one set-based statement."""
+
+    TimelineEntry.query.delete(synchronize_session=False)
+
+    rank = (db.func.row_number()
+            .over(partition_by=Follows.user_following_id,
+                  order_by=(Message.timestamp.desc(), Message.id.desc()))
+            .label('rank'))
+    sources = (Follows.__table__
+               .join(Message.__table__,
+                     Message.user_id == Follows.user_being_followed_id)
+               .join(User.__table__,
+                     User.id == Follows.user_being_followed_id))
+    candidates = (select([Follows.user_following_id.label('user_id'),
+                          Message.id.label('message_id'),
+                          Message.user_id.label('author_id'),
+                          Message.timestamp.label('timestamp'),
+                          rank])
+                  .select_from(sources)
+                  .where(User.followers_count <= fanout_threshold())
+                  .alias('candidates'))
+    newest = (select([candidates.c.user_id,
+                      candidates.c.message_id,
+                      candidates.c.author_id,
+                      candidates.c.timestamp])
+              .where(candidates.c.rank <= max_entries()))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'], newest))
+
+
+def high_fanout_followed_ids(user_id):
+    """Ids followed by `user_id` that are merged in at read time."""
+
+    rows = (db.session
+            .query(Follows.user_being_followed_id)
+            .join(User, User.id == Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id,
+                    User.followers_count > fanout_threshold())
+            .all())
+
+    return [followed_id for (followed_id,) in rows]
+
+
+def home_timeline(user_id, before=None, after=None, limit=None,
+                  messages=Message.with_authors):
+    """One keyset page of `user_id`'s home timeline, newest first.
+
+    `before` and `after` are decoded cursors (see pagination.py).
+    `messages` makes the query the page's rows are read with; it can
+    select columns instead of messages, as long as they include the
+    message's `id` and `timestamp`.
+    """
+
+    fanned_out = pagination.fetch(
+        (messages()
+         .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+         .filter(TimelineEntry.user_id == user_id)),
+        TimelineEntry.timestamp, TimelineEntry.message_id,
+        before, after, limit)
+
+    high_fanout_ids = high_fanout_followed_ids(user_id)
+    if not high_fanout_ids:
+        return pagination.make_page(fanned_out, before, after, limit)
+
+    merged_in = pagination.fetch(
+        messages().filter(Message.user_id.in_(high_fanout_ids)),
+        Message.timestamp, Message.id,
+        before, after, limit)
+
+    wanted = (limit or pagination.per_page()) + 1
+    rows = []
+    seen = set()
+    for msg in heapq.merge(fanned_out, merged_in,
+                           key=pagination.message_key, reverse=not after):
+        if msg.id not in seen:
+            seen.add(msg.id)
+            rows.append(msg)
+        if len(rows) == wanted:
+            break
+
+    return pagination.make_page(rows, before, after, limit)
@@ -0,0 +1,201 @@
+"""Trending messages: ranked by a time-decayed count of recent likes.
+
+Each like adds 1 to its message's score in the trending table and each
+unlike takes 1 away, as part of the like's own transaction (see
+likes.py). ``flask decay-trending``, run every TRENDING_DECAY_MINUTES,
+multiplies every score by the decay over the time since it last ran,
+recorded in the trending_decay table, so a like counts half as much
+after TRENDING_HALF_LIFE_HOURS however often it actually runs, and
+drops messages whose scores fall below TRENDING_MIN_SCORE. The table
+thus only holds messages liked lately, and `top` reads the best of them
+through the index on `score` instead of counting likes per request like
+`naive_top`.
+
+An unlike takes away a whole like, though the like it undoes may have
+decayed; `rebuild` recomputes every score from the likes table.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import (db, insert_ignoring_duplicates, Like, Message,
+                    TrendingDecay, TrendingScore)
+
+DEFAULT_HALF_LIFE_HOURS = 6
+DEFAULT_MIN_SCORE = 0.05
+DEFAULT_DECAY_MINUTES = 10
+DEFAULT_SIZE = 100
+
+
+def half_life():
+    """The time after which a like counts half as much, as a timedelta."""
+
+    return timedelta(hours=current_app.config.get(
+        'TRENDING_HALF_LIFE_HOURS', DEFAULT_HALF_LIFE_HOURS))
+
+
+def min_score():
+    """Score below which a message stops trending."""
+
+    return current_app.config.get('TRENDING_MIN_SCORE', DEFAULT_MIN_SCORE)
+
+
+def size():
+    """Number of trending messages shown."""
+
+    return current_app.config.get('TRENDING_SIZE', DEFAULT_SIZE)
+
+
+def decay_interval():
+    """How often `decay` is run, as a timedelta."""
+
+    return timedelta(minutes=current_app.config.get(
+        'TRENDING_DECAY_MINUTES', DEFAULT_DECAY_MINUTES))
+
+
+def window():
+    """How long a single like keeps a message trending."""
+
+    return half_life() * math.log2(1 / min_score())
+
+
+def weight(age):
+    """What a like made `age` (a timedelta) ago counts for."""
+
+    return 0.5 ** (age / half_life())
+
+
+def likes_changed(message_deltas):
+    """Apply the net change in likes of each message; doesn't commit.
+
+    `message_deltas` maps message ids to their net change in likes.
+    """
+
+    table = TrendingScore.__table__
+
+    for message_id, delta in message_deltas.items():
+        if not delta:
+            continue
+        if delta > 0:
+            db.session.execute(insert_ignoring_duplicates(table).values(
+                message_id=message_id, score=0))
+        (TrendingScore
+         .query
+         .filter(TrendingScore.message_id == message_id)
+         .update({TrendingScore.score: TrendingScore.score + delta},
+                 synchronize_session=False))
+
+
+def last_decayed():
+    """The trending_decay row, locked until commit so overlapping runs
+    of `decay` take turns; None before the first run."""
+
+    return TrendingDecay.query.with_for_update().get(1)
+
+
+def decayed(now):
+    """Record that scores are decayed up to `now`; doesn't commit."""
+
+    last = last_decayed()
+    if last is None:
+        db.session.add(TrendingDecay(id=1, decayed_at=now))
+    else:
+        last.decayed_at = now
+
+
+def decay(elapsed=None):
+    """Decay every score by `elapsed` (a timedelta, by default the time
+    since the last decay, or `decay_interval` the first time) and drop
+    the messages no longer trending; doesn't commit.
+
+    Returns the number of messages dropped.
+    """
+
+    now = datetime.utcnow()
+    if elapsed is None:
+        last = last_decayed()
+        elapsed = (now - last.decayed_at if last is not None
+                   else decay_interval())
+    decayed(now)
+
+    factor = weight(max(elapsed, timedelta(0)))
+    (TrendingScore
+     .query
+     .update({TrendingScore.score: TrendingScore.score * factor},
+             synchronize_session=False))
+
+    return (TrendingScore
+            .query
+            .filter(TrendingScore.score < min_score())
+            .delete(synchronize_session=False))
+
+
+def rebuild():
+    """Recompute every score from the likes made within `window`; doesn't
+    commit."""
+
+    now = datetime.utcnow()
+    scores = {}
+    for message_id, timestamp in (db.session
+                                  .query(Like.message_id, Like.timestamp)
+                                  .filter(Like.timestamp > now - window())):
+        scores[message_id] = (scores.get(message_id, 0)
+                              + weight(now - timestamp))
+
+    TrendingScore.query.delete(synchronize_session=False)
+    decayed(now)
+    rows = [{'message_id': message_id, 'score': score}
+            for message_id, score in scores.items()
+            if score >= min_score()]
+    if rows:
+        db.session.execute(TrendingScore.__table__.insert(), rows)
+
+
+def top(limit=None):
+    """The trending messages, best first."""
+
+    return (Message
+            .with_authors()
+            .join(TrendingScore, TrendingScore.message_id == Message.id)
+            .order_by(TrendingScore.score.desc(), Message.id.desc())
+            .limit(limit or size())
+            .all())
+
+
+def naive_top(limit=None):
+    """The messages most liked within `window`, counted from the likes
+    table on every call.
+
+    What `top` replaces; kept to benchmark it against.
+    """
+
+    since = datetime.utcnow() - window()
+    counts = (db.session
+              .query(Like.message_id, db.func.count().label('likes'))
+              .filter(Like.timestamp > since)
+              .group_by(Like.message_id)
+              .subquery())
+
+    return (Message
+            .with_authors()
+            .join(counts, counts.c.message_id == Message.id)
+            .order_by(counts.c.likes.desc(), Message.id.desc())
+            .limit(limit or size())
+            .all())
+
+
+def rank(messages):
+    """`messages` reordered by trending score, keeping their order among
+    equal scores."""
+
+    ids = [msg.id for msg in messages]
+    if not ids:
+        return messages
+
+    scores = dict(db.session
+                  .query(TrendingScore.message_id, TrendingScore.score)
+                  .filter(TrendingScore.message_id.in_(ids)))
+
+    return sorted(messages, key=lambda msg: -scores.get(msg.id, 0))